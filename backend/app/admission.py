@@ -0,0 +1,257 @@
+"""Admission control for the runs executed in this process.
+
+A run starts once its user has fewer than ADMISSION_USER_CONCURRENCY runs going
+and the token bucket of its LLM has a token. Buckets refill at
+ADMISSION_LLM_RATE runs a second up to ADMISSION_LLM_BURST, and can be set per
+LLM type with ADMISSION_LLM_LIMITS, e.g. '{"GPT 4 Turbo": [1, 5]}'.
+
+Runs that can't start right away wait in a weighted fair queue, so a user with
+many waiting runs doesn't hold back users with few. Runs are rejected when the
+queue holds ADMISSION_QUEUE_SIZE runs, or ADMISSION_USER_QUEUE_SIZE runs of the
+user, or after waiting for ADMISSION_TIMEOUT seconds.
+"""
+import asyncio
+import bisect
+import math
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Mapping, Optional
+
+import orjson
+
+from app.agent import AgentType
+from app.metrics import counter, gauge, histogram
+
+_queue_depth = gauge("admission_queue_depth", "Runs waiting to start, by LLM.")
+_running = gauge("admission_running", "Runs admitted and not done yet, by LLM.")
+_wait_time = histogram(
+    "admission_wait_seconds",
+    "Time runs waited to start, by LLM.",
+    [0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60],
+)
+_rejections = counter("admission_rejections", "Runs rejected, by reason.")
+
+
+class Rejected(Exception):
+    """A run was not admitted, and should be retried after `retry_after`."""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(f"Run rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` takes a second on average, and up to `burst` at once."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until the next token."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    finish: float
+    """The virtual time the run would finish at, runs are started in its order."""
+    user_id: str
+    llm: str
+    enqueued: float
+    future: asyncio.Future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.finish < other.finish
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        *,
+        user_concurrency: int,
+        llm_limits: Mapping[str, tuple[float, float]],
+        default_llm_limit: tuple[float, float],
+        queue_size: int,
+        user_queue_size: int,
+        timeout: float,
+    ) -> None:
+        self.user_concurrency = user_concurrency
+        self.llm_limits = llm_limits
+        self.default_llm_limit = default_llm_limit
+        self.queue_size = queue_size
+        self.user_queue_size = user_queue_size
+        self.timeout = timeout
+        self._running: dict[str, int] = defaultdict(int)
+        self._buckets: dict[str, TokenBucket] = {}
+        self._waiting: list[_Waiter] = []
+        self._waiting_by_user: dict[str, int] = defaultdict(int)
+        self._last_finish: dict[str, float] = {}
+        self._vtime = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _bucket(self, llm: str) -> TokenBucket:
+        if llm not in self._buckets:
+            self._buckets[llm] = TokenBucket(
+                *self.llm_limits.get(llm, self.default_llm_limit)
+            )
+        return self._buckets[llm]
+
+    def _can_start(self, user_id: str, llm: str, now: float) -> bool:
+        return self._running[user_id] < self.user_concurrency and self._bucket(
+            llm
+        ).ready(now)
+
+    def _start(self, user_id: str, llm: str, now: float) -> Callable[[], None]:
+        self._bucket(llm).take(now)
+        self._running[user_id] += 1
+        _running.inc(llm=llm)
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._running[user_id] -= 1
+                _running.dec(llm=llm)
+                self._schedule()
+
+        return release
+
+    def _retry_after(self, llm: str, now: float) -> int:
+        bucket = self._bucket(llm)
+        wait = bucket.wait_time(now) + len(self._waiting) / bucket.rate
+        return max(1, min(60, math.ceil(wait)))
+
+    def _reject(self, reason: str, llm: str, now: float) -> Rejected:
+        _rejections.inc(reason=reason)
+        return Rejected(reason, self._retry_after(llm, now))
+
+    async def admit(
+        self, user_id: str, llm: str, weight: float = 1
+    ) -> Callable[[], None]:
+        """Wait for a run to be allowed to start.
+
+        Returns a function to call once the run is done. Raises Rejected if the
+        queue is full or the run waited too long.
+        """
+        now = time.monotonic()
+        if not self._waiting and self._can_start(user_id, llm, now):
+            _wait_time.observe(0, llm=llm)
+            return self._start(user_id, llm, now)
+        if len(self._waiting) >= self.queue_size:
+            raise self._reject("queue_full", llm, now)
+        if self._waiting_by_user[user_id] >= self.user_queue_size:
+            raise self._reject("user_queue_full", llm, now)
+
+        finish = max(self._vtime, self._last_finish.get(user_id, 0)) + 1 / weight
+        self._last_finish[user_id] = finish
+        waiter = _Waiter(
+            finish, user_id, llm, now, asyncio.get_running_loop().create_future()
+        )
+        bisect.insort(self._waiting, waiter)
+        self._waiting_by_user[user_id] += 1
+        _queue_depth.inc(llm=llm)
+        # Others may be waiting on their user or LLM only.
+        self._schedule()
+        timeout = asyncio.get_running_loop().call_later(
+            self.timeout, self._expire, waiter
+        )
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if (
+                waiter.future.done()
+                and not waiter.future.cancelled()
+                and waiter.future.exception() is None
+            ):
+                # Admitted just as the caller went away.
+                waiter.future.result()()
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            timeout.cancel()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter in self._waiting:
+            self._waiting.remove(waiter)
+            self._waiting_by_user[waiter.user_id] -= 1
+            _queue_depth.dec(llm=waiter.llm)
+
+    def _expire(self, waiter: _Waiter) -> None:
+        if not waiter.future.done():
+            self._remove(waiter)
+            waiter.future.set_exception(
+                self._reject("timeout", waiter.llm, time.monotonic())
+            )
+
+    def _schedule(self) -> None:
+        """Start the waiting runs that can start, in order of finish time."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        refill: Optional[float] = None
+        for waiter in list(self._waiting):
+            if self._can_start(waiter.user_id, waiter.llm, now):
+                self._remove(waiter)
+                self._vtime = waiter.finish
+                _wait_time.observe(now - waiter.enqueued, llm=waiter.llm)
+                waiter.future.set_result(self._start(waiter.user_id, waiter.llm, now))
+            elif self._running[waiter.user_id] < self.user_concurrency:
+                # Waiting on the bucket of its LLM, rather than on its user.
+                wait = self._bucket(waiter.llm).wait_time(now)
+                refill = wait if refill is None else min(refill, wait)
+        if not self._waiting:
+            # Restart virtual time so that it doesn't grow without bounds.
+            self._vtime = 0.0
+            self._last_finish.clear()
+        elif refill is not None:
+            self._timer = asyncio.get_running_loop().call_later(refill, self._schedule)
+
+
+def llm_type(config: Mapping[str, Any]) -> str:
+    """The LLM type, or agent type, a run of the agent is configured with."""
+    configurable = config.get("configurable", {})
+    bot_type = configurable.get("type", "agent")
+    field = "agent_type" if bot_type == "agent" else "llm_type"
+    return str(
+        configurable.get(f"type=={bot_type}/{field}", AgentType.GPT_35_TURBO.value)
+    )
+
+
+def _llm_limits() -> dict[str, tuple[float, float]]:
+    limits = orjson.loads(os.environ.get("ADMISSION_LLM_LIMITS", "{}"))
+    return {llm: (float(rate), float(burst)) for llm, (rate, burst) in limits.items()}
+
+
+controller = AdmissionController(
+    user_concurrency=int(os.environ.get("ADMISSION_USER_CONCURRENCY", 4)),
+    llm_limits=_llm_limits(),
+    default_llm_limit=(
+        float(os.environ.get("ADMISSION_LLM_RATE", 5)),
+        float(os.environ.get("ADMISSION_LLM_BURST", 10)),
+    ),
+    queue_size=int(os.environ.get("ADMISSION_QUEUE_SIZE", 200)),
+    user_queue_size=int(os.environ.get("ADMISSION_USER_QUEUE_SIZE", 20)),
+    timeout=float(os.environ.get("ADMISSION_TIMEOUT", 30)),
+)
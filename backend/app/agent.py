@@ -1,9 +1,14 @@
+import hashlib
+import os
 from enum import Enum
 from typing import Any, Mapping, Optional, Sequence, Union
 
+import orjson
+from langchain.pydantic_v1 import BaseModel
 from langchain_core.messages import AnyMessage
 from langchain_core.runnables import (
     ConfigurableField,
+    Runnable,
     RunnableBinding,
 )
 from langgraph.checkpoint import CheckpointAt
@@ -11,17 +16,20 @@ from langgraph.checkpoint import CheckpointAt
 from app.agent_types.google_agent import get_google_agent_executor
 from app.agent_types.openai_agent import get_openai_agent_executor
 from app.agent_types.xml_agent import get_xml_agent_executor
+from app.cache import LRUCache
 from app.chatbot import get_chatbot_executor
 from app.checkpoint import PostgresCheckpoint
+from app.context_window import CONTEXT_WINDOW_TOKENS
 from app.llms import (
     get_anthropic_llm,
     get_google_llm,
     get_mixtral_fireworks,
     get_openai_llm,
 )
-from app.retrieval import get_retrieval_executor
+from app.retrieval import RETRIEVAL_SPECULATION, get_retrieval_executor
 from app.tools import (
     RETRIEVAL_DESCRIPTION,
+    TOOL_CACHE_TTL,
     TOOLS,
     ActionServer,
     Arxiv,
@@ -34,11 +42,12 @@ from app.tools import (
     SecFilings,
     Tavily,
     TavilyAnswer,
+    ThreadRetrievalTool,
+    ThreadRetriever,
     Wikipedia,
     YouSearch,
-    get_retrieval_tool,
-    get_retriever,
 )
+from app.upload import vstore
 
 Tool = Union[
     ActionServer,
@@ -69,42 +78,99 @@ DEFAULT_SYSTEM_MESSAGE = "You are a helpful assistant."
 
 CHECKPOINTER = PostgresCheckpoint(at=CheckpointAt.END_OF_STEP)
 
+CONTEXT_WINDOW_FIELD = ConfigurableField(
+    id="context_window_tokens",
+    name="Context Window (tokens)",
+    description="The most tokens of the conversation to send the LLM, the latest messages that fit. Defaults to what suits the model.",
+)
+
+# Compiled executors, shared by every run with the same configuration. Per-run
+# values like the thread ID reach them through the `configurable` config. They
+# expire with the tools they hold.
+_executors: LRUCache[Runnable] = LRUCache(
+    "executors", int(os.environ.get("EXECUTOR_CACHE_SIZE", 128)), ttl=TOOL_CACHE_TTL
+)
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _executor_key(*parts: Any) -> str:
+    """A hash of the parts that doesn't depend on the order of dict keys."""
+    return hashlib.sha256(
+        orjson.dumps(parts, default=_json_default, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
+
 
 def get_agent_executor(
     tools: list,
     agent: AgentType,
     system_message: str,
     interrupt_before_action: bool,
+    max_tokens: Optional[int] = None,
 ):
     if agent == AgentType.GPT_35_TURBO:
         llm = get_openai_llm()
         return get_openai_agent_executor(
-            tools, llm, system_message, interrupt_before_action, CHECKPOINTER
+            tools,
+            llm,
+            system_message,
+            interrupt_before_action,
+            CHECKPOINTER,
+            max_tokens,
         )
     elif agent == AgentType.GPT_4:
         llm = get_openai_llm(gpt_4=True)
         return get_openai_agent_executor(
-            tools, llm, system_message, interrupt_before_action, CHECKPOINTER
+            tools,
+            llm,
+            system_message,
+            interrupt_before_action,
+            CHECKPOINTER,
+            max_tokens,
         )
     elif agent == AgentType.AZURE_OPENAI:
         llm = get_openai_llm(azure=True)
         return get_openai_agent_executor(
-            tools, llm, system_message, interrupt_before_action, CHECKPOINTER
+            tools,
+            llm,
+            system_message,
+            interrupt_before_action,
+            CHECKPOINTER,
+            max_tokens,
         )
     elif agent == AgentType.CLAUDE2:
         llm = get_anthropic_llm()
         return get_xml_agent_executor(
-            tools, llm, system_message, interrupt_before_action, CHECKPOINTER
+            tools,
+            llm,
+            system_message,
+            interrupt_before_action,
+            CHECKPOINTER,
+            max_tokens,
         )
     elif agent == AgentType.BEDROCK_CLAUDE2:
         llm = get_anthropic_llm(bedrock=True)
         return get_xml_agent_executor(
-            tools, llm, system_message, interrupt_before_action, CHECKPOINTER
+            tools,
+            llm,
+            system_message,
+            interrupt_before_action,
+            CHECKPOINTER,
+            max_tokens,
         )
     elif agent == AgentType.GEMINI:
         llm = get_google_llm()
         return get_google_agent_executor(
-            tools, llm, system_message, interrupt_before_action, CHECKPOINTER
+            tools,
+            llm,
+            system_message,
+            interrupt_before_action,
+            CHECKPOINTER,
+            max_tokens,
         )
     else:
         raise ValueError("Unexpected agent type")
@@ -116,6 +182,7 @@ class ConfigurableAgent(RunnableBinding):
     system_message: str = DEFAULT_SYSTEM_MESSAGE
     retrieval_description: str = RETRIEVAL_DESCRIPTION
     interrupt_before_action: bool = False
+    context_window_tokens: Optional[int] = None
     assistant_id: Optional[str] = None
     thread_id: Optional[str] = None
     user_id: Optional[str] = None
@@ -130,37 +197,61 @@ class ConfigurableAgent(RunnableBinding):
         thread_id: Optional[str] = None,
         retrieval_description: str = RETRIEVAL_DESCRIPTION,
         interrupt_before_action: bool = False,
+        context_window_tokens: Optional[int] = None,
         kwargs: Optional[Mapping[str, Any]] = None,
         config: Optional[Mapping[str, Any]] = None,
         **others: Any,
     ) -> None:
         others.pop("bound", None)
-        _tools = []
-        for _tool in tools:
-            if _tool["type"] == AvailableTools.RETRIEVAL:
-                if assistant_id is None or thread_id is None:
-                    raise ValueError(
-                        "Both assistant_id and thread_id must be provided if Retrieval tool is used"
+        uses_retrieval = any(
+            _tool["type"] == AvailableTools.RETRIEVAL for _tool in tools
+        )
+        if uses_retrieval and (assistant_id is None or thread_id is None):
+            raise ValueError(
+                "Both assistant_id and thread_id must be provided if Retrieval tool is used"
+            )
+
+        def build() -> Runnable:
+            _tools = []
+            for _tool in tools:
+                if _tool["type"] == AvailableTools.RETRIEVAL:
+                    _tools.append(
+                        ThreadRetrievalTool(description=retrieval_description)
                     )
-                _tools.append(
-                    get_retrieval_tool(assistant_id, thread_id, retrieval_description)
-                )
-            else:
-                tool_config = _tool.get("config", {})
-                _returned_tools = TOOLS[_tool["type"]](**tool_config)
-                if isinstance(_returned_tools, list):
-                    _tools.extend(_returned_tools)
                 else:
-                    _tools.append(_returned_tools)
-        _agent = get_agent_executor(
-            _tools, agent, system_message, interrupt_before_action
+                    tool_config = _tool.get("config", {})
+                    _returned_tools = TOOLS[_tool["type"]](**tool_config)
+                    if isinstance(_returned_tools, list):
+                        _tools.extend(_returned_tools)
+                    else:
+                        _tools.append(_returned_tools)
+            _agent = get_agent_executor(
+                _tools,
+                agent,
+                system_message,
+                interrupt_before_action,
+                context_window_tokens or CONTEXT_WINDOW_TOKENS.get(agent),
+            )
+            return _agent.with_config({"recursion_limit": 50})
+
+        # The retrieval tool finds the assistant and thread of each call in its
+        # config, so runs on any thread share the executor.
+        key = _executor_key(
+            "agent",
+            agent,
+            system_message,
+            tools,
+            interrupt_before_action,
+            context_window_tokens,
+            retrieval_description if uses_retrieval else None,
         )
-        agent_executor = _agent.with_config({"recursion_limit": 50})
+        agent_executor = _executors.get_or_compute(key, build)
         super().__init__(
             tools=tools,
             agent=agent,
             system_message=system_message,
             retrieval_description=retrieval_description,
+            context_window_tokens=context_window_tokens,
             bound=agent_executor,
             kwargs=kwargs or {},
             config=config or {},
@@ -180,6 +271,7 @@ class LLMType(str, Enum):
 def get_chatbot(
     llm_type: LLMType,
     system_message: str,
+    max_tokens: Optional[int] = None,
 ):
     if llm_type == LLMType.GPT_35_TURBO:
         llm = get_openai_llm()
@@ -197,12 +289,13 @@ def get_chatbot(
         llm = get_mixtral_fireworks()
     else:
         raise ValueError("Unexpected llm type")
-    return get_chatbot_executor(llm, system_message, CHECKPOINTER)
+    return get_chatbot_executor(llm, system_message, CHECKPOINTER, max_tokens)
 
 
 class ConfigurableChatBot(RunnableBinding):
     llm: LLMType
     system_message: str = DEFAULT_SYSTEM_MESSAGE
+    context_window_tokens: Optional[int] = None
     user_id: Optional[str] = None
 
     def __init__(
@@ -210,16 +303,25 @@ class ConfigurableChatBot(RunnableBinding):
         *,
         llm: LLMType = LLMType.GPT_35_TURBO,
         system_message: str = DEFAULT_SYSTEM_MESSAGE,
+        context_window_tokens: Optional[int] = None,
         kwargs: Optional[Mapping[str, Any]] = None,
         config: Optional[Mapping[str, Any]] = None,
         **others: Any,
     ) -> None:
         others.pop("bound", None)
 
-        chatbot = get_chatbot(llm, system_message)
+        chatbot = _executors.get_or_compute(
+            _executor_key("chatbot", llm, system_message, context_window_tokens),
+            lambda: get_chatbot(
+                llm,
+                system_message,
+                context_window_tokens or CONTEXT_WINDOW_TOKENS.get(llm),
+            ),
+        )
         super().__init__(
             llm=llm,
             system_message=system_message,
+            context_window_tokens=context_window_tokens,
             bound=chatbot,
             kwargs=kwargs or {},
             config=config or {},
@@ -231,6 +333,7 @@ chatbot = (
     .configurable_fields(
         llm=ConfigurableField(id="llm_type", name="LLM Type"),
         system_message=ConfigurableField(id="system_message", name="Instructions"),
+        context_window_tokens=CONTEXT_WINDOW_FIELD,
     )
     .with_types(input_type=Sequence[AnyMessage], output_type=Sequence[AnyMessage])
 )
@@ -239,6 +342,7 @@ chatbot = (
 class ConfigurableRetrieval(RunnableBinding):
     llm_type: LLMType
     system_message: str = DEFAULT_SYSTEM_MESSAGE
+    context_window_tokens: Optional[int] = None
     assistant_id: Optional[str] = None
     thread_id: Optional[str] = None
     user_id: Optional[str] = None
@@ -248,6 +352,7 @@ class ConfigurableRetrieval(RunnableBinding):
         *,
         llm_type: LLMType = LLMType.GPT_35_TURBO,
         system_message: str = DEFAULT_SYSTEM_MESSAGE,
+        context_window_tokens: Optional[int] = None,
         assistant_id: Optional[str] = None,
         thread_id: Optional[str] = None,
         kwargs: Optional[Mapping[str, Any]] = None,
@@ -255,27 +360,47 @@ class ConfigurableRetrieval(RunnableBinding):
         **others: Any,
     ) -> None:
         others.pop("bound", None)
-        retriever = get_retriever(assistant_id, thread_id)
-        if llm_type == LLMType.GPT_35_TURBO:
-            llm = get_openai_llm()
-        elif llm_type == LLMType.GPT_4:
-            llm = get_openai_llm(gpt_4=True)
-        elif llm_type == LLMType.AZURE_OPENAI:
-            llm = get_openai_llm(azure=True)
-        elif llm_type == LLMType.CLAUDE2:
-            llm = get_anthropic_llm()
-        elif llm_type == LLMType.BEDROCK_CLAUDE2:
-            llm = get_anthropic_llm(bedrock=True)
-        elif llm_type == LLMType.GEMINI:
-            llm = get_google_llm()
-        elif llm_type == LLMType.MIXTRAL:
-            llm = get_mixtral_fireworks()
-        else:
-            raise ValueError("Unexpected llm type")
-        chatbot = get_retrieval_executor(llm, retriever, system_message, CHECKPOINTER)
+
+        def build() -> Runnable:
+            retriever = ThreadRetriever()
+            if llm_type == LLMType.GPT_35_TURBO:
+                llm = get_openai_llm()
+            elif llm_type == LLMType.GPT_4:
+                llm = get_openai_llm(gpt_4=True)
+            elif llm_type == LLMType.AZURE_OPENAI:
+                llm = get_openai_llm(azure=True)
+            elif llm_type == LLMType.CLAUDE2:
+                llm = get_anthropic_llm()
+            elif llm_type == LLMType.BEDROCK_CLAUDE2:
+                llm = get_anthropic_llm(bedrock=True)
+            elif llm_type == LLMType.GEMINI:
+                llm = get_google_llm()
+            elif llm_type == LLMType.MIXTRAL:
+                llm = get_mixtral_fireworks()
+            else:
+                raise ValueError("Unexpected llm type")
+            return get_retrieval_executor(
+                llm,
+                retriever,
+                system_message,
+                CHECKPOINTER,
+                speculative=RETRIEVAL_SPECULATION,
+                embeddings=vstore.embeddings,
+                max_tokens=context_window_tokens or CONTEXT_WINDOW_TOKENS.get(llm_type),
+            )
+
+        # The retriever finds the assistant and thread of each call in its
+        # config, so runs on any thread share the executor.
+        chatbot = _executors.get_or_compute(
+            _executor_key(
+                "chat_retrieval", llm_type, system_message, context_window_tokens
+            ),
+            build,
+        )
         super().__init__(
             llm_type=llm_type,
             system_message=system_message,
+            context_window_tokens=context_window_tokens,
             bound=chatbot,
             kwargs=kwargs or {},
             config=config or {},
@@ -287,6 +412,7 @@ chat_retrieval = (
     .configurable_fields(
         llm_type=ConfigurableField(id="llm_type", name="LLM Type"),
         system_message=ConfigurableField(id="system_message", name="Instructions"),
+        context_window_tokens=CONTEXT_WINDOW_FIELD,
         assistant_id=ConfigurableField(
             id="assistant_id", name="Assistant ID", is_shared=True
         ),
@@ -308,6 +434,7 @@ agent = (
     .configurable_fields(
         agent=ConfigurableField(id="agent_type", name="Agent Type"),
         system_message=ConfigurableField(id="system_message", name="Instructions"),
+        context_window_tokens=CONTEXT_WINDOW_FIELD,
         interrupt_before_action=ConfigurableField(
             id="interrupt_before_action",
             name="Tool Confirmation",
@@ -1,14 +1,15 @@
 import json
+from typing import Optional
 
-from langchain.schema.messages import FunctionMessage
 from langchain.tools import BaseTool
 from langchain_core.language_models.base import LanguageModelLike
-from langchain_core.messages import SystemMessage
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.message import MessageGraph
-from langgraph.prebuilt import ToolExecutor, ToolInvocation
+from langgraph.prebuilt import ToolInvocation
 
+from app.agent_types.tool_executor import ToolExecutor
+from app.context_window import fit_prompt
 from app.message_types import LiberalFunctionMessage
 
 
@@ -18,18 +19,17 @@ def get_google_agent_executor(
     system_message: str,
     interrupt_before_action: bool,
     checkpoint: BaseCheckpointSaver,
+    max_tokens: Optional[int] = None,
 ):
-    def _get_messages(messages):
-        msgs = []
-        for m in messages:
-            if isinstance(m, LiberalFunctionMessage):
-                _dict = m.dict()
-                _dict["content"] = str(_dict["content"])
-                m_c = FunctionMessage(**_dict)
-                msgs.append(m_c)
-            else:
-                msgs.append(m)
-        return [SystemMessage(content=system_message)] + msgs
+    async def _get_messages(messages, config):
+        system, messages = await fit_prompt(
+            system_message, messages, config, max_tokens
+        )
+        msgs = [
+            m.to_message() if isinstance(m, LiberalFunctionMessage) else m
+            for m in messages
+        ]
+        return [system] + msgs
 
     if tools:
         llm_with_tools = llm.bind(functions=tools)
@@ -49,7 +49,7 @@ def get_google_agent_executor(
             return "continue"
 
     # Define the function to execute tools
-    async def call_tool(messages):
+    async def call_tool(messages, config):
         # Based on the continue condition
         # we know the last message involves a function call
         last_message = messages[-1]
@@ -61,7 +61,7 @@ def get_google_agent_executor(
             ),
         )
         # We call the tool_executor and get back a response
-        response = await tool_executor.ainvoke(action)
+        response = await tool_executor.ainvoke(action, config)
         # We use the response to create a FunctionMessage
         function_message = LiberalFunctionMessage(content=response, name=action.tool)
         # We return a list, because this will get added to the existing list
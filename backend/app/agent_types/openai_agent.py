@@ -1,14 +1,16 @@
 import json
+from typing import Optional
 
 from langchain.tools import BaseTool
 from langchain.tools.render import format_tool_to_openai_tool
 from langchain_core.language_models.base import LanguageModelLike
-from langchain_core.messages import SystemMessage, ToolMessage
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.message import MessageGraph
-from langgraph.prebuilt import ToolExecutor, ToolInvocation
+from langgraph.prebuilt import ToolInvocation
 
+from app.agent_types.tool_executor import ToolExecutor
+from app.context_window import fit_prompt
 from app.message_types import LiberalToolMessage
 
 
@@ -18,19 +20,16 @@ def get_openai_agent_executor(
     system_message: str,
     interrupt_before_action: bool,
     checkpoint: BaseCheckpointSaver,
+    max_tokens: Optional[int] = None,
 ):
-    async def _get_messages(messages):
-        msgs = []
-        for m in messages:
-            if isinstance(m, LiberalToolMessage):
-                _dict = m.dict()
-                _dict["content"] = str(_dict["content"])
-                m_c = ToolMessage(**_dict)
-                msgs.append(m_c)
-            else:
-                msgs.append(m)
-
-        return [SystemMessage(content=system_message)] + msgs
+    async def _get_messages(messages, config):
+        system, messages = await fit_prompt(
+            system_message, messages, config, max_tokens
+        )
+        msgs = [
+            m.to_message() if isinstance(m, LiberalToolMessage) else m for m in messages
+        ]
+        return [system] + msgs
 
     if tools:
         llm_with_tools = llm.bind(tools=[format_tool_to_openai_tool(t) for t in tools])
@@ -50,7 +49,7 @@ def get_openai_agent_executor(
             return "continue"
 
     # Define the function to execute tools
-    async def call_tool(messages):
+    async def call_tool(messages, config):
         actions: list[ToolInvocation] = []
         # Based on the continue condition
         # we know the last message involves a function call
@@ -67,7 +66,7 @@ def get_openai_agent_executor(
                 )
             )
         # We call the tool_executor and get back a response
-        responses = await tool_executor.abatch(actions)
+        responses = await tool_executor.abatch(actions, config)
         # We use the response to create a ToolMessage
         tool_messages = [
             LiberalToolMessage(
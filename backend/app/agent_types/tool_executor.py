@@ -0,0 +1,173 @@
+"""Execution of the tools the agents call.
+
+Every call has a deadline of TOOL_TIMEOUT_SECONDS, which can be set per tool
+name with TOOL_TIMEOUTS, e.g. '{"arxiv": 60}'. Calls that miss it, including
+while waiting for a slot, return a message saying so for the model to react
+to, rather than holding up the run. Calls timing out while running end their
+tool run with a ToolTimeout, so that callbacks see them end.
+
+At most TOOL_CONCURRENCY calls run at a time in the process, and at most
+TOOL_CONCURRENCY_PER_TOOL calls of each tool, which can be set per tool name
+with TOOL_CONCURRENCY_LIMITS. Several calls emitted by the model at once run in
+parallel through `abatch`.
+"""
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from inspect import signature
+from typing import Any, AsyncIterator, Callable, Optional, Union
+
+import orjson
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool, ToolException
+from langgraph.prebuilt import ToolExecutor as BaseToolExecutor
+from langgraph.prebuilt.tool_executor import ToolInvocationInterface
+
+from app.metrics import counter, histogram
+
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT_SECONDS", 30))
+TOOL_TIMEOUTS: dict[str, float] = orjson.loads(os.environ.get("TOOL_TIMEOUTS", "{}"))
+TOOL_CONCURRENCY = int(os.environ.get("TOOL_CONCURRENCY", 64))
+TOOL_CONCURRENCY_PER_TOOL = int(os.environ.get("TOOL_CONCURRENCY_PER_TOOL", 16))
+TOOL_CONCURRENCY_LIMITS: dict[str, int] = orjson.loads(
+    os.environ.get("TOOL_CONCURRENCY_LIMITS", "{}")
+)
+
+TIMEOUT_MESSAGE = (
+    "Calling {tool} timed out after {timeout:g} seconds. "
+    "Try again, with other input, or without this tool."
+)
+
+_calls = counter("tool_calls", "Tool calls, by tool and outcome.")
+_duration = histogram(
+    "tool_duration_seconds",
+    "Time tool calls took, including waiting for a slot, by tool.",
+    [0.1, 0.5, 1, 2.5, 5, 10, 30, 60],
+)
+
+_semaphores: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[Optional[str], asyncio.Semaphore]
+] = weakref.WeakKeyDictionary()
+"""By event loop, the process wide semaphore under None, and one per tool name."""
+
+
+def _semaphore(tool: Optional[str]) -> asyncio.Semaphore:
+    # Semaphores can only be used in one event loop, so each gets its own, e.g.
+    # when tests or threads run several.
+    semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if tool not in semaphores:
+        semaphores[tool] = asyncio.Semaphore(
+            TOOL_CONCURRENCY
+            if tool is None
+            else TOOL_CONCURRENCY_LIMITS.get(tool, TOOL_CONCURRENCY_PER_TOOL)
+        )
+    return semaphores[tool]
+
+
+async def _acquire(semaphore: asyncio.Semaphore, deadline: float) -> None:
+    await asyncio.wait_for(semaphore.acquire(), max(deadline - time.monotonic(), 0))
+
+
+@asynccontextmanager
+async def _slots(tool: str, deadline: float) -> AsyncIterator[None]:
+    """Hold a slot of the tool and one of the process, raising TimeoutError if
+    they aren't free by the deadline."""
+    # The tool's own slot first, so that calls waiting on a busy tool don't hold
+    # the process wide slots other tools need.
+    per_tool, process = _semaphore(tool), _semaphore(None)
+    await _acquire(per_tool, deadline)
+    try:
+        await _acquire(process, deadline)
+        try:
+            yield
+        finally:
+            process.release()
+    finally:
+        per_tool.release()
+
+
+class ToolTimeout(ToolException):
+    """Raised in the run of a tool call that missed its deadline."""
+
+
+def _call(method: Callable, run_manager: Any, args: tuple, kwargs: dict) -> Any:
+    if run_manager is not None and signature(method).parameters.get("run_manager"):
+        kwargs = {**kwargs, "run_manager": run_manager}
+    return method(*args, **kwargs)
+
+
+class _WithDeadline(BaseTool):
+    """Runs a tool in its own tool run, ending it with a ToolTimeout past the
+    deadline instead of cancelling it."""
+
+    tool: BaseTool
+    deadline: float
+    timeout: float
+
+    @classmethod
+    def of(cls, tool: BaseTool, deadline: float, timeout: float) -> "_WithDeadline":
+        return cls(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            return_direct=tool.return_direct,
+            handle_tool_error=tool.handle_tool_error,
+            handle_validation_error=tool.handle_validation_error,
+            tool=tool,
+            deadline=deadline,
+            timeout=timeout,
+        )
+
+    @property
+    def args(self) -> dict:
+        return self.tool.args
+
+    def _to_args_and_kwargs(self, tool_input: Union[str, dict]) -> tuple[tuple, dict]:
+        return self.tool._to_args_and_kwargs(tool_input)
+
+    def _run(self, *args: Any, run_manager: Any = None, **kwargs: Any) -> Any:
+        # Sync calls can't be stopped, so they don't have a deadline.
+        return _call(self.tool._run, run_manager, args, kwargs)
+
+    async def _arun(self, *args: Any, run_manager: Any = None, **kwargs: Any) -> Any:
+        try:
+            return await asyncio.wait_for(
+                _call(self.tool._arun, run_manager, args, kwargs),
+                max(self.deadline - time.monotonic(), 0),
+            )
+        except asyncio.TimeoutError:
+            raise ToolTimeout(
+                TIMEOUT_MESSAGE.format(tool=self.name, timeout=self.timeout)
+            ) from None
+
+
+class ToolExecutor(BaseToolExecutor):
+    """A ToolExecutor with deadlines and concurrency limits for async calls."""
+
+    async def _aexecute(
+        self, tool_invocation: ToolInvocationInterface, *, config: RunnableConfig
+    ) -> Any:
+        tool = tool_invocation.tool
+        if tool not in self.tool_map:
+            return await super()._aexecute(tool_invocation, config=config)
+        timeout = TOOL_TIMEOUTS.get(tool, TOOL_TIMEOUT_SECONDS)
+        start = time.monotonic()
+        deadline = start + timeout
+        try:
+            async with _slots(tool, deadline):
+                output = await _WithDeadline.of(
+                    self.tool_map[tool], deadline, timeout
+                ).ainvoke(tool_invocation.tool_input, config)
+        except (asyncio.TimeoutError, ToolTimeout):
+            # Tools running in a thread go on there, but the run doesn't wait.
+            _calls.inc(tool=tool, outcome="timeout")
+            return TIMEOUT_MESSAGE.format(tool=tool, timeout=timeout)
+        except Exception:
+            _calls.inc(tool=tool, outcome="error")
+            raise
+        finally:
+            _duration.observe(time.monotonic() - start, tool=tool)
+        _calls.inc(tool=tool, outcome="ok")
+        return output
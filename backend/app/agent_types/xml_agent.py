@@ -1,62 +1,143 @@
+import os
+from typing import Optional, Sequence
+
 from langchain.tools import BaseTool
 from langchain.tools.render import render_text_description
 from langchain_core.language_models.base import LanguageModelLike
-from langchain_core.messages import (
-    AIMessage,
-    FunctionMessage,
-    HumanMessage,
-    SystemMessage,
-)
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.message import MessageGraph
-from langgraph.prebuilt import ToolExecutor, ToolInvocation
+from langgraph.prebuilt import ToolInvocation
 
 from app.agent_types.prompts import xml_template
+from app.agent_types.tool_executor import ToolExecutor
+from app.cache import LRUCache
+from app.context_window import fit_prompt
 from app.message_types import LiberalFunctionMessage
 
+XML_HISTORY_CACHE_MESSAGES = int(os.environ.get("XML_HISTORY_CACHE_MESSAGES", 2**16))
+"""Most messages, of all threads, whose collapsed chat history is kept between
+the steps of a run."""
+
+
+def _same(a: BaseMessage, b: BaseMessage) -> bool:
+    return a is b or a == b
+
+
+class ChatHistory:
+    """The chat history of a thread as the XML agent sees it, with every turn of
+    the agent, its actions, their observations and its answer, collapsed into a
+    single AI message.
+
+    Messages are only ever added to threads during a run, so the history is
+    extended with the messages added since the last step, instead of collapsing
+    all of them again. Any other change to the thread, e.g. messages replaced
+    with others, starts it over.
+    """
+
+    def __init__(self) -> None:
+        # The messages collapsed so far.
+        self._messages: list[BaseMessage] = []
+        self._collapsed: list[BaseMessage] = []
+        # Index in the collapsed history of each message of the user.
+        self._positions: dict[int, int] = {}
+        # The messages of the current turn, and its actions and observations.
+        self._turn: list[BaseMessage] = []
+        self._log: list[str] = []
+
+    def add(self, messages: Sequence[BaseMessage], start: int = 0) -> list[BaseMessage]:
+        """The collapsed history of `messages[start:]`, where `start` is 0 or the
+        index of a message of the user."""
+        if not self._extended_by(messages):
+            self.__init__()
+        try:
+            for i in range(len(self._messages), len(messages)):
+                message = messages[i]
+                if isinstance(message, HumanMessage):
+                    self._end_turn()
+                    self._positions[i] = len(self._collapsed)
+                    self._collapsed.append(message)
+                else:
+                    self._turn.append(message)
+            history = self._collapsed[self._positions[start] if start else 0 :]
+            if self._turn:
+                history.append(self._collapse())
+        except Exception:
+            self.__init__()
+            raise
+        self._messages.extend(messages[len(self._messages) :])
+        return history
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def _extended_by(self, messages: Sequence[BaseMessage]) -> bool:
+        # By identity, as comparing messages costs more than collapsing them.
+        # Steps of a run pass on the same messages, so this holds within runs.
+        return len(messages) >= len(self._messages) and all(
+            a is b for a, b in zip(messages, self._messages)
+        )
 
-def _collapse_messages(messages):
-    log = ""
-    if isinstance(messages[-1], AIMessage):
-        scratchpad = messages[:-1]
-        final = messages[-1]
-    else:
-        scratchpad = messages
-        final = None
-    if len(scratchpad) % 2 != 0:
-        raise ValueError("Unexpected")
-    for i in range(0, len(scratchpad), 2):
-        action = messages[i]
-        observation = messages[i + 1]
-        log += f"{action.content}<observation>{observation.content}</observation>"
-    if final is not None:
-        log += final.content
-    return AIMessage(content=log)
+    def _end_turn(self) -> None:
+        if self._turn:
+            self._collapsed.append(self._collapse())
+            self._turn = []
+            self._log = []
+
+    def _collapse(self) -> AIMessage:
+        turn = self._turn
+        final = turn[-1] if isinstance(turn[-1], AIMessage) else None
+        scratchpad = len(turn) - 1 if final is not None else len(turn)
+        if scratchpad % 2 != 0:
+            raise ValueError("Unexpected")
+        # Only the actions and observations since the last step are rendered.
+        for i in range(2 * len(self._log), scratchpad, 2):
+            action, observation = turn[i], turn[i + 1]
+            self._log.append(
+                f"{action.content}<observation>{observation.content}</observation>"
+            )
+        if final is not None:
+            return AIMessage(content="".join(self._log) + final.content)
+        return AIMessage(content="".join(self._log))
 
 
 def construct_chat_history(messages):
-    collapsed_messages = []
-    temp_messages = []
-    for message in messages:
-        if isinstance(message, HumanMessage):
-            if temp_messages:
-                collapsed_messages.append(_collapse_messages(temp_messages))
-                temp_messages = []
-            collapsed_messages.append(message)
-        elif isinstance(message, LiberalFunctionMessage):
-            _dict = message.dict()
-            _dict["content"] = str(_dict["content"])
-            m_c = FunctionMessage(**_dict)
-            temp_messages.append(m_c)
-        else:
-            temp_messages.append(message)
+    return ChatHistory().add(messages)
 
-    # Don't forget to add the last non-human message if it exists
-    if temp_messages:
-        collapsed_messages.append(_collapse_messages(temp_messages))
 
-    return collapsed_messages
+# Sized by the messages each history holds, and dropped when the run ends.
+_histories: LRUCache[ChatHistory] = LRUCache(
+    "xml_chat_histories", XML_HISTORY_CACHE_MESSAGES
+)
+
+
+def _chat_history(messages, window, config):
+    """The collapsed history of `window`, the latest of `messages`, extending
+    that of the previous step of the thread where possible."""
+    thread_id = config.get("configurable", {}).get("thread_id")
+    start = len(messages) - len(window)
+    if (
+        thread_id is None
+        or not window
+        or not _same(window[0], messages[start])
+        or (start and not isinstance(window[0], HumanMessage))
+    ):
+        return construct_chat_history(window)
+    if (history := _histories.get(thread_id)) is None:
+        history = ChatHistory()
+    collapsed = history.add(messages, start)
+    _histories.put(thread_id, history, size=len(history))
+    return collapsed
+
+
+def _end_run(message: BaseMessage, config) -> BaseMessage:
+    """Drop the chat history of the thread once the agent answers, as that ends
+    the run."""
+    if "</tool>" not in message.content:
+        if (thread_id := config.get("configurable", {}).get("thread_id")) is not None:
+            _histories.pop(thread_id)
+    return message
 
 
 def get_xml_agent_executor(
@@ -65,6 +146,7 @@ def get_xml_agent_executor(
     system_message: str,
     interrupt_before_action: bool,
     checkpoint: BaseCheckpointSaver,
+    max_tokens: Optional[int] = None,
 ):
     formatted_system_message = xml_template.format(
         system_message=system_message,
@@ -74,12 +156,13 @@ def get_xml_agent_executor(
 
     llm_with_stop = llm.bind(stop=["</tool_input>", "<observation>"])
 
-    def _get_messages(messages):
-        return [
-            SystemMessage(content=formatted_system_message)
-        ] + construct_chat_history(messages)
+    async def _get_messages(full, config):
+        system, messages = await fit_prompt(
+            formatted_system_message, full, config, max_tokens
+        )
+        return [system] + _chat_history(full, messages, config)
 
-    agent = _get_messages | llm_with_stop
+    agent = _get_messages | llm_with_stop | _end_run
     tool_executor = ToolExecutor(tools)
 
     # Define the function that determines whether to continue or not
@@ -91,7 +174,7 @@ def get_xml_agent_executor(
             return "end"
 
     # Define the function to execute tools
-    async def call_tool(messages):
+    async def call_tool(messages, config):
         # Based on the continue condition
         # we know the last message involves a function call
         last_message = messages[-1]
@@ -109,7 +192,7 @@ def get_xml_agent_executor(
             tool_input=_tool_input,
         )
         # We call the tool_executor and get back a response
-        response = await tool_executor.ainvoke(action)
+        response = await tool_executor.ainvoke(action, config)
         # We use the response to create a FunctionMessage
         function_message = LiberalFunctionMessage(content=response, name=action.tool)
         # We return a list, because this will get added to the existing list
@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, Path, Query
 from pydantic import BaseModel, Field
 
 import app.storage as storage
-from app.schema import Assistant, OpengptsUserId
+from app.schema import Assistant, AssistantsPage, OpengptsUserId
 
 router = APIRouter()
 
@@ -29,6 +29,26 @@ async def list_assistants(opengpts_user_id: OpengptsUserId) -> List[Assistant]:
     return await storage.list_assistants(opengpts_user_id)
 
 
+@router.get("/page")
+async def list_assistants_page(
+    opengpts_user_id: OpengptsUserId,
+    limit: Annotated[
+        int,
+        Query(ge=1, le=1000, description="The maximum number of assistants to return."),
+    ] = 100,
+    cursor: Annotated[
+        Optional[str], Query(description="The next_cursor of the previous page.")
+    ] = None,
+) -> AssistantsPage:
+    """List the assistants of the current user, most recently updated first."""
+    try:
+        return await storage.list_assistants_page(
+            opengpts_user_id, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/public/")
 async def list_public_assistants(
     shared_id: Annotated[
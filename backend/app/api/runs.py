@@ -1,8 +1,9 @@
 import json
-from typing import Optional, Sequence
+from typing import Annotated, Callable, Optional, Sequence
+from uuid import UUID
 
 import langsmith.client
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi import APIRouter, Header, HTTPException, Query, Request
 from fastapi.exceptions import RequestValidationError
 from langchain.pydantic_v1 import ValidationError
 from langchain_core.messages import AnyMessage
@@ -13,10 +14,18 @@ from langsmith.utils import tracing_is_enabled
 from pydantic import BaseModel, Field
 from sse_starlette import EventSourceResponse
 
+from app import admission, relay, run_manager
 from app.agent import agent
-from app.schema import OpengptsUserId
-from app.storage import get_assistant
-from app.stream import astream_messages, to_sse
+from app.schema import OpengptsUserId, Run
+from app.storage import get_assistant, get_run, get_thread_messages
+from app.stream import (
+    MessagesStream,
+    StreamProtocol,
+    astream_messages,
+    buffer_to_sse,
+    coalesce,
+    to_sse,
+)
 
 router = APIRouter()
 
@@ -58,17 +67,81 @@ async def _run_input_and_config(request: Request, opengpts_user_id: OpengptsUser
     return input_, config
 
 
+async def _admit(opengpts_user_id: str, config: RunnableConfig) -> Callable[[], None]:
+    """Wait for the run to be admitted, returning the function to call when the run
+    is done."""
+    try:
+        return await admission.controller.admit(
+            opengpts_user_id, admission.llm_type(config)
+        )
+    except admission.Rejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many runs, try again later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def follow_run(
+    opengpts_user_id: str,
+    run: Run,
+    protocol: StreamProtocol,
+    last_event_id: Optional[int],
+) -> EventSourceResponse:
+    """Stream the messages of a run, from this process or the one executing it."""
+    headers = {"X-Run-Id": str(run["run_id"])}
+    buffer = run_manager.get_stream(run["run_id"])
+    if (
+        buffer is None
+        and run["status"] in ("queued", "running")
+        # Runs of the workers don't stream.
+        and run["config"] is None
+    ):
+        buffer = relay.follow(opengpts_user_id, run["run_id"])
+    if buffer is None:
+
+        async def thread_messages() -> MessagesStream:
+            yield (await get_thread_messages(opengpts_user_id, run["thread_id"]))[
+                "messages"
+            ]
+
+        return EventSourceResponse(to_sse(thread_messages(), protocol), headers=headers)
+    return EventSourceResponse(
+        buffer_to_sse(buffer, protocol, last_event_id or 0), headers=headers
+    )
+
+
 @router.post("")
 async def create_run(
     payload: CreateRunPayload,  # for openapi docs
     request: Request,
     opengpts_user_id: OpengptsUserId,
-    background_tasks: BackgroundTasks,
-):
-    """Create a run."""
+) -> Run:
+    """Create a run.
+
+    With RUN_QUEUE=postgres the run is queued for the workers, otherwise it is
+    executed in this process, and its messages can be streamed with
+    GET /runs/{run_id}/stream.
+    """
     input_, config = await _run_input_and_config(request, opengpts_user_id)
-    background_tasks.add_task(agent.ainvoke, input_, config)
-    return {"status": "ok"}  # TODO add a run id
+    if run_manager.QUEUE_RUNS:
+        body = await request.json()
+        return await run_manager.enqueue(
+            opengpts_user_id,
+            payload.thread_id,
+            payload.assistant_id,
+            body["input"],
+            config,
+        )
+    release = await _admit(opengpts_user_id, config)
+    run, _ = await run_manager.start_stream(
+        opengpts_user_id,
+        payload.thread_id,
+        payload.assistant_id,
+        coalesce(astream_messages(agent, input_, config)),
+        on_done=release,
+    )
+    return run
 
 
 @router.post("/stream")
@@ -76,11 +149,32 @@ async def stream_run(
     payload: CreateRunPayload,  # for openapi docs
     request: Request,
     opengpts_user_id: OpengptsUserId,
+    protocol: Annotated[
+        StreamProtocol,
+        Query(
+            description="snapshot sends every message on each event, delta only changes."
+        ),
+    ] = "snapshot",
 ):
-    """Create a run."""
+    """Create a run and stream its messages.
+
+    The ID of the run is sent in the X-Run-Id header. The run goes on if the
+    client disconnects, resume the stream with GET /runs/{run_id}/stream.
+    """
     input_, config = await _run_input_and_config(request, opengpts_user_id)
+    release = await _admit(opengpts_user_id, config)
+    run, buffer = await run_manager.start_stream(
+        opengpts_user_id,
+        payload.thread_id,
+        payload.assistant_id,
+        coalesce(astream_messages(agent, input_, config)),
+        on_done=release,
+    )
 
-    return EventSourceResponse(to_sse(astream_messages(agent, input_, config)))
+    return EventSourceResponse(
+        buffer_to_sse(buffer, protocol),
+        headers={"X-Run-Id": str(run["run_id"])},
+    )
 
 
 @router.get("/input_schema")
@@ -101,6 +195,55 @@ async def config_schema() -> dict:
     return agent.config_schema().schema()
 
 
+@router.get("/{run_id}")
+async def get_run_by_id(opengpts_user_id: OpengptsUserId, run_id: UUID) -> Run:
+    """Get a run, with its status and timings."""
+    run = await get_run(opengpts_user_id, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+
+@router.get("/{run_id}/stream")
+async def resume_stream(
+    opengpts_user_id: OpengptsUserId,
+    run_id: UUID,
+    protocol: Annotated[
+        StreamProtocol,
+        Query(
+            description="snapshot sends every message on each event, delta only changes."
+        ),
+    ] = "snapshot",
+    last_event_id: Annotated[
+        Optional[int],
+        Header(description="The ID of the last event received, to resume after."),
+    ] = None,
+):
+    """Stream the messages of a run, to any number of clients at once.
+
+    Events after Last-Event-ID are replayed, then the stream follows the run.
+    If some of them are no longer buffered, the stream starts from the latest
+    messages instead. Runs executed by workers, or that ended more than
+    STREAM_BUFFER_TTL seconds ago, get the messages of their thread.
+    """
+    run = await get_run(opengpts_user_id, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return await follow_run(opengpts_user_id, run, protocol, last_event_id)
+
+
+@router.post("/{run_id}/cancel")
+async def cancel_run(opengpts_user_id: OpengptsUserId, run_id: UUID) -> Run:
+    """Cancel a run, including any LLM and tool calls it is waiting on."""
+    run = await get_run(opengpts_user_id, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run["status"] not in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Run is {run['status']}")
+    await run_manager.cancel(run_id)
+    return await get_run(opengpts_user_id, run_id)
+
+
 if tracing_is_enabled():
     langsmith_client = langsmith.client.Client()
 
@@ -1,12 +1,15 @@
-from typing import Annotated, List, Sequence
+from typing import Annotated, List, Optional, Sequence
 from uuid import uuid4
 
-from fastapi import APIRouter, HTTPException, Path
+from fastapi import APIRouter, Header, HTTPException, Path, Query
 from langchain.schema.messages import AnyMessage
 from pydantic import BaseModel, Field
 
 import app.storage as storage
-from app.schema import OpengptsUserId, Thread
+from app.api.runs import follow_run
+from app.schema import OpengptsUserId, Thread, ThreadsPage
+from app.serialization import MessagesResponse
+from app.stream import StreamProtocol
 
 router = APIRouter()
 
@@ -33,13 +36,78 @@ async def list_threads(opengpts_user_id: OpengptsUserId) -> List[Thread]:
     return await storage.list_threads(opengpts_user_id)
 
 
+@router.get("/page")
+async def list_threads_page(
+    opengpts_user_id: OpengptsUserId,
+    limit: Annotated[
+        int,
+        Query(ge=1, le=1000, description="The maximum number of threads to return."),
+    ] = 100,
+    cursor: Annotated[
+        Optional[str], Query(description="The next_cursor of the previous page.")
+    ] = None,
+) -> ThreadsPage:
+    """List the threads of the current user, most recently updated first."""
+    try:
+        return await storage.list_threads_page(
+            opengpts_user_id, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/{tid}/messages")
 async def get_thread_messages(
     opengpts_user_id: OpengptsUserId,
     tid: ThreadID,
+    limit: Annotated[
+        Optional[int],
+        Query(
+            ge=1,
+            le=1000,
+            description="Only return the newest messages, this many at a time.",
+        ),
+    ] = None,
+    before: Annotated[
+        Optional[int],
+        Query(
+            ge=0,
+            description="The next_cursor of the previous page, requires limit.",
+        ),
+    ] = None,
+):
+    """Get all messages for a thread, or a page of them if limit is given."""
+    if limit is not None:
+        return MessagesResponse(
+            await storage.get_thread_messages_page(
+                opengpts_user_id, tid, limit=limit, before=before
+            )
+        )
+    return MessagesResponse(await storage.get_thread_messages(opengpts_user_id, tid))
+
+
+@router.get("/{tid}/stream")
+async def stream_thread(
+    opengpts_user_id: OpengptsUserId,
+    tid: ThreadID,
+    protocol: Annotated[
+        StreamProtocol,
+        Query(
+            description="snapshot sends every message on each event, delta only changes."
+        ),
+    ] = "snapshot",
+    last_event_id: Annotated[
+        Optional[int],
+        Header(description="The ID of the last event received, to resume after."),
+    ] = None,
 ):
-    """Get all messages for a thread."""
-    return await storage.get_thread_messages(opengpts_user_id, tid)
+    """Stream the messages of the run going on in a thread, as GET
+    /runs/{run_id}/stream does. Lets more clients watch a run than the one that
+    started it."""
+    run = await storage.get_active_run(opengpts_user_id, tid)
+    if not run:
+        raise HTTPException(status_code=404, detail="No run going on in the thread")
+    return await follow_run(opengpts_user_id, run, protocol, last_event_id)
 
 
 @router.post("/{tid}/messages")
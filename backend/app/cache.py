@@ -0,0 +1,160 @@
+"""In-process caches."""
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+from app.metrics import counter
+
+V = TypeVar("V")
+F = TypeVar("F", bound=Callable[..., Any])
+
+_hits = counter("cache_hits", "Cache lookups that found a value.")
+_misses = counter("cache_misses", "Cache lookups that found nothing.")
+_evictions = counter("cache_evictions", "Values evicted to stay within maxsize.")
+_expirations = counter("cache_expirations", "Values dropped because their TTL passed.")
+_builds = counter("cache_builds", "Values computed by cached functions.")
+
+
+class LRUCache(Generic[V]):
+    """A thread-safe least recently used cache.
+
+    Every value has a size, 1 unless given, and the total size of the values in
+    the cache is kept under `maxsize`. A value bigger than `maxsize` is not
+    cached at all.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None) -> None:
+        """
+        Args:
+            name: Name of the cache, used to label its metrics.
+            maxsize: The maximum total size of the cached values.
+            ttl: Seconds after which a value expires, never if None.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.size = 0
+        self._data: OrderedDict[
+            Hashable, tuple[V, int, Optional[float]]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+        # Locks of the keys whose values are being computed.
+        self._inflight: dict[Hashable, threading.Lock] = {}
+        self._inflight_lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                _misses.inc(cache=self.name)
+                return None
+            self._data.move_to_end(key)
+        _hits.inc(cache=self.name)
+        return entry[0]
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """Get a value without counting a lookup or marking it as used."""
+        with self._lock:
+            entry = self._get(key)
+        return None if entry is None else entry[0]
+
+    def put(
+        self, key: Hashable, value: V, size: int = 1, ttl: Optional[float] = None
+    ) -> None:
+        """Cache a value, expiring after `ttl` seconds if given, else the cache's."""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._pop(key)
+            if size > self.maxsize:
+                return
+            expires = time.monotonic() + ttl if ttl is not None else None
+            self._data[key] = (value, size, expires)
+            self.size += size
+            while self.size > self.maxsize:
+                _, (_, evicted, _) = self._data.popitem(last=False)
+                self.size -= evicted
+                _evictions.inc(cache=self.name)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], V]) -> V:
+        """Get a value, computing and caching it if missing.
+
+        Concurrent calls for the same key wait for a single call to compute the
+        value instead of all computing it.
+        """
+        if (value := self.get(key)) is not None:
+            return value
+        with self._inflight_lock:
+            lock = self._inflight.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                # Computed by another call while we were waiting.
+                if (value := self.peek(key)) is not None:
+                    return value
+                value = compute()
+                _builds.inc(cache=self.name)
+                self.put(key, value)
+                return value
+        finally:
+            with self._inflight_lock:
+                if self._inflight.get(key) is lock:
+                    del self._inflight[key]
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            return self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _get(self, key: Hashable) -> Optional[tuple[V, int, Optional[float]]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+            self._pop(key)
+            _expirations.inc(cache=self.name)
+            return None
+        return entry
+
+    def _pop(self, key: Hashable) -> Optional[V]:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return None
+        self.size -= entry[1]
+        return entry[0]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+
+def cached(name: str, maxsize: int, ttl: Optional[float] = None) -> Callable[[F], F]:
+    """Cache the results of a function by its arguments, like `lru_cache`.
+
+    Concurrent calls with the same arguments wait for a single call to compute
+    the value instead of all computing it. The arguments must be hashable.
+
+    Args:
+        name: Name of the cache, used to label its metrics.
+        maxsize: The maximum number of values to keep.
+        ttl: Seconds after which a value is computed again, never if None.
+    """
+
+    def decorator(fn: F) -> F:
+        cache: LRUCache[Any] = LRUCache(name, maxsize, ttl)
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = (args, tuple(sorted(kwargs.items())))
+            # Wrapped so that None results are cached too.
+            return cache.get_or_compute(key, lambda: (fn(*args, **kwargs),))[0]
+
+        wrapper.cache = cache  # type: ignore[attr-defined]
+        wrapper.cache_clear = cache.clear  # type: ignore[attr-defined]
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
@@ -1,17 +1,24 @@
+from typing import Optional
+
 from langchain_core.language_models.base import LanguageModelLike
-from langchain_core.messages import SystemMessage
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.message import MessageGraph
 
+from app.context_window import fit_prompt
+
 
 def get_chatbot_executor(
     llm: LanguageModelLike,
     system_message: str,
     checkpoint: BaseCheckpointSaver,
+    max_tokens: Optional[int] = None,
 ):
-    def _get_messages(messages):
-        return [SystemMessage(content=system_message)] + messages
+    async def _get_messages(messages, config):
+        system, messages = await fit_prompt(
+            system_message, messages, config, max_tokens
+        )
+        return [system] + messages
 
     chatbot = _get_messages | llm
 
@@ -1,18 +1,255 @@
-import pickle
-from typing import Optional
+import os
+import weakref
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Optional
 
+import asyncpg
+from langchain.pydantic_v1 import Field, PrivateAttr
 from langchain.schema.runnable import RunnableConfig
 from langchain.schema.runnable.utils import ConfigurableFieldSpec
+from langchain_core.messages import AnyMessage
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.checkpoint.base import Checkpoint
 
-from app.lifespan import get_pg_pool
+from app.cache import LRUCache
+from app.codec import Codec, CompactCodec, decode, get_codec, is_compact
+from app.lifespan import add_listener, add_reset_listener, get_pg_pool, listening
+
+NOTIFY_CHANNEL = "checkpoints"
+MESSAGES_CHANNEL_NAME = "__root__"
+"""The channel a MessageGraph keeps its messages in, named by langgraph."""
+
+
+@dataclass
+class _Written:
+    """What this process last persisted for a thread, used to compute deltas."""
+
+    step: int
+    """The step of the last row written for the thread."""
+    base_step: int
+    """The step of the base snapshot the deltas are applied on top of."""
+    channel_values: dict[str, Any]
+    """Shallow copy of the channel values that were persisted."""
+
+
+@dataclass
+class _Cached:
+    """A decoded checkpoint kept in memory."""
+
+    step: int
+    """The step of the checkpoint, compared against notifications."""
+    size: int
+    """Size of the stored checkpoint in bytes, used to bound the cache."""
+    checkpoint: Checkpoint
+
+
+@dataclass
+class MessagesPage:
+    """A range of the messages of a thread, see `PostgresCheckpoint.aget_messages`."""
+
+    messages: list[AnyMessage]
+    start: int
+    """The index of the first message in the thread."""
+    versions: dict
+    """The channel versions and versions seen by each node, from the checkpoint."""
+
+
+class _Invalidator:
+    """Drops what a checkpointer knows about threads written to elsewhere.
+
+    Held by the checkpointer, and only weakly by the module, so that
+    checkpointers that are no longer used aren't notified forever.
+    """
+
+    def __init__(self, cache: LRUCache[_Cached], written: OrderedDict) -> None:
+        self.cache = cache
+        self.written = written
+
+    def notify(self, payload: str) -> None:
+        thread_id, _, step = payload.rpartition(":")
+        step = int(step)
+        cached = self.cache.peek(thread_id)
+        if cached is not None and cached.step < step:
+            self.cache.pop(thread_id)
+        written = self.written.get(thread_id)
+        if written is not None and written.step < step:
+            self.written.pop(thread_id, None)
+
+    def reset(self) -> None:
+        # Notifications may have been missed, so nothing cached can be trusted.
+        self.cache.clear()
+        self.written.clear()
+
+
+_invalidators: weakref.WeakSet[_Invalidator] = weakref.WeakSet()
+
+
+def _on_notify(payload: str) -> None:
+    for invalidator in list(_invalidators):
+        invalidator.notify(payload)
+
+
+def _on_reset() -> None:
+    for invalidator in list(_invalidators):
+        invalidator.reset()
+
+
+add_listener(NOTIFY_CHANNEL, _on_notify)
+add_reset_listener(_on_reset)
+
+
+def _seen_dict() -> defaultdict:
+    return defaultdict(int)
+
+
+def _versions_seen(versions_seen: dict[str, dict[str, int]]) -> defaultdict:
+    restored = defaultdict(_seen_dict)
+    for node, seen in versions_seen.items():
+        restored[node] = defaultdict(int, seen)
+    return restored
+
+
+def _copy_checkpoint(checkpoint: Checkpoint) -> Checkpoint:
+    """Copy the mutable parts of a checkpoint, pregel updates them in place."""
+    return Checkpoint(
+        v=checkpoint["v"],
+        ts=checkpoint["ts"],
+        channel_values=dict(checkpoint["channel_values"]),
+        channel_versions=defaultdict(int, checkpoint["channel_versions"]),
+        versions_seen=_versions_seen(checkpoint["versions_seen"]),
+    )
+
+
+_MISSING = object()
+
+
+def _diff_checkpoint(prev_values: dict[str, Any], checkpoint: Checkpoint) -> dict:
+    """Compute the delta between the previously persisted values and a checkpoint.
+
+    List values (e.g. the `__root__` message list) that extend the previous
+    value are stored as the appended tail only. Values are compared by identity,
+    which is cheap and safe since channels replace values instead of mutating
+    them.
+    """
+    values = checkpoint["channel_values"]
+    set_values = {}
+    extend_values = {}
+    for key, value in values.items():
+        prev = prev_values.get(key, _MISSING)
+        if prev is value:
+            continue
+        if (
+            isinstance(value, list)
+            and isinstance(prev, list)
+            and len(prev) <= len(value)
+            and all(a is b for a, b in zip(prev, value))
+        ):
+            if len(value) > len(prev):
+                extend_values[key] = value[len(prev) :]
+        else:
+            set_values[key] = value
+    return {
+        "v": checkpoint["v"],
+        "ts": checkpoint["ts"],
+        "set": set_values,
+        "extend": extend_values,
+        "delete": [key for key in prev_values if key not in values],
+        "channel_versions": dict(checkpoint["channel_versions"]),
+        "versions_seen": {
+            node: dict(seen) for node, seen in checkpoint["versions_seen"].items()
+        },
+    }
+
+
+def _versions(checkpoint: Checkpoint) -> dict:
+    return {
+        "channel_versions": {
+            str(chan): version
+            for chan, version in checkpoint["channel_versions"].items()
+        },
+        "versions_seen": {
+            node: {str(chan): version for chan, version in seen.items()}
+            for node, seen in checkpoint["versions_seen"].items()
+        },
+    }
+
+
+def _remember(tracked: OrderedDict, key: str, value: Any, maxlen: int) -> None:
+    tracked[key] = value
+    tracked.move_to_end(key)
+    while len(tracked) > maxlen:
+        tracked.popitem(last=False)
+
+
+def _load_checkpoint(data: bytes) -> Checkpoint:
+    """Decode a stored checkpoint, restoring the defaultdicts pregel expects."""
+    checkpoint = decode(data)
+    checkpoint["channel_versions"] = defaultdict(int, checkpoint["channel_versions"])
+    checkpoint["versions_seen"] = _versions_seen(checkpoint["versions_seen"])
+    return checkpoint
+
+
+def _apply_delta(checkpoint: Checkpoint, delta: dict) -> Checkpoint:
+    """Apply a delta produced by `_diff_checkpoint` to a checkpoint in place."""
+    values = checkpoint["channel_values"]
+    for key in delta["delete"]:
+        values.pop(key, None)
+    values.update(delta["set"])
+    for key, tail in delta["extend"].items():
+        values[key] = values[key] + tail
+    checkpoint["v"] = delta["v"]
+    checkpoint["ts"] = delta["ts"]
+    checkpoint["channel_versions"] = defaultdict(int, delta["channel_versions"])
+    checkpoint["versions_seen"] = _versions_seen(delta["versions_seen"])
+    return checkpoint
 
 
 class PostgresCheckpoint(BaseCheckpointSaver):
+    delta_storage: bool = Field(
+        default_factory=lambda: os.environ.get("CHECKPOINT_STORAGE") == "delta"
+    )
+    """Write only what changed since the previous step to `checkpoint_delta`.
+
+    Reads rebuild the checkpoint from the latest base snapshot in `checkpoints`
+    plus the deltas written after it. When switching this off, run `compact`
+    first so no deltas are left behind.
+    """
+    snapshot_every: int = Field(
+        default_factory=lambda: int(os.environ.get("CHECKPOINT_SNAPSHOT_EVERY", 50))
+    )
+    """Write a new base snapshot after this many deltas."""
+    max_tracked_threads: int = 1000
+    """Number of threads for which the last written state is kept in memory."""
+    codec: Codec = Field(default_factory=get_codec)
+    """Codec used for new rows. Rows in any other format are still readable, and
+    legacy pickle rows are rewritten with this codec the first time they are read.
+    """
+    cache_bytes: int = Field(
+        default_factory=lambda: int(os.environ.get("CHECKPOINT_CACHE_BYTES", 0))
+    )
+    """Keep up to this many bytes of recently used checkpoints in memory, 0 to
+    disable. Sizes are those of the stored rows, decoded checkpoints take more.
+
+    Writes go through the cache and are announced with NOTIFY, so that other
+    workers drop their older copy of the thread.
+    """
+
+    _written: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _indexed: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _cache: Optional[LRUCache[_Cached]] = PrivateAttr(default=None)
+    _invalidator: Optional[_Invalidator] = PrivateAttr(default=None)
+
     class Config:
         arbitrary_types_allowed = True
 
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        if self.cache_bytes > 0:
+            self._cache = LRUCache("checkpoints", self.cache_bytes)
+            self._invalidator = _Invalidator(self._cache, self._written)
+            _invalidators.add(self._invalidator)
+
     @property
     def config_specs(self) -> list[ConfigurableFieldSpec]:
         return [
@@ -34,22 +271,434 @@ class PostgresCheckpoint(BaseCheckpointSaver):
 
     async def aget(self, config: RunnableConfig) -> Optional[Checkpoint]:
         thread_id = config["configurable"]["thread_id"]
+        if checkpoint := self._cache_get(thread_id):
+            return checkpoint
         async with get_pg_pool().acquire() as conn:
-            if value := await conn.fetchrow(
-                "SELECT checkpoint FROM checkpoints WHERE thread_id = $1", thread_id
-            ):
-                return pickle.loads(value[0])
+            if not self.delta_storage:
+                if value := await conn.fetchrow(
+                    "SELECT checkpoint, step FROM checkpoints WHERE thread_id = $1",
+                    thread_id,
+                ):
+                    checkpoint = _load_checkpoint(value["checkpoint"])
+                    await self._backfill(conn, thread_id, value, checkpoint)
+                    self._cache_put(
+                        thread_id,
+                        _Cached(value["step"], len(value["checkpoint"]), checkpoint),
+                    )
+                    return _copy_checkpoint(checkpoint)
+                return None
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                base = await conn.fetchrow(
+                    "SELECT checkpoint, step FROM checkpoints WHERE thread_id = $1",
+                    thread_id,
+                )
+                if base is None:
+                    return None
+                deltas = await conn.fetch(
+                    (
+                        "SELECT step, delta FROM checkpoint_delta "
+                        "WHERE thread_id = $1 AND step > $2 ORDER BY step"
+                    ),
+                    thread_id,
+                    base["step"],
+                )
+            checkpoint = _load_checkpoint(base["checkpoint"])
+            await self._backfill(conn, thread_id, base, checkpoint)
+        for row in deltas:
+            _apply_delta(checkpoint, decode(row["delta"]))
+        step = deltas[-1]["step"] if deltas else base["step"]
+        self._track(
+            thread_id,
+            _Written(step, base["step"], dict(checkpoint["channel_values"])),
+        )
+        size = len(base["checkpoint"]) + sum(len(row["delta"]) for row in deltas)
+        self._cache_put(thread_id, _Cached(step, size, checkpoint))
+        return _copy_checkpoint(checkpoint)
 
     async def aput(self, config: RunnableConfig, checkpoint: Checkpoint) -> None:
         thread_id = config["configurable"]["thread_id"]
         async with get_pg_pool().acquire() as conn:
-            await conn.execute(
+            try:
+                # In one transaction, so the messages never disagree with the
+                # checkpoint, e.g. if the process stops in between.
+                async with conn.transaction():
+                    await self._put(conn, thread_id, checkpoint)
+                    await self._index_messages(conn, thread_id, checkpoint)
+            except BaseException:
+                # What was remembered of the write may not have been committed.
+                self._forget(thread_id)
+                raise
+
+    async def _put(
+        self, conn: asyncpg.Connection, thread_id: str, checkpoint: Checkpoint
+    ) -> None:
+        """Write a checkpoint, in the transaction of the caller."""
+        if not self.delta_storage:
+            data = self.codec.encode(checkpoint)
+            step = await conn.fetchval(
                 (
                     "INSERT INTO checkpoints (thread_id, checkpoint) "
                     "VALUES ($1, $2) "
-                    "ON CONFLICT (thread_id) "
-                    "DO UPDATE SET checkpoint = EXCLUDED.checkpoint;"
+                    "ON CONFLICT (thread_id) DO UPDATE SET "
+                    "checkpoint = EXCLUDED.checkpoint, "
+                    "step = checkpoints.step + 1 "
+                    "RETURNING step;"
                 ),
                 thread_id,
-                pickle.dumps(checkpoint),
+                data,
+            )
+            await self._written_through(conn, thread_id, step, checkpoint, len(data))
+            return
+        written = self._written.get(thread_id)
+        if (
+            written is not None
+            and written.step - written.base_step < self.snapshot_every
+        ):
+            data = self.codec.encode(
+                _diff_checkpoint(written.channel_values, checkpoint)
+            )
+            if await self._put_delta(conn, thread_id, written, data):
+                self._track(
+                    thread_id,
+                    _Written(
+                        written.step + 1,
+                        written.base_step,
+                        dict(checkpoint["channel_values"]),
+                    ),
+                )
+                # The size of the whole thread is only known if it was
+                # cached already, otherwise leave it to the next read.
+                cached = (
+                    self._cache.peek(thread_id) if self._cache is not None else None
+                )
+                await self._written_through(
+                    conn,
+                    thread_id,
+                    written.step + 1,
+                    checkpoint,
+                    cached.size + len(data) if cached else None,
+                )
+                return
+        step, size = await self._put_snapshot(conn, thread_id, checkpoint)
+        self._track(thread_id, _Written(step, step, dict(checkpoint["channel_values"])))
+        await self._written_through(conn, thread_id, step, checkpoint, size)
+
+    async def _put_delta(
+        self, conn: asyncpg.Connection, thread_id: str, written: _Written, data: bytes
+    ) -> bool:
+        """Write a delta on top of what this process last wrote, if nobody else
+        wrote to the thread since.
+
+        Returns:
+            Whether the delta was written. If not, our view of the thread is
+            stale and a full snapshot must be written instead.
+        """
+        # Locking the base row serializes this with snapshots and other
+        # deltas, which would otherwise drop or hide the delta.
+        base_step = await conn.fetchval(
+            "SELECT step FROM checkpoints WHERE thread_id = $1 FOR UPDATE;",
+            thread_id,
+        )
+        last_step = await conn.fetchval(
+            "SELECT MAX(step) FROM checkpoint_delta WHERE thread_id = $1;",
+            thread_id,
+        )
+        if (
+            base_step != written.base_step
+            or (last_step if last_step is not None else base_step) != written.step
+        ):
+            return False
+        await conn.execute(
+            (
+                "INSERT INTO checkpoint_delta (thread_id, step, delta) "
+                "VALUES ($1, $2, $3);"
+            ),
+            thread_id,
+            written.step + 1,
+            data,
+        )
+        return True
+
+    async def _put_snapshot(
+        self, conn: asyncpg.Connection, thread_id: str, checkpoint: Checkpoint
+    ) -> tuple[int, int]:
+        """Write a full base snapshot and drop the deltas it supersedes.
+
+        Returns:
+            The step and size of the snapshot.
+        """
+        data = self.codec.encode(checkpoint)
+        step = await conn.fetchval(
+            (
+                "INSERT INTO checkpoints (thread_id, checkpoint, step) "
+                "VALUES ($1, $2, 0) "
+                "ON CONFLICT (thread_id) DO UPDATE SET "
+                "checkpoint = EXCLUDED.checkpoint, "
+                "step = GREATEST(checkpoints.step, ("
+                "SELECT COALESCE(MAX(step), 0) FROM checkpoint_delta "
+                "WHERE thread_id = $1)) + 1 "
+                "RETURNING step;"
+            ),
+            thread_id,
+            data,
+        )
+        await conn.execute(
+            "DELETE FROM checkpoint_delta WHERE thread_id = $1 AND step <= $2;",
+            thread_id,
+            step,
+        )
+        return step, len(data)
+
+    async def _backfill(
+        self,
+        conn: asyncpg.Connection,
+        thread_id: str,
+        row: asyncpg.Record,
+        checkpoint: Checkpoint,
+    ) -> None:
+        """Rewrite a legacy pickle row with the compact codec.
+
+        The row is only replaced if nobody wrote to it since it was read.
+        """
+        if is_compact(row["checkpoint"]) or not isinstance(self.codec, CompactCodec):
+            return
+        await conn.execute(
+            "UPDATE checkpoints SET checkpoint = $2 WHERE thread_id = $1 AND step = $3;",
+            thread_id,
+            self.codec.encode(checkpoint),
+            row["step"],
+        )
+
+    def _cache_get(self, thread_id: str) -> Optional[Checkpoint]:
+        if self._cache is None or not listening():
+            # Other workers' writes can't be heard of, so the cache may be stale.
+            return None
+        if (cached := self._cache.get(thread_id)) is None:
+            return None
+        if self.delta_storage:
+            # Deltas are computed against what was written, which must be
+            # the cached checkpoint, otherwise read it again.
+            written = self._written.get(thread_id)
+            if written is None or written.step != cached.step:
+                return None
+        return _copy_checkpoint(cached.checkpoint)
+
+    def _cache_put(self, thread_id: str, cached: _Cached) -> None:
+        if self._cache is not None:
+            self._cache.put(thread_id, cached, cached.size)
+
+    async def _written_through(
+        self,
+        conn: asyncpg.Connection,
+        thread_id: str,
+        step: int,
+        checkpoint: Checkpoint,
+        size: Optional[int],
+    ) -> None:
+        """Cache a checkpoint that was just written and tell the other workers.
+
+        The checkpoint is only cached if its size is known.
+        """
+        if self._cache is None:
+            return
+        if size is None:
+            self._cache.pop(thread_id)
+        else:
+            self._cache_put(
+                thread_id, _Cached(step, size, _copy_checkpoint(checkpoint))
+            )
+        await conn.execute(
+            "SELECT pg_notify($1, $2);", NOTIFY_CHANNEL, f"{thread_id}:{step}"
+        )
+
+    def _track(self, thread_id: str, written: _Written) -> None:
+        _remember(self._written, thread_id, written, self.max_tracked_threads)
+
+    def _forget(self, thread_id: str) -> None:
+        self._written.pop(thread_id, None)
+        self._indexed.pop(thread_id, None)
+        if self._cache is not None:
+            self._cache.pop(thread_id)
+
+    async def _index_messages(
+        self, conn: asyncpg.Connection, thread_id: str, checkpoint: Checkpoint
+    ) -> None:
+        """Store the messages added to the thread one per row in `thread_message`,
+        along with the versions needed to tell whether the thread is resumeable.
+
+        Messages are only ever appended to the root channel, so only those past
+        the previously stored count are written. Call this in a transaction.
+        """
+        messages = checkpoint["channel_values"].get(MESSAGES_CHANNEL_NAME, [])
+        known = self._indexed.get(thread_id)
+        if known is None:
+            known = (
+                await conn.fetchval(
+                    (
+                        "SELECT message_count FROM checkpoint_versions "
+                        "WHERE thread_id = $1;"
+                    ),
+                    thread_id,
+                )
+                or 0
+            )
+        if len(messages) < known:
+            await conn.execute(
+                "DELETE FROM thread_message WHERE thread_id = $1 AND idx >= $2;",
+                thread_id,
+                len(messages),
             )
+        if len(messages) > known:
+            await conn.executemany(
+                (
+                    "INSERT INTO thread_message (thread_id, idx, message) "
+                    "VALUES ($1, $2, $3) "
+                    "ON CONFLICT (thread_id, idx) DO UPDATE SET "
+                    "message = EXCLUDED.message;"
+                ),
+                [
+                    (thread_id, idx, self.codec.encode(message))
+                    for idx, message in enumerate(messages[known:], known)
+                ],
+            )
+        await conn.execute(
+            (
+                "INSERT INTO checkpoint_versions "
+                "(thread_id, message_count, versions) VALUES ($1, $2, $3) "
+                "ON CONFLICT (thread_id) DO UPDATE SET "
+                "message_count = EXCLUDED.message_count, "
+                "versions = EXCLUDED.versions;"
+            ),
+            thread_id,
+            len(messages),
+            _versions(checkpoint),
+        )
+        _remember(self._indexed, thread_id, len(messages), self.max_tracked_threads)
+
+    async def aget_messages(
+        self, config: RunnableConfig, *, limit: int, before: Optional[int] = None
+    ) -> Optional[MessagesPage]:
+        """Get the newest `limit` messages of a thread, without loading the
+        whole checkpoint.
+
+        Args:
+            config: The config holding the thread ID.
+            limit: The maximum number of messages to return.
+            before: Only return messages before this index, used to page back
+                through the thread with the `start` of the previous page.
+
+        Returns:
+            The messages, oldest first, or None if the thread has no checkpoint.
+        """
+        thread_id = config["configurable"]["thread_id"]
+        async with get_pg_pool().acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                versions = await conn.fetchval(
+                    "SELECT versions FROM checkpoint_versions WHERE thread_id = $1;",
+                    thread_id,
+                )
+                rows = await conn.fetch(
+                    (
+                        "SELECT idx, message FROM thread_message "
+                        "WHERE thread_id = $1 AND idx < $2 "
+                        "ORDER BY idx DESC LIMIT $3;"
+                    ),
+                    thread_id,
+                    before if before is not None else 2**31 - 1,
+                    limit,
+                )
+        if versions is not None:
+            return MessagesPage(
+                messages=[decode(row["message"]) for row in reversed(rows)],
+                start=rows[-1]["idx"] if rows else 0,
+                versions=versions,
+            )
+        # Written before messages were stored separately, index it now.
+        checkpoint = await self.aget(config)
+        if checkpoint is None:
+            return None
+        self._indexed.pop(thread_id, None)
+        async with get_pg_pool().acquire() as conn:
+            async with conn.transaction():
+                await self._index_messages(conn, thread_id, checkpoint)
+        messages = checkpoint["channel_values"].get(MESSAGES_CHANNEL_NAME, [])
+        end = len(messages) if before is None else min(before, len(messages))
+        start = max(end - limit, 0)
+        return MessagesPage(messages[start:end], start, _versions(checkpoint))
+
+    async def compact(self, *, min_deltas: int = 1) -> int:
+        """Fold pending deltas into their base snapshot.
+
+        Args:
+            min_deltas: Only compact threads with at least this many deltas.
+
+        Returns:
+            The number of threads that were compacted.
+        """
+        async with get_pg_pool().acquire() as conn:
+            thread_ids = await conn.fetch(
+                (
+                    "SELECT thread_id FROM checkpoint_delta "
+                    "GROUP BY thread_id HAVING COUNT(*) >= $1;"
+                ),
+                min_deltas,
+            )
+            for row in thread_ids:
+                thread_id = row["thread_id"]
+                async with conn.transaction():
+                    base = await conn.fetchrow(
+                        (
+                            "SELECT checkpoint, step FROM checkpoints "
+                            "WHERE thread_id = $1 FOR UPDATE;"
+                        ),
+                        thread_id,
+                    )
+                    if base is None:
+                        continue
+                    deltas = await conn.fetch(
+                        (
+                            "SELECT step, delta FROM checkpoint_delta "
+                            "WHERE thread_id = $1 AND step > $2 ORDER BY step"
+                        ),
+                        thread_id,
+                        base["step"],
+                    )
+                    if deltas:
+                        checkpoint = _load_checkpoint(base["checkpoint"])
+                        for delta in deltas:
+                            _apply_delta(checkpoint, decode(delta["delta"]))
+                        await conn.execute(
+                            (
+                                "UPDATE checkpoints SET checkpoint = $2, step = $3 "
+                                "WHERE thread_id = $1;"
+                            ),
+                            thread_id,
+                            self.codec.encode(checkpoint),
+                            deltas[-1]["step"],
+                        )
+                    await conn.execute(
+                        (
+                            "DELETE FROM checkpoint_delta "
+                            "WHERE thread_id = $1 AND step <= $2;"
+                        ),
+                        thread_id,
+                        deltas[-1]["step"] if deltas else base["step"],
+                    )
+                # Deltas written by this process now refer to a different base.
+                self._written.pop(thread_id, None)
+                if self._cache is not None:
+                    self._cache.pop(thread_id)
+        return len(thread_ids)
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    from app.lifespan import lifespan
+
+    async def run():
+        async with lifespan(None):
+            compacted = await PostgresCheckpoint().compact()
+            print(f"Compacted {compacted} threads.")
+
+    asyncio.run(run())
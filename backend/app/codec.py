@@ -0,0 +1,273 @@
+"""Codecs used to store checkpoints and other values in Postgres.
+
+The compact format is a small header followed by orjson encoded data in which
+well known objects (messages, documents) are written as tagged dicts holding
+only their non-default fields. Anything else falls back to an embedded pickle,
+including values orjson would write as another type, like datetimes, UUIDs,
+enums, dataclasses and dicts with keys other than strings.
+Objects that appear more than once, like messages shared between the
+`__root__` channel and node inboxes, are written once and referenced after.
+
+    b"OGC" | version (1 byte) | flags (1 byte) | payload
+
+Payloads above a configurable size are compressed with zstd, which requires
+the optional `zstandard` package.
+"""
+import base64
+import os
+import pickle
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Optional
+
+import orjson
+from langchain_core.documents import Document
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    ChatMessage,
+    ChatMessageChunk,
+    FunctionMessage,
+    FunctionMessageChunk,
+    HumanMessage,
+    HumanMessageChunk,
+    SystemMessage,
+    SystemMessageChunk,
+    ToolMessage,
+    ToolMessageChunk,
+)
+
+from app.message_types import LiberalFunctionMessage, LiberalToolMessage
+
+MAGIC = b"OGC"
+VERSION = 1
+FLAG_ZSTD = 1
+
+_TAG = "\x00t"
+_REF = "\x00r"
+_PICKLE_TAG = 0
+_TUPLE_TAG = 2
+_CONTAINERS = (list, dict)
+_DICTS = (dict, defaultdict)
+_SCALARS = (str, int, float, bool, type(None))
+
+# Tags are part of the stored format, never reuse or renumber them.
+_TAGS: dict[type, int] = {
+    Document: 1,
+    HumanMessage: 10,
+    AIMessage: 11,
+    SystemMessage: 12,
+    FunctionMessage: 13,
+    ToolMessage: 14,
+    ChatMessage: 15,
+    HumanMessageChunk: 20,
+    AIMessageChunk: 21,
+    SystemMessageChunk: 22,
+    FunctionMessageChunk: 23,
+    ToolMessageChunk: 24,
+    ChatMessageChunk: 25,
+    LiberalFunctionMessage: 30,
+    LiberalToolMessage: 31,
+}
+_TYPES = {tag: typ for typ, tag in _TAGS.items()}
+
+
+def _field_defaults(typ: type) -> dict[str, Any]:
+    """The default value of every optional field, omitted when encoding."""
+    defaults = {}
+    for name, field in typ.__fields__.items():
+        if field.required:
+            continue
+        defaults[name] = (
+            field.default_factory() if field.default_factory else field.default
+        )
+    return defaults
+
+
+_DEFAULTS = {typ: _field_defaults(typ) for typ in _TAGS}
+
+
+class _Opaque:
+    """Holds a value for orjson to pass to `default` instead of encoding it."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+
+def _prepare(value: Any) -> Any:
+    """Copy lists and dicts, wrapping values that orjson would otherwise encode
+    as something else than they are, e.g. tuples as lists, so they're tagged.
+    """
+    typ = type(value)
+    if typ in _SCALARS:
+        return value
+    if typ is list:
+        return [v if type(v) in _SCALARS else _prepare(v) for v in value]
+    # Checkpoints restore the defaultdicts they hold themselves.
+    if typ in _DICTS and all(k.__class__ is str for k in value):
+        return {k: v if type(v) in _SCALARS else _prepare(v) for k, v in value.items()}
+    if typ in _TAGS:
+        # orjson doesn't know these, so passes them to `default` as they are.
+        return value
+    return _Opaque(value)
+
+
+def _encode_object(obj: Any) -> dict:
+    """Encode an object orjson doesn't know about as a tagged dict."""
+    typ = type(obj)
+    if tag := _TAGS.get(typ):
+        defaults = _DEFAULTS[typ]
+        encoded = {_TAG: tag}
+        for key, value in obj.__dict__.items():
+            if key in defaults and value == defaults[key]:
+                continue
+            encoded[key] = _prepare(value)
+        return encoded
+    if typ is tuple:
+        return {_TAG: _TUPLE_TAG, "i": _prepare(list(obj))}
+    return {
+        _TAG: _PICKLE_TAG,
+        "d": base64.b64encode(pickle.dumps(obj)).decode(),
+    }
+
+
+def _dumps(value: Any) -> bytes:
+    # Tagged objects are numbered in the order orjson encounters them, which
+    # is the order _revive walks them in, so references can be by number.
+    seen: dict[int, int] = {}
+
+    def default(obj: Any) -> Any:
+        if type(obj) is _Opaque:
+            obj = obj.value
+        if (ref := seen.get(id(obj))) is not None:
+            return {_REF: ref}
+        seen[id(obj)] = len(seen)
+        return _encode_object(obj)
+
+    return orjson.dumps(_prepare(value), default=default)
+
+
+def _revive(value: Any, objects: list) -> Any:
+    """Turn tagged dicts produced by `_dumps` back into objects."""
+    # Scalars are checked inline rather than recursed into, decoding is
+    # dominated by this walk.
+    if isinstance(value, list):
+        return [_revive(v, objects) if type(v) in _CONTAINERS else v for v in value]
+    if _REF in value:
+        return objects[value[_REF]]
+    tag = value.pop(_TAG, None)
+    if tag is not None:
+        # Number the object before its children, like the encoder does.
+        index = len(objects)
+        objects.append(None)
+    revived = {
+        k: _revive(v, objects) if type(v) in _CONTAINERS else v
+        for k, v in value.items()
+    }
+    if tag is None:
+        return revived
+    if tag == _PICKLE_TAG:
+        obj = pickle.loads(base64.b64decode(revived["d"]))
+    elif tag == _TUPLE_TAG:
+        obj = tuple(revived["i"])
+    else:
+        # Fields were validated when the object was first created.
+        obj = _TYPES[tag].construct(**revived)
+    objects[index] = obj
+    return obj
+
+
+class Codec(ABC):
+    """Turns values into bytes and back."""
+
+    @abstractmethod
+    def encode(self, value: Any) -> bytes:
+        """Encode a value."""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        """Decode a value encoded by this codec."""
+
+
+class PickleCodec(Codec):
+    """The legacy format: a plain pickle."""
+
+    def encode(self, value: Any) -> bytes:
+        return pickle.dumps(value)
+
+    def decode(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class CompactCodec(Codec):
+    """Schema versioned orjson encoding, optionally zstd compressed."""
+
+    def __init__(self, compress_threshold: Optional[int] = None) -> None:
+        """
+        Args:
+            compress_threshold: Compress payloads larger than this many bytes.
+                Compression is disabled if None.
+        """
+        self.compress_threshold = compress_threshold
+        if compress_threshold is not None:
+            _get_zstd()
+
+    def encode(self, value: Any) -> bytes:
+        payload = _dumps(value)
+        flags = 0
+        if (
+            self.compress_threshold is not None
+            and len(payload) > self.compress_threshold
+        ):
+            payload = _get_zstd().ZstdCompressor().compress(payload)
+            flags |= FLAG_ZSTD
+        return MAGIC + bytes((VERSION, flags)) + payload
+
+    def decode(self, data: bytes) -> Any:
+        if not is_compact(data):
+            raise ValueError("Not a compact encoded value")
+        version, flags = data[3], data[4]
+        if version > VERSION:
+            raise ValueError(f"Unsupported compact codec version {version}")
+        payload = memoryview(data)[5:]
+        if flags & FLAG_ZSTD:
+            payload = _get_zstd().ZstdDecompressor().decompress(payload)
+        value = orjson.loads(payload)
+        return _revive(value, []) if type(value) in _CONTAINERS else value
+
+
+def _get_zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstandard package not found, please install it with "
+            "`pip install zstandard` or disable checkpoint compression"
+        ) from e
+    return zstandard
+
+
+def is_compact(data: bytes) -> bool:
+    """Whether the data was written by the compact codec."""
+    return data[:3] == MAGIC
+
+
+def decode(data: bytes) -> Any:
+    """Decode data written by any of the codecs."""
+    if is_compact(data):
+        return CompactCodec().decode(data)
+    return pickle.loads(data)
+
+
+def get_codec() -> Codec:
+    """Get the codec configured through the environment.
+
+    Pickle unless CHECKPOINT_CODEC is `compact`, which is smaller only for some
+    threads and slower to decode, see `benchmarks.checkpoint_codec`.
+    """
+    if os.environ.get("CHECKPOINT_CODEC") != "compact":
+        return PickleCodec()
+    threshold = os.environ.get("CHECKPOINT_COMPRESS_THRESHOLD")
+    return CompactCodec(int(threshold) if threshold else None)
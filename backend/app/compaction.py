@@ -0,0 +1,176 @@
+"""Summarizing the earlier messages of long threads.
+
+Off unless THREAD_SUMMARY_TOKENS is set. After a run succeeds, if the messages
+of its thread not summarized yet take more tokens than that, all but the latest
+THREAD_SUMMARY_KEEP_TOKENS of them are summarized, along with the summary so
+far, by the LLM named in THREAD_SUMMARY_LLM. This happens in the background of
+the process that executed the run, so it never delays a reply, and executors
+send the summary instead of the messages it covers from then on.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional, Sequence
+
+from langchain_core.language_models.base import LanguageModelLike
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.prompts import PromptTemplate
+
+from app import storage
+from app.context_window import (
+    THREAD_SUMMARY_TOKENS,
+    count_tokens,
+    forget_summary,
+    window_start,
+)
+from app.lifespan import get_pg_pool
+from app.llms import get_anthropic_llm, get_google_llm, get_openai_llm
+from app.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+THREAD_SUMMARY_KEEP_TOKENS = int(os.environ.get("THREAD_SUMMARY_KEEP_TOKENS", 4000))
+THREAD_SUMMARY_BATCH_TOKENS = int(os.environ.get("THREAD_SUMMARY_BATCH_TOKENS", 8000))
+"""The most tokens of messages summarized with one call to the LLM."""
+THREAD_SUMMARY_LLM = os.environ.get("THREAD_SUMMARY_LLM", "openai")
+"""openai, anthropic or google."""
+TOOL_OUTPUT_CHARS = 2000
+"""Characters of each tool output the LLM is shown."""
+
+summary_prompt = PromptTemplate.from_template(
+    """Summarize the conversation below between a human and an AI assistant \
+using tools, for the assistant to carry on from.
+
+Keep the facts, names, numbers, decisions and open questions, and what the \
+human wants and prefers. Leave out pleasantries. Write at most a few paragraphs.
+
+>>> Summary of the conversation so far:
+{summary}
+>>> END OF SUMMARY
+
+>>> Conversation since:
+{conversation}
+>>> END OF CONVERSATION
+
+Return ONLY the summary of the whole conversation."""
+)
+
+_summarized = counter("thread_summaries", "Threads summarized, by outcome.")
+
+_tasks: dict[str, asyncio.Task] = {}
+"""The threads being summarized in this process."""
+
+
+def get_summary_llm() -> LanguageModelLike:
+    if THREAD_SUMMARY_LLM == "anthropic":
+        return get_anthropic_llm()
+    if THREAD_SUMMARY_LLM == "google":
+        return get_google_llm()
+    return get_openai_llm()
+
+
+def _render(message: BaseMessage) -> Optional[str]:
+    if isinstance(message, HumanMessage):
+        return f"Human: {message.content}"
+    if isinstance(message, AIMessage):
+        calls = [
+            call["function"] for call in message.additional_kwargs.get("tool_calls", [])
+        ]
+        if "function_call" in message.additional_kwargs:
+            calls.append(message.additional_kwargs["function_call"])
+        lines = [f"AI: {message.content}"] if message.content else []
+        lines += [f"AI called {c['name']} with {c['arguments']}" for c in calls]
+        return "\n".join(lines) or None
+    content = str(message.content)
+    if len(content) > TOOL_OUTPUT_CHARS:
+        content = content[:TOOL_OUTPUT_CHARS] + "..."
+    return f"Tool output: {content}"
+
+
+async def summarize(
+    llm: LanguageModelLike, summary: str, messages: Sequence[BaseMessage]
+) -> str:
+    """Extend a summary with the messages after those it covers."""
+    batch: list[str] = []
+    tokens = 0
+    for i, message in enumerate(messages):
+        if (line := _render(message)) is not None:
+            batch.append(line)
+            tokens += count_tokens(message)
+        if batch and (tokens >= THREAD_SUMMARY_BATCH_TOKENS or i == len(messages) - 1):
+            prompt = await summary_prompt.ainvoke(
+                {"summary": summary or "(none)", "conversation": "\n".join(batch)}
+            )
+            summary = (await llm.ainvoke(prompt)).content
+            batch = []
+            tokens = 0
+    return summary
+
+
+async def _get_summary(thread_id: str) -> tuple[str, int]:
+    async with get_pg_pool().acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT summary, message_count FROM thread_summary WHERE thread_id = $1",
+            thread_id,
+        )
+    return (row["summary"], row["message_count"]) if row else ("", 0)
+
+
+async def _put_summary(thread_id: str, summary: str, message_count: int) -> None:
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            (
+                "INSERT INTO thread_summary (thread_id, summary, message_count) "
+                "VALUES ($1, $2, $3) ON CONFLICT (thread_id) DO UPDATE SET "
+                "summary = EXCLUDED.summary, "
+                "message_count = EXCLUDED.message_count, "
+                "updated_at = CURRENT_TIMESTAMP"
+            ),
+            thread_id,
+            summary,
+            message_count,
+        )
+    forget_summary(thread_id)
+
+
+async def compact_thread(thread_id: str) -> bool:
+    """Summarize the earlier messages of a thread if they take too many tokens.
+
+    Returns whether the summary was updated.
+    """
+    messages = (await storage.get_thread_messages(None, thread_id))["messages"]
+    summary, count = await _get_summary(thread_id)
+    if count > len(messages):
+        # Messages were removed since, start over.
+        summary, count = "", 0
+    pending = messages[count:]
+    if sum(count_tokens(m) for m in pending) <= THREAD_SUMMARY_TOKENS:
+        return False
+    # Up to the latest messages kept as they are, which start with one of the
+    # user's, so that the messages sent after the summary do too.
+    end = window_start(pending, THREAD_SUMMARY_KEEP_TOKENS)
+    while end > 0 and not isinstance(pending[end], HumanMessage):
+        end -= 1
+    if end == 0:
+        return False
+    summary = await summarize(get_summary_llm(), summary, pending[:end])
+    await _put_summary(thread_id, summary, count + end)
+    return True
+
+
+async def _compact(thread_id: str) -> None:
+    try:
+        updated = await compact_thread(thread_id)
+        _summarized.inc(outcome="updated" if updated else "skipped")
+    except Exception:
+        _summarized.inc(outcome="failed")
+        logger.exception("Summarizing thread %s failed", thread_id)
+    finally:
+        _tasks.pop(thread_id, None)
+
+
+def schedule(thread_id: str) -> None:
+    """Summarize the earlier messages of a thread in the background, if enabled
+    and they take too many tokens."""
+    if THREAD_SUMMARY_TOKENS and thread_id not in _tasks:
+        _tasks[thread_id] = asyncio.create_task(_compact(thread_id))
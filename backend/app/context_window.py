@@ -0,0 +1,211 @@
+"""Fitting conversations into a budget of prompt tokens.
+
+Executors send the LLM their system message and as many of the latest messages
+of the thread as fit in the budget of the model, CONTEXT_WINDOW_TOKENS, which
+assistants can lower or raise. Tokens are counted with tiktoken's cl100k_base
+encoding, that of the OpenAI models, which is close enough for the others.
+
+Tool calls are kept or dropped together with their results, and the window
+starts with a message of the user where possible, as some models require.
+
+With THREAD_SUMMARY_TOKENS set, long threads are summarized after their runs,
+see `app.compaction`, and the system message holds the summary instead of the
+messages it covers.
+"""
+import logging
+import os
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import orjson
+import tiktoken
+from langchain_core.messages import (
+    BaseMessage,
+    FunctionMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.runnables import RunnableConfig
+
+from app.cache import LRUCache
+from app.lifespan import get_pg_pool
+from app.message_types import LiberalFunctionMessage, LiberalToolMessage
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_WINDOW_TOKENS: dict[str, int] = {
+    # The context window of each model, less room for the reply.
+    "GPT 3.5 Turbo": 12_000,
+    "GPT 4 Turbo": 100_000,
+    "GPT 4 (Azure OpenAI)": 6_000,
+    "Claude 2": 90_000,
+    "Claude 2 (Amazon Bedrock)": 90_000,
+    "GEMINI": 24_000,
+    "Mixtral": 24_000,
+    **orjson.loads(os.environ.get("CONTEXT_WINDOW_TOKENS", "{}")),
+}
+"""Prompt tokens by agent or LLM type, the defaults updated with the JSON
+object in CONTEXT_WINDOW_TOKENS, e.g. '{"GPT 4 Turbo": 16000}'."""
+
+MESSAGE_TOKENS = 4
+"""Tokens every message takes besides its content, for its role and delimiters."""
+
+THREAD_SUMMARY_TOKENS = int(os.environ.get("THREAD_SUMMARY_TOKENS", 0)) or None
+"""Tokens of messages not summarized yet past which threads are summarized."""
+
+SUMMARY_TEMPLATE = """
+
+Summary of the conversation before the messages that follow:
+{summary}"""
+
+# Keyed by the texts themselves, whose hash Python keeps, and sized by their
+# length, so that the cache keeps at most TOKEN_COUNT_CACHE_BYTES of them alive.
+_counts: LRUCache[int] = LRUCache(
+    "token_counts", int(os.environ.get("TOKEN_COUNT_CACHE_BYTES", 2**24))
+)
+# Summaries only ever cover more messages, and each says how many, so using
+# one that's out of date is fine.
+_summaries: LRUCache[tuple[Optional[tuple[str, int]]]] = LRUCache(
+    "thread_summaries", 10_000, ttl=60
+)
+
+
+@lru_cache(maxsize=None)
+def _encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The encoding is downloaded on first use, which fails when offline.
+        logger.warning("Can't load tiktoken encoding, estimating tokens instead")
+        return None
+
+
+def _count_text(text: str) -> int:
+    if not text:
+        return 0
+    if (count := _counts.get(text)) is None:
+        encoding = _encoding()
+        if encoding is None:
+            count = (len(text) + 3) // 4
+        else:
+            count = len(encoding.encode(text, disallowed_special=()))
+        _counts.put(text, count, len(text))
+    return count
+
+
+def _count_message(message: BaseMessage) -> int:
+    content = message.content
+    tokens = MESSAGE_TOKENS + _count_text(
+        content if isinstance(content, str) else str(content)
+    )
+    for key in ("function_call", "tool_calls"):
+        if key in message.additional_kwargs:
+            tokens += _count_text(orjson.dumps(message.additional_kwargs[key]).decode())
+    return tokens
+
+
+def count_tokens(message: BaseMessage) -> int:
+    """The number of tokens a message takes in a prompt."""
+    if isinstance(message, (LiberalFunctionMessage, LiberalToolMessage)):
+        # Their content isn't text, so their count is kept with them rather
+        # than converting the content again for every step.
+        if message._token_count is None:
+            message._token_count = _count_message(message)
+        return message._token_count
+    return _count_message(message)
+
+
+def window_start(messages: Sequence[BaseMessage], max_tokens: int) -> int:
+    """The index of the first of the latest messages that fit in `max_tokens`.
+
+    The latest message, with the results of its tool calls, always fits. The
+    window starts with a message of the user, if it holds one.
+    """
+    # From the end, so that only the messages that fit and one more are counted.
+    start = len(messages)
+    tokens = 0
+    while start > 0:
+        # The results of tool calls go with the message making the calls.
+        end = start
+        start -= 1
+        while start > 0 and isinstance(messages[start], (ToolMessage, FunctionMessage)):
+            start -= 1
+        group_tokens = sum(count_tokens(m) for m in messages[start:end])
+        if end < len(messages) and tokens + group_tokens > max_tokens:
+            start = end
+            break
+        tokens += group_tokens
+    if start == 0:
+        return 0
+    return next(
+        (
+            i
+            for i in range(start, len(messages))
+            if isinstance(messages[i], HumanMessage)
+        ),
+        start,
+    )
+
+
+def fit_messages(
+    messages: Sequence[BaseMessage], max_tokens: Optional[int]
+) -> list[BaseMessage]:
+    """The latest messages that fit in `max_tokens`, all of them if None.
+
+    If none of the messages that fit is from the user, the latest message of the
+    user comes first, as what they answer.
+    """
+    if max_tokens is None:
+        return list(messages)
+    start = window_start(messages, max_tokens)
+    window = list(messages[start:])
+    if start == 0 or isinstance(window[0], HumanMessage):
+        return window
+    asked = next(
+        (m for m in reversed(messages[:start]) if isinstance(m, HumanMessage)), None
+    )
+    return [asked, *window] if asked is not None else window
+
+
+async def get_summary(thread_id: str) -> Optional[tuple[str, int]]:
+    """The summary of the earlier messages of a thread, and how many it covers."""
+    if (entry := _summaries.get(thread_id)) is None:
+        async with get_pg_pool().acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT summary, message_count FROM thread_summary "
+                "WHERE thread_id = $1",
+                thread_id,
+            )
+        entry = ((row["summary"], row["message_count"]) if row else None,)
+        _summaries.put(thread_id, entry)
+    return entry[0]
+
+
+def forget_summary(thread_id: str) -> None:
+    """Read the summary of a thread again next time, once it changed."""
+    _summaries.pop(thread_id)
+
+
+async def fit_prompt(
+    system_message: str,
+    messages: Sequence[BaseMessage],
+    config: RunnableConfig,
+    max_tokens: Optional[int],
+) -> tuple[SystemMessage, list[BaseMessage]]:
+    """The system message and the latest messages that fit with it in
+    `max_tokens`, all of them if None.
+
+    If the earlier messages of the thread are summarized, the system message
+    holds the summary, and only messages after those it covers are sent.
+    """
+    thread_id = config.get("configurable", {}).get("thread_id")
+    if THREAD_SUMMARY_TOKENS and thread_id is not None:
+        summary = await get_summary(str(thread_id))
+        if summary is not None and summary[1] <= len(messages):
+            system_message += SUMMARY_TEMPLATE.format(summary=summary[0])
+            messages = messages[summary[1] :]
+    system = SystemMessage(content=system_message)
+    if max_tokens is not None:
+        max_tokens -= count_tokens(system)
+    return system, fit_messages(messages, max_tokens)
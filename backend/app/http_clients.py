@@ -0,0 +1,116 @@
+"""HTTP clients shared by the LLMs of each provider.
+
+Each provider gets one httpx client, whose pool keeps up to
+HTTP_MAX_KEEPALIVE_CONNECTIONS connections alive for HTTP_KEEPALIVE_EXPIRY
+seconds, so that calls don't each pay for a TLS handshake. Each pool opens at
+most HTTP_MAX_CONNECTIONS connections, which HTTP_CONNECTION_LIMITS can set per
+provider, e.g. '{"openai": 200}'. Connections use HTTP/2 when HTTP2 is true and
+the h2 package is installed, so that concurrent calls share them.
+
+LLMs are cached for the life of the process, so the clients are too. On
+shutdown, the lifespan closes their connections; they reconnect if used again.
+"""
+import importlib.util
+import logging
+import os
+from typing import Optional
+
+import httpx
+import orjson
+from botocore.config import Config
+
+from app.metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_CONNECTION_LIMITS: dict[str, int] = orjson.loads(
+    os.environ.get("HTTP_CONNECTION_LIMITS", "{}")
+)
+HTTP2 = os.environ.get("HTTP2", "true") == "true"
+
+_requests = counter("http_requests", "Requests to LLM providers, by provider.")
+_connections = gauge(
+    "http_connections",
+    "Connections to LLM providers, by provider and state (active or idle).",
+)
+
+_transports: dict[str, httpx.AsyncHTTPTransport] = {}
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _max_connections(provider: str) -> int:
+    return HTTP_CONNECTION_LIMITS.get(provider, HTTP_MAX_CONNECTIONS)
+
+
+def _http2() -> bool:
+    if HTTP2 and importlib.util.find_spec("h2") is None:
+        logger.warning("h2 is not installed, connecting with HTTP/1.1")
+        return False
+    return HTTP2
+
+
+def _pool_connections(transport: httpx.AsyncHTTPTransport) -> Optional[list]:
+    """The connections of a transport's pool, which httpx doesn't expose, so
+    None if a newer httpx keeps them elsewhere."""
+    return getattr(getattr(transport, "_pool", None), "connections", None)
+
+
+def _update_connections(provider: str) -> None:
+    connections = _pool_connections(_transports[provider])
+    if connections is None:
+        return
+    idle = sum(1 for c in connections if c.is_idle())
+    _connections.set(len(connections) - idle, provider=provider, state="active")
+    _connections.set(idle, provider=provider, state="idle")
+
+
+def get_http_client(provider: str, proxy: Optional[str] = None) -> httpx.AsyncClient:
+    """The client for calls to a provider, e.g. "openai"."""
+    if provider not in _clients:
+        max_connections = _max_connections(provider)
+        _transports[provider] = transport = httpx.AsyncHTTPTransport(
+            http2=_http2(),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=min(
+                    HTTP_MAX_KEEPALIVE_CONNECTIONS, max_connections
+                ),
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            proxy=httpx.Proxy(proxy) if proxy else None,
+        )
+        if _pool_connections(transport) is None:
+            logger.warning(
+                "Can't count the connections to %s with this httpx", provider
+            )
+
+        async def on_request(request: httpx.Request) -> None:
+            _requests.inc(provider=provider)
+
+        async def on_response(response: httpx.Response) -> None:
+            _update_connections(provider)
+
+        _clients[provider] = httpx.AsyncClient(
+            transport=transport,
+            follow_redirects=True,
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+    return _clients[provider]
+
+
+def get_boto_config(provider: str) -> Config:
+    """The config of boto3 clients for a provider, e.g. "bedrock", which pool
+    connections themselves."""
+    return Config(max_pool_connections=_max_connections(provider), tcp_keepalive=True)
+
+
+async def close_connections() -> None:
+    """Close the connections of all clients."""
+    for provider, transport in _transports.items():
+        await transport.aclose()
+        _update_connections(provider)
@@ -1,17 +1,73 @@
+import asyncio
+import logging
 import os
+from collections import defaultdict
 from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
 
 import asyncpg
 import orjson
 from fastapi import FastAPI
 
+from app.http_clients import close_connections
+
+logger = logging.getLogger(__name__)
+
+PING_CHANNEL = "lifespan_ping"
+"""Notified by the listening connection to itself, to confirm delivery."""
+PING_TIMEOUT = 5.0
+
 _pg_pool = None
+_listen_conn = None
+_listening = False
+_reconnect_task: Optional[asyncio.Task] = None
+_listeners: dict[str, list[Callable[[str], None]]] = defaultdict(list)
+_reset_listeners: list[Callable[[], None]] = []
+_periodic: list[tuple[float, Callable[[], Awaitable[None]]]] = []
+_periodic_tasks: list[asyncio.Task] = []
 
 
 def get_pg_pool() -> asyncpg.pool.Pool:
     return _pg_pool
 
 
+def add_listener(channel: str, callback: Callable[[str], None]) -> None:
+    """Call `callback` with the payload of every NOTIFY on `channel`.
+
+    Listeners are usually added at import time, but can be added while the app
+    runs, in which case notifications are delivered from shortly after.
+    """
+    new = channel not in _listeners
+    _listeners[channel].append(callback)
+    if new and _listen_conn is not None:
+        asyncio.get_running_loop().create_task(
+            _listen_conn.add_listener(channel, _dispatch)
+        )
+
+
+def add_reset_listener(callback: Callable[[], None]) -> None:
+    """Call `callback` when notifications are delivered again after the
+    connection listening for them was lost, so some may have been missed."""
+    _reset_listeners.append(callback)
+
+
+def add_periodic(interval: float, callback: Callable[[], Awaitable[None]]) -> None:
+    """Await `callback` every `interval` seconds while the app runs, in every
+    process, e.g. to delete expired rows. Add these at import time."""
+    _periodic.append((interval, callback))
+
+
+def listening() -> bool:
+    """Whether notifications are being delivered. False while the connection
+    listening for them is being reestablished."""
+    return _listening
+
+
+def _dispatch(conn, pid: int, channel: str, payload: str) -> None:
+    for callback in _listeners[channel]:
+        callback(payload)
+
+
 async def _init_connection(conn) -> None:
     await conn.set_type_codec(
         "json",
@@ -21,9 +77,82 @@ async def _init_connection(conn) -> None:
     )
 
 
+async def _confirm_delivery(conn: asyncpg.Connection) -> None:
+    """Wait for a NOTIFY sent by the connection to reach it."""
+    received = asyncio.get_running_loop().create_future()
+
+    def on_ping(*args) -> None:
+        if not received.done():
+            received.set_result(None)
+
+    await conn.add_listener(PING_CHANNEL, on_ping)
+    try:
+        await conn.execute("SELECT pg_notify($1, '');", PING_CHANNEL)
+        await asyncio.wait_for(received, PING_TIMEOUT)
+    finally:
+        await conn.remove_listener(PING_CHANNEL, on_ping)
+
+
+async def _listen() -> None:
+    """Acquire a connection and listen on it for the notifications of all
+    channels with listeners."""
+    global _listen_conn, _listening
+    conn = await _pg_pool.acquire()
+    try:
+        for channel in list(_listeners):
+            await conn.add_listener(channel, _dispatch)
+        await _confirm_delivery(conn)
+    except BaseException:
+        await _pg_pool.release(conn)
+        raise
+    conn.add_termination_listener(_on_terminated)
+    _listen_conn = conn
+    _listening = True
+
+
+async def _reconnect(lost: asyncpg.Connection) -> None:
+    global _reconnect_task
+    await _pg_pool.release(lost)
+    delay = 0.5
+    while True:
+        try:
+            await _listen()
+        except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+            logger.warning(
+                "Listening for notifications failed (%r), retrying in %gs", e, delay
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+        else:
+            break
+    logger.info("Listening for notifications again")
+    _reconnect_task = None
+    for callback in _reset_listeners:
+        callback()
+
+
+async def _every(interval: float, callback: Callable[[], Awaitable[None]]) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await callback()
+        except Exception:
+            logger.exception("Periodic task %s failed", callback.__qualname__)
+
+
+def _on_terminated(conn: asyncpg.Connection) -> None:
+    global _listen_conn, _listening, _reconnect_task
+    if conn is not _listen_conn:
+        return
+    logger.warning("Lost the connection listening for notifications, reconnecting")
+    _listen_conn = None
+    _listening = False
+    _reconnect_task = asyncio.get_running_loop().create_task(_reconnect(conn))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _pg_pool
+    global _pg_pool, _listen_conn, _listening, _reconnect_task
 
     _pg_pool = await asyncpg.create_pool(
         database=os.environ["POSTGRES_DB"],
@@ -33,6 +162,23 @@ async def lifespan(app: FastAPI):
         port=os.environ["POSTGRES_PORT"],
         init=_init_connection,
     )
+    await _listen()
+    for interval, callback in _periodic:
+        _periodic_tasks.append(asyncio.create_task(_every(interval, callback)))
     yield
+    _listening = False
+    for task in _periodic_tasks:
+        task.cancel()
+    _periodic_tasks.clear()
+    if _reconnect_task is not None:
+        _reconnect_task.cancel()
+        _reconnect_task = None
+    if _listen_conn is not None:
+        conn, _listen_conn = _listen_conn, None
+        conn.remove_termination_listener(_on_terminated)
+        for channel in _listeners:
+            await conn.remove_listener(channel, _dispatch)
+        await _pg_pool.release(conn)
     await _pg_pool.close()
     _pg_pool = None
+    await close_connections()
@@ -1,39 +1,39 @@
 import logging
 import os
 from functools import lru_cache
+from typing import Any
 from urllib.parse import urlparse
 
 import boto3
 import httpx
+import openai
 from langchain_community.chat_models import BedrockChat, ChatAnthropic, ChatFireworks
 from langchain_google_vertexai import ChatVertexAI
 from langchain_openai import AzureChatOpenAI, ChatOpenAI
 
+from app.http_clients import get_boto_config, get_http_client
+
 logger = logging.getLogger(__name__)
 
 
 @lru_cache(maxsize=4)
 def get_openai_llm(gpt_4: bool = False, azure: bool = False):
     proxy_url = os.getenv("PROXY_URL")
-    http_client = None
     if proxy_url:
         parsed_url = urlparse(proxy_url)
-        if parsed_url.scheme and parsed_url.netloc:
-            http_client = httpx.AsyncClient(proxies=proxy_url)
-        else:
+        if not (parsed_url.scheme and parsed_url.netloc):
             logger.warn("Invalid proxy URL provided. Proceeding without proxy.")
+            proxy_url = None
 
     if not azure:
         openai_model = "gpt-4-turbo-preview" if gpt_4 else "gpt-3.5-turbo"
         llm = ChatOpenAI(
-            http_client=http_client,
             model=openai_model,
             temperature=0,
             streaming=True,
         )
     else:
         llm = AzureChatOpenAI(
-            http_client=http_client,
             temperature=0,
             deployment_name=os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"],
             openai_api_base=os.environ["AZURE_OPENAI_API_BASE"],
@@ -41,9 +41,28 @@ def get_openai_llm(gpt_4: bool = False, azure: bool = False):
             openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
             streaming=True,
         )
+    llm.async_client = _with_http_client(
+        llm.async_client,
+        get_http_client("azure" if azure else "openai", proxy=proxy_url),
+    )
     return llm
 
 
+def _with_http_client(completions: Any, http_client: httpx.AsyncClient) -> Any:
+    """The chat completions of a copy of their OpenAI client using `http_client`.
+
+    The http_client argument of the LLM would also go to the sync client, so the
+    async client built from the other arguments is copied instead. It is only
+    reachable through a private attribute, so if that is gone the completions
+    are returned as they are, with their own connections.
+    """
+    client = getattr(completions, "_client", None)
+    if not isinstance(client, openai.AsyncOpenAI):
+        logger.warning("Can't share HTTP connections with this openai version")
+        return completions
+    return client.copy(http_client=http_client).chat.completions
+
+
 @lru_cache(maxsize=2)
 def get_anthropic_llm(bedrock: bool = False):
     if bedrock:
@@ -52,10 +71,14 @@ def get_anthropic_llm(bedrock: bool = False):
             region_name="us-west-2",
             aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
             aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+            config=get_boto_config("bedrock"),
         )
         model = BedrockChat(model_id="anthropic.claude-v2", client=client)
     else:
         model = ChatAnthropic(temperature=0, max_tokens_to_sample=2000)
+        model.async_client = model.async_client.copy(
+            http_client=get_http_client("anthropic")
+        )
     return model
 
 
@@ -1,11 +1,51 @@
-from typing import Any
+from typing import Any, Optional
 
 from langchain_core.messages import FunctionMessage, ToolMessage
+from langchain_core.pydantic_v1 import PrivateAttr
+
+
+def _without_converted(state: dict) -> dict:
+    # The conversion is rebuilt when needed, rather than pickled along with the
+    # message it duplicates.
+    private = state["__private_attribute_values__"]
+    if private.get("_converted") is not None:
+        state["__private_attribute_values__"] = {**private, "_converted": None}
+    return state
 
 
 class LiberalFunctionMessage(FunctionMessage):
     content: Any
 
+    # Messages stay in memory for the whole run, so each is converted, and
+    # its tokens counted, once.
+    _converted: Optional[FunctionMessage] = PrivateAttr(default=None)
+    _token_count: Optional[int] = PrivateAttr(default=None)
+
+    def to_message(self) -> FunctionMessage:
+        """This message with its content as a string, as LLMs take it."""
+        if self._converted is None:
+            _dict = self.dict()
+            _dict["content"] = str(_dict["content"])
+            self._converted = FunctionMessage(**_dict)
+        return self._converted
+
+    def __getstate__(self) -> dict:
+        return _without_converted(super().__getstate__())
+
 
 class LiberalToolMessage(ToolMessage):
     content: Any
+
+    _converted: Optional[ToolMessage] = PrivateAttr(default=None)
+    _token_count: Optional[int] = PrivateAttr(default=None)
+
+    def to_message(self) -> ToolMessage:
+        """This message with its content as a string, as LLMs take it."""
+        if self._converted is None:
+            _dict = self.dict()
+            _dict["content"] = str(_dict["content"])
+            self._converted = ToolMessage(**_dict)
+        return self._converted
+
+    def __getstate__(self) -> dict:
+        return _without_converted(super().__getstate__())
@@ -0,0 +1,164 @@
+"""In-process metrics, exposed as JSON on /metrics.
+
+Metrics are created once at import time and updated from anywhere:
+
+    hits = counter("checkpoint_cache_hits", "Checkpoint cache hits.")
+    hits.inc()
+"""
+import bisect
+import threading
+from collections import defaultdict
+from typing import Any, Sequence, Union
+
+_lock = threading.Lock()
+_registry: dict[str, "Metric"] = {}
+
+
+def _key(labels: dict[str, Any]) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metric:
+    type: str
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+
+    def _values(self) -> list[dict]:
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        return {
+            "type": self.type,
+            "description": self.description,
+            "values": self._values(),
+        }
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        self._counts: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        with _lock:
+            self._counts[_key(labels)] += amount
+
+    def value(self, **labels: Any) -> float:
+        return self._counts.get(_key(labels), 0)
+
+    def _values(self) -> list[dict]:
+        with _lock:
+            counts = list(self._counts.items())
+        return [{"labels": dict(k), "value": v} for k, v in counts]
+
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        self._gauges: dict[tuple, float] = defaultdict(float)
+
+    def set(self, value: float, **labels: Any) -> None:
+        with _lock:
+            self._gauges[_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        with _lock:
+            self._gauges[_key(labels)] += amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        return self._gauges.get(_key(labels), 0)
+
+    def _values(self) -> list[dict]:
+        with _lock:
+            gauges = list(self._gauges.items())
+        return [{"labels": dict(k), "value": v} for k, v in gauges]
+
+
+class Histogram(Metric):
+    """Counts of observed values by the buckets they fall in."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float]) -> None:
+        super().__init__(name, description)
+        self.buckets = sorted(buckets)
+        # Per label set: a count per bucket and one for values above them all,
+        # the sum and the count of the observed values.
+        self._values_by_key: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            values = self._values_by_key.setdefault(
+                _key(labels), [[0] * (len(self.buckets) + 1), 0.0, 0]
+            )
+            values[0][index] += 1
+            values[1] += value
+            values[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        values = self._values_by_key.get(_key(labels))
+        return values[2] if values else 0
+
+    def _values(self) -> list[dict]:
+        with _lock:
+            items = [
+                (k, list(counts), total, count)
+                for k, (counts, total, count) in self._values_by_key.items()
+            ]
+        result = []
+        for k, counts, total, count in items:
+            # Cumulative, each bucket counts the values less than or equal to it.
+            buckets, cumulative = {}, 0
+            for bound, n in zip([*self.buckets, "+Inf"], counts):
+                cumulative += n
+                buckets[str(bound)] = cumulative
+            result.append(
+                {"labels": dict(k), "buckets": buckets, "sum": total, "count": count}
+            )
+        return result
+
+
+def _get_or_create(cls: type, name: str, *args: Any) -> Any:
+    with _lock:
+        if name not in _registry:
+            _registry[name] = cls(name, *args)
+        metric = _registry[name]
+    if not isinstance(metric, cls):
+        raise ValueError(f"Metric {name} is a {metric.type}")
+    return metric
+
+
+def counter(name: str, description: str) -> Counter:
+    """Get or create a counter."""
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name: str, description: str) -> Gauge:
+    """Get or create a gauge."""
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name: str, description: str, buckets: Sequence[float]) -> Histogram:
+    """Get or create a histogram with the given upper bounds for its buckets."""
+    return _get_or_create(Histogram, name, description, buckets)
+
+
+def snapshot() -> dict[str, dict[str, Union[str, list]]]:
+    """The current value of every metric."""
+    with _lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
@@ -0,0 +1,169 @@
+"""Relay of streamed runs to the processes not executing them.
+
+A run streams into a buffer in the process executing it, which any number of
+clients of that process follow. Clients of other processes follow a mirror of
+that buffer: the first of them in a process notifies RUN_FOLLOWERS_CHANNEL, the
+executing process then writes the run's events to the run_event table and
+notifies RUN_EVENTS_CHANNEL, for the mirrors to read them. Events keep their
+IDs, so clients can resume with Last-Event-ID on any process.
+
+Events are only written for runs followed from other processes, each one
+holding the messages that changed since the previous one. Every process deletes
+those of runs that ended over STREAM_BUFFER_TTL seconds ago, every
+RUN_EVENTS_SWEEP_SECONDS, so they don't outlive a crashed process either.
+"""
+import asyncio
+import logging
+import os
+from uuid import UUID
+
+from app import codec, run_manager, storage
+from app.lifespan import add_listener, add_periodic
+from app.stream import STREAM_BUFFER_TTL, StreamBuffer, changed_from
+
+logger = logging.getLogger(__name__)
+
+# Mirrors check the run every RELAY_CHECK_SECONDS, in case its process stopped.
+RELAY_CHECK_SECONDS = float(os.environ.get("RELAY_CHECK_SECONDS", 5))
+RUN_EVENTS_SWEEP_SECONDS = float(os.environ.get("RUN_EVENTS_SWEEP_SECONDS", 60))
+
+_publishers: dict[UUID, asyncio.Task] = {}
+"""The runs of this process whose events are written for other processes."""
+
+_mirrors: dict[UUID, "_Mirror"] = {}
+"""The runs of other processes followed from this one."""
+
+
+class RunFailed(Exception):
+    """The run followed from another process failed."""
+
+
+async def _publish(run_id: UUID, buffer: StreamBuffer) -> None:
+    pending: list[tuple[int, bytes]] = []
+    ready = asyncio.Event()
+    encoding = codec.get_codec()
+
+    async def encode() -> None:
+        # In order, as each event holds the change from the previous one.
+        sent: list = []
+        last_id = 0
+        error = False
+        try:
+            async for id, chunk in buffer.follow():
+                if isinstance(chunk, str):
+                    event = {"metadata": chunk}
+                else:
+                    # Chunks evicted before they were written are skipped, the
+                    # mirrors start over from the whole list.
+                    index = changed_from(sent, chunk) if id == last_id + 1 else 0
+                    event = {"index": index, "messages": chunk[index:]}
+                    sent = chunk
+                last_id = id
+                pending.append((id, encoding.encode(event)))
+                ready.set()
+        except Exception:
+            error = True
+        pending.append((last_id + 1, encoding.encode({"end": error})))
+        ready.set()
+
+    encoder = asyncio.create_task(encode())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            events = pending[:]
+            del pending[:]
+            # Slow writes delay the mirrors only, never the run.
+            await storage.put_run_events(run_id, events)
+            if encoder.done() and not pending:
+                break
+    except Exception:
+        logger.exception("Relaying run %s failed", run_id)
+    finally:
+        encoder.cancel()
+        _publishers.pop(run_id, None)
+
+
+class _Mirror:
+    """Follows the events of a run written by the process executing it."""
+
+    def __init__(self, user_id: str, run_id: UUID) -> None:
+        self.user_id = user_id
+        self.run_id = run_id
+        self.buffer = StreamBuffer()
+        self.notified = asyncio.Event()
+        self._messages: list = []
+
+    async def run(self) -> None:
+        try:
+            await storage.follow_run(self.run_id)
+            while not self.buffer.done:
+                self.notified.clear()
+                await self._fetch()
+                if self.buffer.done:
+                    break
+                try:
+                    await asyncio.wait_for(self.notified.wait(), RELAY_CHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    await self._check()
+            await asyncio.sleep(STREAM_BUFFER_TTL)
+        except Exception as e:
+            logger.exception("Following run %s failed", self.run_id)
+            if not self.buffer.done:
+                self.buffer.close(e)
+        finally:
+            _mirrors.pop(self.run_id, None)
+
+    async def _fetch(self) -> None:
+        for id, data in await storage.get_run_events(self.run_id, self.buffer.last_id):
+            event = codec.decode(data)
+            if "end" in event:
+                self.buffer.close(RunFailed() if event["end"] else None)
+                return
+            if "metadata" in event:
+                self.buffer.append(event["metadata"], id)
+            else:
+                self._messages = self._messages[: event["index"]] + event["messages"]
+                self.buffer.append(self._messages, id)
+
+    async def _check(self) -> None:
+        run = await storage.get_run(self.user_id, self.run_id)
+        if run is None or run["status"] not in ("queued", "running"):
+            # Its process stopped before writing the end of the stream.
+            await self._fetch()
+            if not self.buffer.done:
+                self.buffer.close()
+        elif self.buffer.last_id == 0:
+            # The run may not have been streaming yet when first asked.
+            await storage.follow_run(self.run_id)
+
+
+def follow(user_id: str, run_id: UUID) -> StreamBuffer:
+    """The buffer of a run streamed by another process, mirrored in this one."""
+    if (mirror := _mirrors.get(run_id)) is None:
+        mirror = _mirrors[run_id] = _Mirror(user_id, run_id)
+        asyncio.create_task(mirror.run())
+    return mirror.buffer
+
+
+def _on_followed(payload: str) -> None:
+    run_id = UUID(payload)
+    if run_id in _publishers:
+        return
+    if (buffer := run_manager.get_stream(run_id)) is not None:
+        _publishers[run_id] = asyncio.create_task(_publish(run_id, buffer))
+
+
+def _on_events(payload: str) -> None:
+    if (mirror := _mirrors.get(UUID(payload))) is not None:
+        mirror.notified.set()
+
+
+async def _sweep() -> None:
+    if deleted := await storage.delete_expired_run_events(STREAM_BUFFER_TTL):
+        logger.info("Deleted %d expired run events", deleted)
+
+
+add_listener(storage.RUN_FOLLOWERS_CHANNEL, _on_followed)
+add_listener(storage.RUN_EVENTS_CHANNEL, _on_events)
+add_periodic(RUN_EVENTS_SWEEP_SECONDS, _sweep)
@@ -1,5 +1,12 @@
+import asyncio
 import json
+import logging
+import math
+import os
+import re
+from typing import Optional
 
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.base import LanguageModelLike
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate
@@ -9,7 +16,23 @@ from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.message import MessageGraph
 
+from app.context_window import count_tokens, fit_messages
 from app.message_types import LiberalFunctionMessage
+from app.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_SPECULATION = os.environ.get("RETRIEVAL_SPECULATION") == "true"
+"""Whether to retrieve with the latest message while the search query is written."""
+RETRIEVAL_SPECULATION_SIMILARITY = float(
+    os.environ.get("RETRIEVAL_SPECULATION_SIMILARITY", 0.9)
+)
+"""The least cosine similarity of the message and query to use what was retrieved."""
+
+_speculations = counter(
+    "retrieval_speculations",
+    "Retrievals with the latest message, by whether their results were used.",
+)
 
 search_prompt = PromptTemplate.from_template(
     """Given the conversation below, come up with a search query to look up.
@@ -33,12 +56,46 @@ Respond to the user using ONLY the context provided below. Do not make anything
 {context}"""
 
 
+def _normalize_query(query: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", query).split()).casefold()
+
+
+def _cosine_similarity(a: list[float], b: list[float]) -> float:
+    norms = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norms if norms else 0.0
+
+
+def _function_call(query: str) -> AIMessage:
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "function_call": {
+                "name": "retrieval",
+                "arguments": json.dumps({"query": query}),
+            }
+        },
+    )
+
+
 def get_retrieval_executor(
     llm: LanguageModelLike,
     retriever: BaseRetriever,
     system_message: str,
     checkpoint: BaseCheckpointSaver,
+    speculative: bool = False,
+    embeddings: Optional[Embeddings] = None,
+    max_tokens: Optional[int] = None,
 ):
+    """Make a graph answering with documents retrieved for the conversation.
+
+    Follow-up messages are rewritten into a search query by the LLM. If
+    `speculative`, retrieval with the message itself starts meanwhile, and its
+    results are used if the query turns out to be the same once normalized or,
+    given `embeddings`, close enough to the message. The conversation is cut to
+    the latest messages fitting in `max_tokens`, if given. The retriever is
+    called with the config of the run, e.g. to search the files of its thread.
+    """
+
     def _get_messages(messages):
         chat_history = []
         for m in messages:
@@ -49,18 +106,19 @@ def get_retrieval_executor(
                 chat_history.append(m)
         response = messages[-1].content
         content = "\n".join([d.page_content for d in response])
-        return [
-            SystemMessage(
-                content=response_prompt_template.format(
-                    instructions=system_message, context=content
-                )
+        system = SystemMessage(
+            content=response_prompt_template.format(
+                instructions=system_message, context=content
             )
-        ] + chat_history
+        )
+        if max_tokens:
+            chat_history = fit_messages(chat_history, max_tokens - count_tokens(system))
+        return [system] + chat_history
 
     @chain
     async def get_search_query(messages):
         convo = []
-        for m in messages:
+        for m in fit_messages(messages, max_tokens):
             if isinstance(m, AIMessage):
                 if "function_call" not in m.additional_kwargs:
                     convo.append(f"AI: {m.content}")
@@ -74,43 +132,96 @@ def get_retrieval_executor(
     async def invoke_retrieval(messages):
         if len(messages) == 1:
             human_input = messages[-1].content
-            return AIMessage(
-                content="",
-                additional_kwargs={
-                    "function_call": {
-                        "name": "retrieval",
-                        "arguments": json.dumps({"query": human_input}),
-                    }
-                },
-            )
+            return _function_call(human_input)
         else:
             search_query = await get_search_query.ainvoke(messages)
-            return AIMessage(
-                content="",
-                additional_kwargs={
-                    "function_call": {
-                        "name": "retrieval",
-                        "arguments": json.dumps({"query": search_query}),
-                    }
-                },
-            )
+            return _function_call(search_query)
 
-    async def retrieve(messages):
+    async def retrieve(messages, config):
         params = messages[-1].additional_kwargs["function_call"]
         query = json.loads(params["arguments"])["query"]
-        response = await retriever.ainvoke(query)
+        response = await retriever.ainvoke(query, config)
         msg = LiberalFunctionMessage(name="retrieval", content=response)
         return msg
 
+    async def retrieve_speculatively(messages, config):
+        """Retrieve with the latest message while the search query is written."""
+        message = messages[-1].content
+        speculation = asyncio.ensure_future(retriever.ainvoke(message, config))
+        message_embedding = (
+            asyncio.ensure_future(embeddings.aembed_query(message))
+            if embeddings is not None
+            else None
+        )
+        try:
+            query = await get_search_query.ainvoke(messages)
+            similarity = None
+            if _normalize_query(query) == _normalize_query(message):
+                outcome = "same"
+            elif message_embedding is not None:
+                # On a miss this embeds the query once more to retrieve with it,
+                # a small price next to the LLM call retrieval no longer waits for.
+                query_embedding = await embeddings.aembed_query(query)
+                similarity = _cosine_similarity(
+                    await message_embedding, query_embedding
+                )
+                if similarity >= RETRIEVAL_SPECULATION_SIMILARITY:
+                    outcome = "similar"
+                else:
+                    outcome = "different"
+            else:
+                outcome = "different"
+            _speculations.inc(outcome=outcome)
+            logger.info(
+                "Speculative retrieval %s: the query was %s (similarity %s)",
+                "discarded" if outcome == "different" else "used",
+                outcome,
+                similarity,
+            )
+            logger.debug("Message: %r, search query: %r", message, query)
+            if outcome == "different":
+                speculation.cancel()
+                documents = await retriever.ainvoke(query, config)
+            else:
+                documents = await speculation
+        finally:
+            speculation.cancel()
+            if message_embedding is not None:
+                message_embedding.cancel()
+        return [
+            _function_call(query),
+            LiberalFunctionMessage(name="retrieval", content=documents),
+        ]
+
+    async def invoke_and_retrieve(messages, config):
+        if len(messages) > 1:
+            return await retrieve_speculatively(messages, config)
+        human_input = messages[-1].content
+        return [
+            _function_call(human_input),
+            LiberalFunctionMessage(
+                name="retrieval",
+                content=await retriever.ainvoke(human_input, config),
+            ),
+        ]
+
     response = _get_messages | llm
 
     workflow = MessageGraph()
-    workflow.add_node("invoke_retrieval", invoke_retrieval)
-    workflow.add_node("retrieve", retrieve)
+    if speculative:
+        # The search query and documents come together, so that retrieval
+        # can start before the query is written.
+        workflow.add_node("invoke_retrieval", invoke_and_retrieve)
+    else:
+        workflow.add_node("invoke_retrieval", invoke_retrieval)
+        workflow.add_node("retrieve", retrieve)
     workflow.add_node("response", response)
     workflow.set_entry_point("invoke_retrieval")
-    workflow.add_edge("invoke_retrieval", "retrieve")
-    workflow.add_edge("retrieve", "response")
+    if speculative:
+        workflow.add_edge("invoke_retrieval", "response")
+    else:
+        workflow.add_edge("invoke_retrieval", "retrieve")
+        workflow.add_edge("retrieve", "response")
     workflow.add_edge("response", END)
     app = workflow.compile(checkpointer=checkpoint)
     return app
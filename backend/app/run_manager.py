@@ -0,0 +1,227 @@
+"""Runs of assistants on threads.
+
+Every run is recorded in the run table and executes in its own asyncio task,
+so that it can be observed and cancelled at any point, including while it waits
+on an LLM or a tool.
+
+With RUN_QUEUE=postgres, background runs are queued in the run table instead,
+for `python -m app.worker` processes to execute. Streamed runs always execute
+in the process serving the stream.
+
+Runs executing in the process that created them are heartbeated every
+RUN_HEARTBEAT_SECONDS. Those whose process stopped heartbeating them for
+RUN_STALE_SECONDS, e.g. because it crashed, are failed by any other process.
+"""
+import asyncio
+import logging
+import os
+import socket
+from typing import Any, Awaitable, Callable, Optional
+from uuid import UUID, uuid4
+
+from app import compaction, storage
+from app.lifespan import add_listener, add_periodic
+from app.schema import Run
+from app.stream import STREAM_BUFFER_TTL, MessagesStream, StreamBuffer
+
+logger = logging.getLogger(__name__)
+
+QUEUE_RUNS = os.environ.get("RUN_QUEUE") == "postgres"
+RUN_HEARTBEAT_SECONDS = float(os.environ.get("RUN_HEARTBEAT_SECONDS", 10))
+RUN_STALE_SECONDS = float(os.environ.get("RUN_STALE_SECONDS", 60))
+
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+"""Recorded as the worker of the runs this process creates and executes."""
+
+_tasks: dict[UUID, asyncio.Task] = {}
+"""The runs executing in this process, by run ID."""
+
+_interrupted: set[UUID] = set()
+"""Runs being stopped without recording them as cancelled."""
+
+_streams: dict[UUID, StreamBuffer] = {}
+"""The buffers of the runs streamed by this process, by run ID."""
+
+
+async def _execute(
+    run_id: UUID,
+    thread_id: str,
+    run: Callable[[], Awaitable[Any]],
+    *,
+    claimed: bool = False,
+) -> None:
+    try:
+        if not claimed:
+            await storage.update_run(run_id, "running", worker_id=PROCESS_ID)
+        await run()
+    except asyncio.CancelledError:
+        if run_id not in _interrupted:
+            await storage.update_run(run_id, "cancelled")
+        raise
+    except Exception as e:
+        logger.exception("Run %s failed", run_id)
+        # Only the type, the message may contain sensitive information.
+        await storage.update_run(run_id, "failed", error=type(e).__name__)
+    else:
+        await storage.update_run(run_id, "succeeded")
+        compaction.schedule(thread_id)
+
+
+async def start(
+    user_id: str,
+    thread_id: str,
+    assistant_id: Optional[str],
+    run: Callable[[], Awaitable[Any]],
+    *,
+    on_done: Optional[Callable[[], None]] = None,
+) -> Run:
+    """Record a run and start executing it in the background.
+
+    Args:
+        user_id: The user creating the run.
+        thread_id: The thread to run on.
+        assistant_id: The assistant to run.
+        run: Called once to get the coroutine doing the work.
+        on_done: Called once the run is done, however it ends, including if it
+            could not be recorded.
+    """
+    try:
+        record = await storage.put_run(
+            user_id, thread_id=thread_id, assistant_id=assistant_id
+        )
+    except BaseException:
+        if on_done is not None:
+            on_done()
+        raise
+    task = _spawn(record["run_id"], _execute(record["run_id"], thread_id, run))
+    if on_done is not None:
+        task.add_done_callback(lambda _: on_done())
+    return record
+
+
+def _spawn(run_id: UUID, coro: Awaitable[None]) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _tasks[run_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(run_id, None))
+    return task
+
+
+async def enqueue(
+    user_id: str,
+    thread_id: str,
+    assistant_id: Optional[str],
+    input: Any,
+    config: dict,
+) -> Run:
+    """Queue a run for the workers.
+
+    Args:
+        user_id: The user creating the run.
+        thread_id: The thread to run on.
+        assistant_id: The assistant to run.
+        input: The input of the run, as JSON.
+        config: The config to run with, as JSON.
+    """
+    return await storage.enqueue_run(
+        user_id,
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        input=input,
+        config=config,
+    )
+
+
+def execute(
+    run_id: UUID, thread_id: str, run: Callable[[], Awaitable[Any]]
+) -> asyncio.Task:
+    """Execute a run a worker claimed from the queue."""
+    return _spawn(run_id, _execute(run_id, thread_id, run, claimed=True))
+
+
+async def start_stream(
+    user_id: str,
+    thread_id: str,
+    assistant_id: Optional[str],
+    messages_stream: MessagesStream,
+    *,
+    on_done: Optional[Callable[[], None]] = None,
+) -> tuple[Run, StreamBuffer]:
+    """Record a run and start consuming its messages stream in the background.
+
+    Returns the run and the buffer its messages stream into. The run goes on
+    when clients stop following the buffer, and the buffer is kept for
+    STREAM_BUFFER_TTL seconds after the run ends for clients to resume from.
+    """
+    buffer = StreamBuffer()
+
+    async def run() -> None:
+        try:
+            async for chunk in messages_stream:
+                # Copied, since the stream keeps updating the same list.
+                buffer.append(list(chunk) if isinstance(chunk, list) else chunk)
+        except Exception as e:
+            buffer.close(e)
+            raise
+
+    record = await start(user_id, thread_id, assistant_id, run, on_done=on_done)
+    run_id = record["run_id"]
+    _streams[run_id] = buffer
+
+    def done(_: asyncio.Task) -> None:
+        if not buffer.done:
+            buffer.close()
+        asyncio.get_running_loop().call_later(
+            STREAM_BUFFER_TTL, _streams.pop, run_id, None
+        )
+
+    _tasks[run_id].add_done_callback(done)
+    return record, buffer
+
+
+def get_stream(run_id: UUID) -> Optional[StreamBuffer]:
+    """The buffer of a run streamed by this process, if not evicted yet."""
+    return _streams.get(run_id)
+
+
+async def cancel(run_id: UUID) -> None:
+    """Cancel a run and wait for it to record that it was cancelled.
+
+    Runs executing in other processes are told to stop through Postgres.
+    """
+    if (task := _tasks.get(run_id)) is not None:
+        task.cancel()
+        await asyncio.wait({task})
+    # Also covers runs cancelled before they started, and runs left behind by
+    # a process that stopped. Runs that already ended are left as they are.
+    await storage.cancel_run(run_id)
+
+
+async def interrupt(run_ids: list[UUID]) -> None:
+    """Stop executing runs in this process without recording them as cancelled,
+    so that they can be executed again."""
+    tasks = []
+    for run_id in run_ids:
+        if (task := _tasks.get(run_id)) is not None:
+            _interrupted.add(run_id)
+            task.cancel()
+            tasks.append(task)
+    if tasks:
+        await asyncio.wait(tasks)
+    _interrupted.difference_update(run_ids)
+
+
+def _on_cancelled(payload: str) -> None:
+    if (task := _tasks.get(UUID(payload))) is not None:
+        task.cancel()
+
+
+async def _heartbeat() -> None:
+    if _tasks:
+        # Runs claimed by workers have the worker's ID, which heartbeats them.
+        await storage.heartbeat_runs(PROCESS_ID, list(_tasks))
+    if failed := await storage.fail_stale_runs(RUN_STALE_SECONDS):
+        logger.warning("Failed %d runs of processes that stopped", failed)
+
+
+add_listener(storage.CANCELLED_RUNS_CHANNEL, _on_cancelled)
+add_periodic(RUN_HEARTBEAT_SECONDS, _heartbeat)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Annotated, Optional
+from typing import Annotated, List, Literal, Optional
 from uuid import UUID
 
 from fastapi import Cookie
@@ -36,6 +36,70 @@ class Thread(TypedDict):
     """The last time the thread was updated."""
 
 
+class AssistantSummary(TypedDict):
+    """The fields of an assistant shown in listings."""
+
+    assistant_id: UUID
+    """The ID of the assistant."""
+    name: str
+    """The name of the assistant."""
+    updated_at: datetime
+    """The last time the assistant was updated."""
+    public: bool
+    """Whether the assistant is public."""
+
+
+class AssistantsPage(TypedDict):
+    items: List[AssistantSummary]
+    """The assistants, most recently updated first."""
+    next_cursor: Optional[str]
+    """Pass as `cursor` to get the next page, None on the last page."""
+
+
+class ThreadSummary(TypedDict):
+    """The fields of a thread shown in listings."""
+
+    thread_id: UUID
+    """The ID of the thread."""
+    assistant_id: Optional[UUID]
+    """The assistant that was used in conjunction with this thread."""
+    name: str
+    """The name of the thread."""
+    updated_at: datetime
+    """The last time the thread was updated."""
+
+
+class ThreadsPage(TypedDict):
+    items: List[ThreadSummary]
+    """The threads, most recently updated first."""
+    next_cursor: Optional[str]
+    """Pass as `cursor` to get the next page, None on the last page."""
+
+
+RunStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+
+class Run(TypedDict):
+    run_id: UUID
+    """The ID of the run."""
+    thread_id: str
+    """The thread the run is on."""
+    assistant_id: Optional[UUID]
+    """The assistant that was run."""
+    user_id: str
+    """The ID of the user that created the run."""
+    status: RunStatus
+    """The status of the run."""
+    error: Optional[str]
+    """Why the run failed, if it did."""
+    created_at: datetime
+    """When the run was created."""
+    started_at: Optional[datetime]
+    """When the run started running."""
+    ended_at: Optional[datetime]
+    """When the run succeeded, failed or was cancelled."""
+
+
 OpengptsUserId = Annotated[
     str,
     Cookie(
@@ -0,0 +1,95 @@
+"""Fast JSON serialization of messages for API responses.
+
+Writes the same bytes as langserve's WellKnownLCSerializer, which calls
+`.dict()` on every pydantic model, and as `map_chunk_to_msg`, which validates a
+new message for every chunk. For messages both come down to the instance
+`__dict__`, which orjson writes directly, so no dict or message is built.
+"""
+from functools import lru_cache
+from typing import Any, Sequence
+
+import orjson
+from fastapi.responses import JSONResponse
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    BaseMessageChunk,
+    ChatMessage,
+    ChatMessageChunk,
+    FunctionMessage,
+    FunctionMessageChunk,
+    HumanMessage,
+    HumanMessageChunk,
+)
+from langchain_core.pydantic_v1 import BaseModel, Extra
+
+# In the order map_chunk_to_msg checks them.
+_CHUNK_TYPES: list[tuple[type, type]] = [
+    (HumanMessageChunk, HumanMessage),
+    (AIMessageChunk, AIMessage),
+    (FunctionMessageChunk, FunctionMessage),
+    (ChatMessageChunk, ChatMessage),
+]
+
+
+@lru_cache(maxsize=None)
+def _plain(cls: type) -> bool:
+    """Whether `.dict()` of instances of the model class is their `__dict__`."""
+    return (
+        getattr(cls, "__exclude_fields__", None) is None
+        and getattr(cls, "__include_fields__", None) is None
+        and not getattr(cls.__config__, "use_enum_values", False)
+    )
+
+
+@lru_cache(maxsize=None)
+def _message_type(cls: type) -> type:
+    """The message type map_chunk_to_msg turns chunks of the class into."""
+    for chunk_type, message_type in _CHUNK_TYPES:
+        if issubclass(cls, chunk_type):
+            return message_type
+    raise ValueError(f"Unknown chunk type: {cls.__name__}")
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.__dict__ if _plain(type(obj)) else obj.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _message_dict(msg: Any) -> Any:
+    if not isinstance(msg, BaseMessageChunk):
+        return msg
+    message_type = _message_type(type(msg))
+    values = msg.__dict__
+    if message_type.__config__.extra is not Extra.allow or not _plain(message_type):
+        return message_type(**{k: v for k, v in values.items() if k != "type"})
+    # The fields in the order validation sets them, then the extra ones.
+    fields = {
+        name: values[name] if name != "type" and name in values else field.get_default()
+        for name, field in message_type.__fields__.items()
+    }
+    if len(fields) < len(values):
+        for name, value in values.items():
+            if name not in fields:
+                fields[name] = value
+    return fields
+
+
+def message_dicts(messages: Sequence[BaseMessage]) -> list:
+    """The messages, with chunks turned into messages as map_chunk_to_msg does,
+    ready for `dumps`."""
+    return [_message_dict(msg) for msg in messages]
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize like WellKnownLCSerializer().dumps."""
+    return orjson.dumps(obj, default=_default)
+
+
+class MessagesResponse(JSONResponse):
+    """A JSON response holding messages, written with `dumps`."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
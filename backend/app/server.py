@@ -6,6 +6,7 @@ import orjson
 from fastapi import FastAPI, Form, UploadFile
 from fastapi.staticfiles import StaticFiles
 
+from app import metrics
 from app.api import router as api_router
 from app.lifespan import lifespan
 from app.upload import ingest_runnable
@@ -34,6 +35,12 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def get_metrics() -> dict:
+    """Counters and other metrics of this worker."""
+    return metrics.snapshot()
+
+
 ui_dir = str(ROOT / "ui")
 
 if os.path.exists(ui_dir):
@@ -1,16 +1,74 @@
+import base64
 from datetime import datetime, timezone
-from typing import List, Optional, Sequence
+from functools import lru_cache
+from typing import Any, List, Mapping, Optional, Sequence
+from uuid import UUID
 
+import orjson
 from langchain.schema.messages import AnyMessage
-from langgraph.channels.base import ChannelsManager
-from langgraph.checkpoint.base import empty_checkpoint
-from langgraph.pregel import _prepare_next_tasks
+from langgraph.checkpoint.base import Checkpoint, empty_checkpoint
+from langgraph.graph.message import add_messages
 
-from app.agent import AgentType, get_agent_executor
+from app.agent import CHECKPOINTER, AgentType, get_agent_executor
+from app.checkpoint import MESSAGES_CHANNEL_NAME
 from app.lifespan import get_pg_pool
-from app.schema import Assistant, Thread
+from app.schema import (
+    Assistant,
+    AssistantsPage,
+    Run,
+    RunStatus,
+    Thread,
+    ThreadsPage,
+)
 from app.stream import map_chunk_to_msg
 
+RUNS_CHANNEL = "runs"
+"""Notified when a run is queued for the workers."""
+CANCELLED_RUNS_CHANNEL = "cancelled_runs"
+"""Notified with the ID of every cancelled run."""
+RUN_EVENTS_CHANNEL = "run_events"
+"""Notified with the ID of a run when events of its stream are published."""
+RUN_FOLLOWERS_CHANNEL = "run_followers"
+"""Notified with the ID of a run when another process follows its stream."""
+
+
+def _encode_cursor(updated_at: datetime, id: UUID) -> str:
+    return base64.urlsafe_b64encode(
+        orjson.dumps([updated_at.isoformat(), str(id)])
+    ).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Decode a cursor made by `_encode_cursor`, raising ValueError if invalid."""
+    try:
+        updated_at, id = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(updated_at), UUID(id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+async def _list_page(
+    query: str, id_column: str, user_id: str, limit: int, cursor: Optional[str]
+) -> dict:
+    """Run a keyset paginated query ordered by (updated_at, id) descending.
+
+    The query must have a `{where}` placeholder for the cursor condition and
+    take the user ID and limit as its first two parameters.
+    """
+    args = [user_id, limit + 1]
+    where = ""
+    if cursor is not None:
+        where = f"AND (updated_at, {id_column}) < ($3, $4)"
+        args.extend(_decode_cursor(cursor))
+    async with get_pg_pool().acquire() as conn:
+        rows = await conn.fetch(query.format(where=where), *args)
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = _encode_cursor(last["updated_at"], last[id_column])
+    return {"items": items, "next_cursor": next_cursor}
+
 
 async def list_assistants(user_id: str) -> List[Assistant]:
     """List all assistants for the current user."""
@@ -18,6 +76,29 @@ async def list_assistants(user_id: str) -> List[Assistant]:
         return await conn.fetch("SELECT * FROM assistant WHERE user_id = $1", user_id)
 
 
+async def list_assistants_page(
+    user_id: str, *, limit: int, cursor: Optional[str] = None
+) -> AssistantsPage:
+    """List the assistants of the current user, most recently updated first.
+
+    Args:
+        user_id: The user ID.
+        limit: The maximum number of assistants to return.
+        cursor: The `next_cursor` of the previous page.
+    """
+    return await _list_page(
+        (
+            "SELECT assistant_id, name, updated_at, public FROM assistant "
+            "WHERE user_id = $1 {where} "
+            "ORDER BY updated_at DESC, assistant_id DESC LIMIT $2"
+        ),
+        "assistant_id",
+        user_id,
+        limit,
+        cursor,
+    )
+
+
 async def get_assistant(user_id: str, assistant_id: str) -> Optional[Assistant]:
     """Get an assistant by ID."""
     async with get_pg_pool().acquire() as conn:
@@ -92,6 +173,29 @@ async def list_threads(user_id: str) -> List[Thread]:
         return await conn.fetch("SELECT * FROM thread WHERE user_id = $1", user_id)
 
 
+async def list_threads_page(
+    user_id: str, *, limit: int, cursor: Optional[str] = None
+) -> ThreadsPage:
+    """List the threads of the current user, most recently updated first.
+
+    Args:
+        user_id: The user ID.
+        limit: The maximum number of threads to return.
+        cursor: The `next_cursor` of the previous page.
+    """
+    return await _list_page(
+        (
+            "SELECT thread_id, assistant_id, name, updated_at FROM thread "
+            "WHERE user_id = $1 {where} "
+            "ORDER BY updated_at DESC, thread_id DESC LIMIT $2"
+        ),
+        "thread_id",
+        user_id,
+        limit,
+        cursor,
+    )
+
+
 async def get_thread(user_id: str, thread_id: str) -> Optional[Thread]:
     """Get a thread by ID."""
     async with get_pg_pool().acquire() as conn:
@@ -102,22 +206,66 @@ async def get_thread(user_id: str, thread_id: str) -> Optional[Thread]:
         )
 
 
-# TODO remove hardcoded channel name
-MESSAGES_CHANNEL_NAME = "__root__"
+@lru_cache(maxsize=1)
+def _graph_triggers() -> dict[str, tuple[str, ...]]:
+    """The channels that trigger each node of the agent graph.
+
+    The graph is only compiled once, the first time a thread is read.
+    """
+    app = get_agent_executor([], AgentType.GPT_35_TURBO, "", False)
+    return {name: tuple(proc.triggers) for name, proc in app.nodes.items()}
+
+
+def _is_resumeable(versions: Mapping[str, dict]) -> bool:
+    """Whether a node has a trigger it hasn't seen yet, ie. the run was
+    interrupted and there are tasks left to run.
+
+    Args:
+        versions: The `channel_versions` and `versions_seen` of a checkpoint.
+    """
+    channel_versions = versions["channel_versions"]
+    versions_seen = versions["versions_seen"]
+    return any(
+        channel_versions.get(chan, 0) > versions_seen.get(name, {}).get(chan, 0)
+        for name, triggers in _graph_triggers().items()
+        for chan in triggers
+    )
+
+
+def _thread_messages(checkpoint: Checkpoint) -> dict:
+    return {
+        "messages": [
+            map_chunk_to_msg(msg)
+            for msg in checkpoint["channel_values"].get(MESSAGES_CHANNEL_NAME, [])
+        ],
+        "resumeable": _is_resumeable(checkpoint),
+    }
 
 
 async def get_thread_messages(user_id: str, thread_id: str):
     """Get all messages for a thread."""
     config = {"configurable": {"thread_id": thread_id}}
-    app = get_agent_executor([], AgentType.GPT_35_TURBO, "", False)
-    checkpoint = await app.checkpointer.aget(config) or empty_checkpoint()
-    with ChannelsManager(app.channels, checkpoint) as channels:
-        return {
-            "messages": [
-                map_chunk_to_msg(msg) for msg in channels[MESSAGES_CHANNEL_NAME].get()
-            ],
-            "resumeable": bool(_prepare_next_tasks(checkpoint, app.nodes, channels)),
-        }
+    checkpoint = await CHECKPOINTER.aget(config) or empty_checkpoint()
+    return _thread_messages(checkpoint)
+
+
+async def get_thread_messages_page(
+    user_id: str, thread_id: str, *, limit: int, before: Optional[int] = None
+) -> dict:
+    """Get the newest messages of a thread, `limit` at a time.
+
+    Pass the returned `next_cursor` as `before` to get the previous page, it is
+    None once the start of the thread is reached.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    page = await CHECKPOINTER.aget_messages(config, limit=limit, before=before)
+    if page is None:
+        return {"messages": [], "resumeable": False, "next_cursor": None}
+    return {
+        "messages": [map_chunk_to_msg(msg) for msg in page.messages],
+        "resumeable": _is_resumeable(page.versions),
+        "next_cursor": page.start or None,
+    }
 
 
 async def post_thread_messages(
@@ -125,14 +273,12 @@ async def post_thread_messages(
 ):
     """Add messages to a thread."""
     config = {"configurable": {"thread_id": thread_id}}
-    app = get_agent_executor([], AgentType.GPT_35_TURBO, "", False)
-    checkpoint = await app.checkpointer.aget(config) or empty_checkpoint()
-    with ChannelsManager(app.channels, checkpoint) as channels:
-        channel = channels[MESSAGES_CHANNEL_NAME]
-        channel.update([messages])
-        checkpoint["channel_values"][MESSAGES_CHANNEL_NAME] = channel.checkpoint()
-        checkpoint["channel_versions"][MESSAGES_CHANNEL_NAME] += 1
-        await app.checkpointer.aput(config, checkpoint)
+    checkpoint = await CHECKPOINTER.aget(config) or empty_checkpoint()
+    checkpoint["channel_values"][MESSAGES_CHANNEL_NAME] = add_messages(
+        checkpoint["channel_values"].get(MESSAGES_CHANNEL_NAME, []), list(messages)
+    )
+    checkpoint["channel_versions"][MESSAGES_CHANNEL_NAME] += 1
+    await CHECKPOINTER.aput(config, checkpoint)
 
 
 async def put_thread(
@@ -163,3 +309,287 @@ async def put_thread(
             "name": name,
             "updated_at": updated_at,
         }
+
+
+async def put_run(user_id: str, *, thread_id: str, assistant_id: Optional[str]) -> Run:
+    """Create a queued run."""
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            (
+                "INSERT INTO run (user_id, thread_id, assistant_id) "
+                "VALUES ($1, $2, $3) RETURNING *"
+            ),
+            user_id,
+            thread_id,
+            assistant_id,
+        )
+
+
+async def enqueue_run(
+    user_id: str,
+    *,
+    thread_id: str,
+    assistant_id: Optional[str],
+    input: Any,
+    config: dict,
+) -> Run:
+    """Create a run for the workers to execute, and wake them up."""
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            run = await conn.fetchrow(
+                (
+                    "INSERT INTO run (user_id, thread_id, assistant_id, input, config) "
+                    "VALUES ($1, $2, $3, $4, $5) RETURNING *"
+                ),
+                user_id,
+                thread_id,
+                assistant_id,
+                input,
+                config,
+            )
+            await conn.execute("SELECT pg_notify($1, '')", RUNS_CHANNEL)
+        return run
+
+
+async def get_run(user_id: str, run_id: str) -> Optional[Run]:
+    """Get a run by ID."""
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            "SELECT * FROM run WHERE run_id = $1 AND user_id = $2", run_id, user_id
+        )
+
+
+async def get_active_run(user_id: str, thread_id: str) -> Optional[Run]:
+    """Get the latest run of a thread that is queued or running."""
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            (
+                "SELECT * FROM run WHERE thread_id = $1 AND user_id = $2 "
+                "AND status IN ('queued', 'running') "
+                "ORDER BY created_at DESC LIMIT 1"
+            ),
+            thread_id,
+            user_id,
+        )
+
+
+async def update_run(
+    run_id: str,
+    status: RunStatus,
+    *,
+    error: Optional[str] = None,
+    worker_id: Optional[str] = None,
+) -> Optional[Run]:
+    """Move a run to a new status, recording when it started or ended.
+
+    Runs that start running are heartbeated from then on, by `worker_id`.
+    Runs that already ended are left as they are, and None is returned.
+    """
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            (
+                "UPDATE run SET status = $2::text, error = $3, "
+                "worker_id = COALESCE($4, worker_id), "
+                "started_at = CASE WHEN $2::text = 'running' THEN now() "
+                "ELSE started_at END, "
+                "heartbeat_at = CASE WHEN $2::text = 'running' THEN now() "
+                "ELSE heartbeat_at END, "
+                "ended_at = CASE WHEN $2::text IN ('succeeded', 'failed', 'cancelled') "
+                "THEN now() ELSE ended_at END "
+                "WHERE run_id = $1 AND status IN ('queued', 'running') "
+                "RETURNING *"
+            ),
+            run_id,
+            status,
+            error,
+            worker_id,
+        )
+
+
+async def cancel_run(run_id: str) -> Optional[Run]:
+    """Record that a run was cancelled, and tell the process executing it.
+
+    Runs that already ended are left as they are, and None is returned.
+    """
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            run = await conn.fetchrow(
+                (
+                    "UPDATE run SET status = 'cancelled', ended_at = now() "
+                    "WHERE run_id = $1 AND status IN ('queued', 'running') "
+                    "RETURNING *"
+                ),
+                run_id,
+            )
+            if run is not None:
+                await conn.execute(
+                    "SELECT pg_notify($1, $2)", CANCELLED_RUNS_CHANNEL, str(run_id)
+                )
+        return run
+
+
+async def claim_runs(worker_id: str, limit: int) -> List[Run]:
+    """Claim up to `limit` of the oldest queued runs for a worker.
+
+    Runs being claimed by other workers are skipped rather than waited on.
+    """
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetch(
+            (
+                "UPDATE run SET status = 'running', worker_id = $1, "
+                "started_at = COALESCE(started_at, now()), heartbeat_at = now(), "
+                "attempts = attempts + 1 "
+                "WHERE run_id IN ("
+                "SELECT run_id FROM run "
+                "WHERE status = 'queued' AND config IS NOT NULL "
+                "ORDER BY created_at LIMIT $2 FOR UPDATE SKIP LOCKED"
+                ") RETURNING *"
+            ),
+            worker_id,
+            limit,
+        )
+
+
+async def heartbeat_runs(worker_id: str, run_ids: Sequence[UUID]) -> List[UUID]:
+    """Record that a worker is still executing its runs.
+
+    Returns the runs the worker should stop executing, because they were
+    cancelled or given to another worker.
+    """
+    async with get_pg_pool().acquire() as conn:
+        alive = await conn.fetch(
+            (
+                "UPDATE run SET heartbeat_at = now() "
+                "WHERE run_id = ANY($2) AND worker_id = $1 AND status = 'running' "
+                "RETURNING run_id"
+            ),
+            worker_id,
+            run_ids,
+        )
+    return list(set(run_ids) - {row["run_id"] for row in alive})
+
+
+async def requeue_runs(worker_id: str, run_ids: Sequence[UUID]) -> None:
+    """Put runs a worker stopped executing back in the queue."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            (
+                "UPDATE run SET status = 'queued', worker_id = NULL "
+                "WHERE run_id = ANY($2) AND worker_id = $1 AND status = 'running'"
+            ),
+            worker_id,
+            run_ids,
+        )
+        await conn.execute("SELECT pg_notify($1, '')", RUNS_CHANNEL)
+
+
+async def requeue_stale_runs(stale_after: float, max_attempts: int) -> int:
+    """Put runs whose worker stopped heartbeating back in the queue.
+
+    Runs that were already attempted `max_attempts` times are failed instead.
+    Returns the number of runs requeued.
+    """
+    async with get_pg_pool().acquire() as conn:
+        rows = await conn.fetch(
+            (
+                "UPDATE run SET worker_id = NULL, "
+                "status = CASE WHEN attempts < $2 THEN 'queued' ELSE 'failed' END, "
+                "error = CASE WHEN attempts < $2 THEN NULL ELSE 'WorkerLost' END, "
+                "ended_at = CASE WHEN attempts < $2 THEN NULL ELSE now() END "
+                "WHERE status = 'running' AND config IS NOT NULL "
+                "AND heartbeat_at < now() - make_interval(secs => $1) "
+                "RETURNING status"
+            ),
+            stale_after,
+            max_attempts,
+        )
+        requeued = sum(1 for row in rows if row["status"] == "queued")
+        if requeued:
+            await conn.execute("SELECT pg_notify($1, '')", RUNS_CHANNEL)
+        return requeued
+
+
+async def fail_stale_runs(stale_after: float) -> int:
+    """Fail the runs executed by the process that created them, whose process
+    stopped heartbeating them, as no other process can execute them.
+
+    Returns the number of runs failed.
+    """
+    async with get_pg_pool().acquire() as conn:
+        failed = await conn.execute(
+            (
+                "UPDATE run SET status = 'failed', error = 'ProcessLost', "
+                "ended_at = now() "
+                "WHERE status = 'running' AND config IS NULL "
+                "AND heartbeat_at < now() - make_interval(secs => $1)"
+            ),
+            stale_after,
+        )
+    return int(failed.split()[-1])
+
+
+async def put_run_events(run_id: UUID, events: Sequence[tuple[int, bytes]]) -> None:
+    """Publish encoded events of a run's stream, by event ID."""
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(
+                (
+                    "INSERT INTO run_event (run_id, event_id, data) "
+                    "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING"
+                ),
+                [(run_id, event_id, data) for event_id, data in events],
+            )
+            await conn.execute(
+                "SELECT pg_notify($1, $2)", RUN_EVENTS_CHANNEL, str(run_id)
+            )
+
+
+async def get_run_events(run_id: UUID, after: int) -> List[tuple[int, bytes]]:
+    """Get the published events of a run's stream after `after`, in order."""
+    async with get_pg_pool().acquire() as conn:
+        rows = await conn.fetch(
+            (
+                "SELECT event_id, data FROM run_event "
+                "WHERE run_id = $1 AND event_id > $2 ORDER BY event_id"
+            ),
+            run_id,
+            after,
+        )
+    return [(row["event_id"], row["data"]) for row in rows]
+
+
+async def delete_expired_run_events(ttl: float) -> int:
+    """Delete the published events of the streams that ended over `ttl`
+    seconds ago, or whose process stopped writing them as long ago.
+
+    Events of queued or running runs are kept, as mirrors need all of them.
+    Returns the number of events deleted.
+    """
+    async with get_pg_pool().acquire() as conn:
+        deleted = await conn.execute(
+            (
+                "WITH expired AS ("
+                "SELECT DISTINCT run_id FROM run_event "
+                "WHERE created_at < now() - make_interval(secs => $1)"
+                ") "
+                "DELETE FROM run_event WHERE run_id IN ("
+                "SELECT run_id FROM expired e "
+                "WHERE NOT EXISTS ("
+                "SELECT 1 FROM run_event recent WHERE recent.run_id = e.run_id "
+                "AND recent.created_at >= now() - make_interval(secs => $1)"
+                ") AND NOT EXISTS ("
+                "SELECT 1 FROM run r WHERE r.run_id = e.run_id "
+                "AND r.status IN ('queued', 'running')"
+                "))"
+            ),
+            ttl,
+        )
+    return int(deleted.split()[-1])
+
+
+async def follow_run(run_id: UUID) -> None:
+    """Ask the process streaming a run to publish its events."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "SELECT pg_notify($1, $2)", RUN_FOLLOWERS_CHANNEL, str(run_id)
+        )
@@ -1,5 +1,9 @@
+import asyncio
 import logging
-from typing import AsyncIterator, Optional, Sequence, Union
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Literal, Optional, Sequence, Union
 
 import orjson
 from langchain_core.messages import (
@@ -17,11 +21,53 @@ from langchain_core.messages import (
     SystemMessage,
 )
 from langchain_core.runnables import Runnable, RunnableConfig
-from langserve.serialization import WellKnownLCSerializer
+
+from app.metrics import counter, histogram
+from app.serialization import dumps, message_dicts
 
 logger = logging.getLogger(__name__)
 
-MessagesStream = AsyncIterator[Union[list[AnyMessage], str]]
+# Token updates are sent at most every STREAM_COALESCE_MS milliseconds, or
+# after STREAM_COALESCE_TOKENS of them, whichever comes first. 0 disables.
+STREAM_COALESCE_MS = float(os.environ.get("STREAM_COALESCE_MS", 50))
+STREAM_COALESCE_TOKENS = int(os.environ.get("STREAM_COALESCE_TOKENS", 32))
+
+# Streamed runs keep their last STREAM_BUFFER_SIZE chunks for clients to resume
+# from, until STREAM_BUFFER_TTL seconds after they end.
+STREAM_BUFFER_SIZE = int(os.environ.get("STREAM_BUFFER_SIZE", 1000))
+STREAM_BUFFER_TTL = float(os.environ.get("STREAM_BUFFER_TTL", 300))
+# Clients more than STREAM_MAX_BACKLOG chunks behind skip superseded token
+# updates, so that slow clients get fewer, larger updates.
+STREAM_MAX_BACKLOG = int(os.environ.get("STREAM_MAX_BACKLOG", 8))
+
+_flush_latency = histogram(
+    "stream_flush_latency_seconds",
+    "Time token updates waited to be sent to the client.",
+    [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1],
+)
+_events_per_second = histogram(
+    "stream_events_per_second",
+    "SSE events sent per second, by stream.",
+    [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000],
+)
+_merged_chunks = counter(
+    "stream_merged_chunks",
+    "Token updates not sent to slow clients, superseded by a later one.",
+)
+
+Chunk = Union[list[AnyMessage], str]
+"""The messages of a run so far, or the ID of its root run."""
+
+MessagesStream = AsyncIterator[Chunk]
+
+StreamProtocol = Literal["snapshot", "delta"]
+"""How message lists are sent to the client.
+
+- snapshot: every "data" event holds the whole list of messages.
+- delta: the first "data" event holds the whole list, after that "messages"
+  events replace the messages from `index` onwards with `messages`, and
+  "delta" events append `content` to the content of the message at `index`.
+"""
 
 
 async def astream_messages(
@@ -76,6 +122,97 @@ async def astream_messages(
             yield last_messages_list
 
 
+_END = object()
+
+
+class _Pending:
+    """The latest messages list of a stream, not sent yet."""
+
+    def __init__(self) -> None:
+        self.messages: Optional[list[AnyMessage]] = None
+        self.updates = 0
+        self.since = 0.0
+        self.sent_length = -1
+
+    def add(self, messages: list[AnyMessage]) -> None:
+        if self.messages is None:
+            self.since = time.monotonic()
+        self.messages = messages
+        self.updates += 1
+
+    def take(self) -> list[AnyMessage]:
+        _flush_latency.observe(time.monotonic() - self.since)
+        # Copied, since the stream keeps updating the same list.
+        messages = list(self.messages)
+        self.messages = None
+        self.updates = 0
+        self.sent_length = len(messages)
+        return messages
+
+
+async def coalesce(
+    messages_stream: MessagesStream,
+    interval_ms: float = STREAM_COALESCE_MS,
+    max_tokens: int = STREAM_COALESCE_TOKENS,
+) -> MessagesStream:
+    """Batch the token updates of a stream of messages.
+
+    Updates are yielded at most every `interval_ms` milliseconds or after
+    `max_tokens` of them, whichever comes first. The run id, new messages and
+    the last update are yielded right away. Streams pass through unchanged if
+    `interval_ms` is 0, `max_tokens` of 0 only flushes on time.
+    """
+    if interval_ms <= 0:
+        async for chunk in messages_stream:
+            yield chunk
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump() -> None:
+        # The stream runs in its own task, so that updates keep arriving while
+        # waiting for the window to end.
+        try:
+            async for chunk in messages_stream:
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END)
+
+    pending = _Pending()
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            if pending.messages is None:
+                chunk = await queue.get()
+            else:
+                timeout = pending.since + interval_ms / 1000 - time.monotonic()
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    yield pending.take()
+                    continue
+            if chunk is _END or isinstance(chunk, (str, Exception)):
+                if pending.messages is not None:
+                    yield pending.take()
+                if chunk is _END:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+                continue
+            pending.add(chunk)
+            if len(chunk) != pending.sent_length or 0 < max_tokens <= pending.updates:
+                yield pending.take()
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
 def map_chunk_to_msg(chunk: BaseMessageChunk) -> BaseMessage:
     if not isinstance(chunk, BaseMessageChunk):
         return chunk
@@ -92,28 +229,104 @@ def map_chunk_to_msg(chunk: BaseMessageChunk) -> BaseMessage:
         raise ValueError(f"Unknown chunk type: {chunk}")
 
 
-_serializer = WellKnownLCSerializer()
+def _content_delta(prev: AnyMessage, msg: AnyMessage) -> Optional[str]:
+    """The text appended to the content of `prev` to get `msg`, or None if the
+    message changed in any other way."""
+    if (
+        type(prev) is not type(msg)
+        or not isinstance(prev.content, str)
+        or not isinstance(msg.content, str)
+        or not msg.content.startswith(prev.content)
+    ):
+        return None
+    for key, value in msg.__dict__.items():
+        if key != "content" and prev.__dict__.get(key) != value:
+            return None
+    return msg.content[len(prev.content) :]
+
+
+def changed_from(prev: list[AnyMessage], messages: list[AnyMessage]) -> int:
+    """The index of the first message of `messages` that is not in `prev`."""
+    # Messages are replaced rather than mutated, so compare by identity.
+    for index, (a, b) in enumerate(zip(prev, messages)):
+        if a is not b:
+            return index
+    return min(len(prev), len(messages))
+
+
+def _delta_events(prev: list[AnyMessage], messages: list[AnyMessage]) -> list[dict]:
+    """The delta protocol events that turn `prev` into `messages`."""
+    index = changed_from(prev, messages)
+    if index == len(prev) == len(messages):
+        return []
+    if index == len(prev) - 1 == len(messages) - 1:
+        delta = _content_delta(prev[index], messages[index])
+        if delta is not None:
+            return [
+                {
+                    "event": "delta",
+                    "data": orjson.dumps({"index": index, "content": delta}).decode(),
+                }
+            ]
+    return [
+        {
+            "event": "messages",
+            "data": dumps(
+                {"index": index, "messages": message_dicts(messages[index:])}
+            ).decode(),
+        }
+    ]
 
 
-async def to_sse(messages_stream: MessagesStream) -> AsyncIterator[dict]:
+async def to_sse(
+    messages_stream: MessagesStream, protocol: StreamProtocol = "snapshot"
+) -> AsyncIterator[dict]:
     """Consume the stream into an EventSourceResponse"""
-    try:
+
+    async def entries() -> AsyncIterator[tuple[Optional[int], Chunk]]:
         async for chunk in messages_stream:
-            # EventSourceResponse expects a string for data
-            # so after serializing into bytes, we decode into utf-8
-            # to get a string.
-            if isinstance(chunk, str):
-                yield {
-                    "event": "metadata",
-                    "data": orjson.dumps({"run_id": chunk}).decode(),
-                }
-            else:
-                yield {
-                    "event": "data",
-                    "data": _serializer.dumps(
-                        [map_chunk_to_msg(msg) for msg in chunk]
-                    ).decode(),
-                }
+            yield None, chunk
+
+    async for event in _to_sse(entries(), protocol):
+        yield event
+
+
+async def buffer_to_sse(
+    buffer: "StreamBuffer",
+    protocol: StreamProtocol = "snapshot",
+    after: int = 0,
+    max_backlog: Optional[int] = STREAM_MAX_BACKLOG,
+) -> AsyncIterator[dict]:
+    """Follow the buffer into an EventSourceResponse.
+
+    Events carry the ID of their chunk, for the client to resume the stream from
+    with Last-Event-ID. Events the client missed are replayed, or if they were
+    evicted from the buffer, replaced by the latest messages. Clients more than
+    `max_backlog` chunks behind skip superseded token updates.
+    """
+    # Deltas are from what the client has, whichever chunks it skipped.
+    sent = buffer.state_at(after) if protocol == "delta" else None
+    async for event in _to_sse(buffer.follow(after, max_backlog), protocol, sent):
+        yield event
+
+
+async def _to_sse(
+    entries: AsyncIterator[tuple[Optional[int], Chunk]],
+    protocol: StreamProtocol,
+    sent: Optional[list[AnyMessage]] = None,
+) -> AsyncIterator[dict]:
+    started = time.monotonic()
+    events = 0
+    try:
+        async for id, chunk in entries:
+            for event in _chunk_events(chunk, protocol, sent):
+                if id is not None:
+                    event["id"] = str(id)
+                events += 1
+                yield event
+            if protocol == "delta" and isinstance(chunk, list):
+                # The stream appends to and replaces items of the same list.
+                sent = list(chunk)
     except Exception:
         logger.warn("error in stream", exc_info=True)
         yield {
@@ -128,3 +341,131 @@ async def to_sse(messages_stream: MessagesStream) -> AsyncIterator[dict]:
 
     # Send an end event to signal the end of the stream
     yield {"event": "end"}
+    elapsed = time.monotonic() - started
+    if elapsed > 0:
+        _events_per_second.observe((events + 1) / elapsed, protocol=protocol)
+
+
+def _chunk_events(
+    chunk: Chunk, protocol: StreamProtocol, sent: Optional[list[AnyMessage]]
+) -> list[dict]:
+    # EventSourceResponse expects a string for data
+    # so after serializing into bytes, we decode into utf-8
+    # to get a string.
+    if isinstance(chunk, str):
+        return [{"event": "metadata", "data": orjson.dumps({"run_id": chunk}).decode()}]
+    if protocol == "delta" and sent is not None:
+        return _delta_events(sent, chunk)
+    return [
+        {
+            "event": "data",
+            "data": dumps(message_dicts(chunk)).decode(),
+        }
+    ]
+
+
+class StreamBuffer:
+    """The latest chunks of a messages stream, for any number of clients to follow.
+
+    Chunks are numbered from 1 in order. Only the last `maxlen` are kept, plus
+    the latest metadata.
+    """
+
+    def __init__(self, maxlen: int = STREAM_BUFFER_SIZE) -> None:
+        self._entries: deque[tuple[int, Chunk]] = deque(maxlen=maxlen)
+        self._metadata: Optional[tuple[int, str]] = None
+        self._changed = asyncio.Event()
+        self.last_id = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+
+    def append(self, chunk: Chunk, id: Optional[int] = None) -> None:
+        """Add a chunk, with the next ID unless given one higher than the last.
+
+        Lists must not be changed afterwards.
+        """
+        self.last_id = self.last_id + 1 if id is None else id
+        if isinstance(chunk, str):
+            self._metadata = (self.last_id, chunk)
+        self._entries.append((self.last_id, chunk))
+        self._notify()
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        """End the stream, with the error it failed with if any."""
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def state_at(self, id: int) -> Optional[list[AnyMessage]]:
+        """The messages as of chunk `id`, or None if no longer buffered."""
+        if not self._entries or self._entries[0][0] > id:
+            return None
+        state = None
+        for entry_id, chunk in self._entries:
+            if entry_id > id:
+                break
+            if isinstance(chunk, list):
+                state = chunk
+        return state
+
+    async def follow(
+        self, after: int = 0, max_backlog: Optional[int] = None
+    ) -> AsyncIterator[tuple[int, Chunk]]:
+        """Yield the chunks after chunk `after` with their ID, waiting for new ones
+        until the stream ends.
+
+        If some were evicted before they could be yielded, yields the metadata
+        and the latest messages instead. While more than `max_backlog` chunks
+        wait to be yielded, those superseded by the next one are skipped: token
+        updates of a message, other than its last one before the next message.
+        """
+        cursor = after
+        while True:
+            changed = self._changed
+            if self._entries and self._entries[0][0] > cursor + 1:
+                latest = next(
+                    (e for e in reversed(self._entries) if isinstance(e[1], list)),
+                    self._entries[-1],
+                )
+                if (
+                    self._metadata is not None
+                    and cursor < self._metadata[0] < latest[0]
+                ):
+                    yield self._metadata
+                yield latest
+                cursor = latest[0]
+            # Copied, since the buffer may change while the caller has a chunk.
+            pending = [entry for entry in self._entries if entry[0] > cursor]
+            if max_backlog is not None and len(pending) > max_backlog:
+                superseded = _superseded(pending)
+            else:
+                superseded = [False] * len(pending)
+            for entry, skip in zip(pending, superseded):
+                cursor = entry[0]
+                if skip:
+                    _merged_chunks.inc()
+                    continue
+                yield entry
+                if max_backlog is not None and self.last_id - cursor > max_backlog:
+                    # Fell behind while the caller had the chunk, merge again.
+                    break
+            if cursor >= self.last_id:
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+
+
+def _superseded(entries: list[tuple[int, Chunk]]) -> list[bool]:
+    """Whether each entry is a list superseded by the next entry."""
+    return [
+        isinstance(entry[1], list)
+        and isinstance(next_entry[1], list)
+        and len(entry[1]) == len(next_entry[1])
+        for entry, next_entry in zip(entries, entries[1:])
+    ] + [False]
@@ -0,0 +1,219 @@
+"""Caching of the results of tools that search public data.
+
+Off unless TOOL_RESULT_CACHE is set, to `memory` to keep results in each
+process, or to `postgres` to also keep them in the tool_result table, shared by
+all processes. Results are cached by tool name and input, with whitespace and
+case in strings ignored, for TOOL_RESULT_CACHE_TTL seconds, which tools can
+change and TOOL_RESULT_CACHE_TTLS can set per tool name, e.g. '{"arxiv": 60}'.
+Each tool keeps up to TOOL_RESULT_CACHE_BYTES of results in memory.
+
+Concurrent calls with the same input wait for a single call instead of all
+calling the tool. Failed calls aren't cached.
+"""
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Union
+
+import orjson
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+    Callbacks,
+)
+from langchain_core.tools import BaseTool
+
+from app.cache import LRUCache
+from app.lifespan import get_pg_pool
+from app.metrics import counter
+
+TOOL_RESULT_CACHE = os.environ.get("TOOL_RESULT_CACHE")
+TOOL_RESULT_CACHE_TTL = float(os.environ.get("TOOL_RESULT_CACHE_TTL", 3600))
+TOOL_RESULT_CACHE_TTLS: dict[str, float] = orjson.loads(
+    os.environ.get("TOOL_RESULT_CACHE_TTLS", "{}")
+)
+TOOL_RESULT_CACHE_BYTES = int(os.environ.get("TOOL_RESULT_CACHE_BYTES", 2**24))
+
+_shared_hits = counter(
+    "tool_result_shared_hits", "Tool results found in Postgres, by tool."
+)
+_joined = counter(
+    "tool_result_joined", "Tool calls that waited for the same call, by tool."
+)
+
+_caches: dict[str, LRUCache[tuple[Any]]] = {}
+_inflight: dict[tuple[str, str], asyncio.Future] = {}
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        # Tools with a single argument can be called with it or a dict of it.
+        if len(value) == 1:
+            return _normalize(next(iter(value.values())))
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _key(tool_input: Union[str, dict]) -> str:
+    data = orjson.dumps(_normalize(tool_input), option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cache(tool: str) -> LRUCache[tuple[Any]]:
+    if tool not in _caches:
+        _caches[tool] = LRUCache(f"tool_results_{tool}", TOOL_RESULT_CACHE_BYTES)
+    return _caches[tool]
+
+
+def _put(tool: str, key: str, value: Any, ttl: float) -> Optional[bytes]:
+    """Cache a result in memory, returning it encoded if it can be shared."""
+    try:
+        data = orjson.dumps(value)
+    except TypeError:
+        data = None
+    # Wrapped so that None results are cached too.
+    _cache(tool).put(key, (value,), len(data) if data else len(repr(value)), ttl)
+    return data
+
+
+async def _get_shared(tool: str, key: str) -> Optional[tuple[bytes, datetime]]:
+    async with get_pg_pool().acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT value, expires_at FROM tool_result "
+            "WHERE tool = $1 AND key = $2 AND expires_at > now()",
+            tool,
+            key,
+        )
+    return (row["value"], row["expires_at"]) if row else None
+
+
+async def _put_shared(tool: str, key: str, data: bytes, ttl: float) -> None:
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "DELETE FROM tool_result WHERE tool = $1 AND expires_at <= now()",
+                tool,
+            )
+            await conn.execute(
+                (
+                    "INSERT INTO tool_result (tool, key, value, expires_at) "
+                    "VALUES ($1, $2, $3, $4) ON CONFLICT (tool, key) "
+                    "DO UPDATE SET value = EXCLUDED.value, "
+                    "expires_at = EXCLUDED.expires_at"
+                ),
+                tool,
+                key,
+                data,
+                expires_at,
+            )
+
+
+def _retrieved(task: asyncio.Future) -> None:
+    # Avoids warnings about failed calls all callers stopped waiting for.
+    if not task.cancelled():
+        task.exception()
+
+
+class CachedTool(BaseTool):
+    """A tool returning cached results of another tool.
+
+    Caching happens inside the run, so callers get their tool events, cache
+    hits included, as with any tool.
+    """
+
+    tool: BaseTool
+    ttl: float
+
+    @property
+    def args(self) -> dict:
+        return self.tool.args
+
+    def _run(
+        self,
+        *args: Any,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        **kwargs: Any,
+    ) -> Any:
+        tool_input = args[0] if args else kwargs
+        key = _key(tool_input)
+        if (entry := _cache(self.name).get(key)) is not None:
+            return entry[0]
+        value = self.tool.run(
+            tool_input, callbacks=run_manager.get_child() if run_manager else None
+        )
+        _put(self.name, key, value, self.ttl)
+        return value
+
+    async def _arun(
+        self,
+        *args: Any,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs: Any,
+    ) -> Any:
+        tool_input = args[0] if args else kwargs
+        key = _key(tool_input)
+        if (entry := _cache(self.name).get(key)) is not None:
+            return entry[0]
+        flight = (self.name, key)
+        if (task := _inflight.get(flight)) is None:
+            # Traced as a child of the caller that started it, those joining
+            # it only get their own tool run.
+            task = _inflight[flight] = asyncio.ensure_future(
+                self._fetch(
+                    key, tool_input, run_manager.get_child() if run_manager else None
+                )
+            )
+            task.add_done_callback(_retrieved)
+            task.add_done_callback(
+                lambda t: _inflight.pop(flight) if _inflight.get(flight) is t else None
+            )
+        else:
+            _joined.inc(tool=self.name)
+        # Callers giving up, e.g. past their deadline, don't cancel the others.
+        return await asyncio.shield(task)
+
+    async def _fetch(
+        self, key: str, tool_input: Union[str, dict], callbacks: Callbacks
+    ) -> Any:
+        shared = TOOL_RESULT_CACHE == "postgres"
+        if shared and (row := await _get_shared(self.name, key)) is not None:
+            data, expires_at = row
+            value = orjson.loads(data)
+            ttl = (expires_at - datetime.now(timezone.utc)).total_seconds()
+            _put(self.name, key, value, ttl)
+            _shared_hits.inc(tool=self.name)
+            return value
+        value = await self.tool.arun(tool_input, callbacks=callbacks)
+        data = _put(self.name, key, value, self.ttl)
+        if shared and data is not None:
+            await _put_shared(self.name, key, data, self.ttl)
+        return value
+
+
+def cache_results(tool: BaseTool, ttl: Optional[float] = None) -> BaseTool:
+    """Cache the results of a tool if TOOL_RESULT_CACHE is set.
+
+    Only for tools returning the same results for the same input to any user.
+
+    Args:
+        tool: The tool to cache the results of.
+        ttl: Seconds results are kept for, TOOL_RESULT_CACHE_TTL if None.
+    """
+    if not TOOL_RESULT_CACHE:
+        return tool
+    return CachedTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        return_direct=tool.return_direct,
+        tool=tool,
+        ttl=TOOL_RESULT_CACHE_TTLS.get(
+            tool.name, TOOL_RESULT_CACHE_TTL if ttl is None else ttl
+        ),
+    )
@@ -1,9 +1,11 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import Enum
-from functools import lru_cache
-from typing import Optional
+from typing import Any, Iterator, Optional, Type, Union
 
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain.tools.retriever import create_retriever_tool
+from langchain.tools.retriever import RetrieverInput, create_retriever_tool
 from langchain_community.agent_toolkits.connery import ConneryToolkit
 from langchain_community.retrievers import (
     KayAiRetriever,
@@ -21,11 +23,30 @@ from langchain_community.tools.tavily_search import (
 )
 from langchain_community.utilities.arxiv import ArxivAPIWrapper
 from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForRetrieverRun,
+    CallbackManagerForToolRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableConfig, ensure_config
+from langchain_core.tools import BaseTool as LangChainTool
 from langchain_robocorp import ActionServerToolkit
 from typing_extensions import TypedDict
 
+from app.cache import cached
+from app.tool_results import cache_results
 from app.upload import vstore
 
+TOOL_CACHE_SIZE = int(os.environ.get("TOOL_CACHE_SIZE", 32))
+"""Number of tool instances kept per tool type."""
+TOOL_CACHE_TTL = float(os.environ.get("TOOL_CACHE_TTL", 3600))
+"""Seconds after which tools are built again, eg. to refresh remote action specs."""
+REFERENCE_RESULTS_TTL = 24 * 3600
+"""Seconds results of tools searching papers, filings and encyclopedias are cached."""
+
 
 class DDGInput(BaseModel):
     query: str = Field(description="search query to look up")
@@ -195,7 +216,104 @@ def get_retriever(assistant_id: str, thread_id: str):
     )
 
 
-@lru_cache(maxsize=5)
+# The assistant and thread IDs of the current call, for the methods of the
+# shared retriever and tool that are called without a config.
+_thread_ids: ContextVar[Optional[tuple[str, str]]] = ContextVar(
+    "thread_ids", default=None
+)
+
+
+def _configured_ids(config: Optional[RunnableConfig]) -> tuple[str, str]:
+    configurable = ensure_config(config).get("configurable", {})
+    if "assistant_id" in configurable and "thread_id" in configurable:
+        return configurable["assistant_id"], configurable["thread_id"]
+    if (ids := _thread_ids.get()) is not None:
+        return ids
+    raise ValueError("Retrieval needs the assistant_id and thread_id configured.")
+
+
+@contextmanager
+def _with_thread_ids(config: Optional[RunnableConfig]) -> Iterator[None]:
+    token = _thread_ids.set(_configured_ids(config))
+    try:
+        yield
+    finally:
+        _thread_ids.reset(token)
+
+
+class ThreadRetriever(BaseRetriever):
+    """Searches the files of the assistant and thread in the `configurable`
+    config of each call, so that one instance serves every thread."""
+
+    def invoke(
+        self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> list[Document]:
+        with _with_thread_ids(config):
+            return super().invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> list[Document]:
+        with _with_thread_ids(config):
+            return await super().ainvoke(input, config, **kwargs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return get_retriever(*_configured_ids(None)).get_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return await get_retriever(*_configured_ids(None)).aget_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+
+
+class ThreadRetrievalTool(LangChainTool):
+    """The retrieval tool of the assistant and thread in the `configurable`
+    config of each call, so that one instance serves every thread."""
+
+    name: str = "Retriever"
+    args_schema: Type[BaseModel] = RetrieverInput
+    retriever: ThreadRetriever = Field(default_factory=ThreadRetriever)
+
+    def invoke(
+        self,
+        input: Union[str, dict],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Any:
+        with _with_thread_ids(config):
+            return super().invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self,
+        input: Union[str, dict],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Any:
+        with _with_thread_ids(config):
+            return await super().ainvoke(input, config, **kwargs)
+
+    def _run(
+        self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> list[Document]:
+        return self.retriever.get_relevant_documents(
+            query, callbacks=run_manager.get_child() if run_manager else None
+        )
+
+    async def _arun(
+        self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> list[Document]:
+        return await self.retriever.aget_relevant_documents(
+            query, callbacks=run_manager.get_child() if run_manager else None
+        )
+
+
+@cached("retrieval_tools", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def get_retrieval_tool(assistant_id: str, thread_id: str, description: str):
     return create_retriever_tool(
         get_retriever(assistant_id, thread_id),
@@ -204,81 +322,97 @@ def get_retrieval_tool(assistant_id: str, thread_id: str, description: str):
     )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_duck_duck_go", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_duck_duck_go():
-    return DuckDuckGoSearchRun(args_schema=DDGInput)
+    return cache_results(DuckDuckGoSearchRun(args_schema=DDGInput))
 
 
-@lru_cache(maxsize=1)
+@cached("tools_arxiv", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_arxiv():
-    return ArxivQueryRun(api_wrapper=ArxivAPIWrapper(), args_schema=ArxivInput)
+    return cache_results(
+        ArxivQueryRun(api_wrapper=ArxivAPIWrapper(), args_schema=ArxivInput),
+        REFERENCE_RESULTS_TTL,
+    )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_you_search", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_you_search():
-    return create_retriever_tool(
-        YouRetriever(n_hits=3, n_snippets_per_hit=3),
-        "you_search",
-        "Searches for documents using You.com",
+    return cache_results(
+        create_retriever_tool(
+            YouRetriever(n_hits=3, n_snippets_per_hit=3),
+            "you_search",
+            "Searches for documents using You.com",
+        )
     )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_sec_filings", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_sec_filings():
-    return create_retriever_tool(
-        KayAiRetriever.create(
-            dataset_id="company", data_types=["10-K", "10-Q"], num_contexts=3
+    return cache_results(
+        create_retriever_tool(
+            KayAiRetriever.create(
+                dataset_id="company", data_types=["10-K", "10-Q"], num_contexts=3
+            ),
+            "sec_filings_search",
+            "Search for a query among SEC Filings",
         ),
-        "sec_filings_search",
-        "Search for a query among SEC Filings",
+        REFERENCE_RESULTS_TTL,
     )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_press_releases", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_press_releases():
-    return create_retriever_tool(
-        KayAiRetriever.create(
-            dataset_id="company", data_types=["PressRelease"], num_contexts=6
-        ),
-        "press_release_search",
-        "Search for a query among press releases from US companies",
+    return cache_results(
+        create_retriever_tool(
+            KayAiRetriever.create(
+                dataset_id="company", data_types=["PressRelease"], num_contexts=6
+            ),
+            "press_release_search",
+            "Search for a query among press releases from US companies",
+        )
     )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_pubmed", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_pubmed():
-    return create_retriever_tool(
-        PubMedRetriever(), "pub_med_search", "Search for a query on PubMed"
+    return cache_results(
+        create_retriever_tool(
+            PubMedRetriever(), "pub_med_search", "Search for a query on PubMed"
+        ),
+        REFERENCE_RESULTS_TTL,
     )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_wikipedia", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_wikipedia():
-    return create_retriever_tool(
-        WikipediaRetriever(), "wikipedia", "Search for a query on Wikipedia"
+    return cache_results(
+        create_retriever_tool(
+            WikipediaRetriever(), "wikipedia", "Search for a query on Wikipedia"
+        ),
+        REFERENCE_RESULTS_TTL,
     )
 
 
-@lru_cache(maxsize=1)
+@cached("tools_tavily", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_tavily():
     tavily_search = TavilySearchAPIWrapper()
-    return TavilySearchResults(api_wrapper=tavily_search)
+    return cache_results(TavilySearchResults(api_wrapper=tavily_search))
 
 
-@lru_cache(maxsize=1)
+@cached("tools_tavily_answer", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_tavily_answer():
     tavily_search = TavilySearchAPIWrapper()
-    return _TavilyAnswer(api_wrapper=tavily_search)
+    return cache_results(_TavilyAnswer(api_wrapper=tavily_search))
 
 
-@lru_cache(maxsize=1)
+@cached("tools_action_server", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_action_server(**kwargs: ActionServerConfig):
     toolkit = ActionServerToolkit(url=kwargs["url"], api_key=kwargs["api_key"])
     tools = toolkit.get_tools()
     return tools
 
 
-@lru_cache(maxsize=1)
+@cached("tools_connery_actions", maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL)
 def _get_connery_actions():
     connery_service = ConneryService()
     connery_toolkit = ConneryToolkit.create_instance(connery_service)
@@ -0,0 +1,166 @@
+"""Execute the runs queued with RUN_QUEUE=postgres.
+
+    python -m app.worker
+
+Workers claim the oldest queued runs with SELECT ... FOR UPDATE SKIP LOCKED, so
+any number of them can share the queue, on any number of nodes. Each executes
+up to WORKER_CONCURRENCY runs at a time and heartbeats them. Runs whose worker
+stops heartbeating for WORKER_STALE_SECONDS are put back in the queue, and
+failed after WORKER_MAX_ATTEMPTS attempts.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+from datetime import datetime
+from typing import Optional
+from uuid import UUID, uuid4
+
+from langchain_core.runnables import Runnable
+from langserve.server import _unpack_input
+
+from app import run_manager, storage
+from app.agent import CHECKPOINTER, agent
+from app.lifespan import add_listener, lifespan
+from app.schema import Run
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 8))
+WORKER_POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS", 5))
+WORKER_HEARTBEAT_SECONDS = float(os.environ.get("WORKER_HEARTBEAT_SECONDS", 10))
+WORKER_STALE_SECONDS = float(os.environ.get("WORKER_STALE_SECONDS", 60))
+WORKER_MAX_ATTEMPTS = int(os.environ.get("WORKER_MAX_ATTEMPTS", 3))
+WORKER_SHUTDOWN_SECONDS = float(os.environ.get("WORKER_SHUTDOWN_SECONDS", 30))
+
+
+class Worker:
+    """Claims runs from the queue and executes them."""
+
+    def __init__(
+        self,
+        runnable: Runnable = agent,
+        *,
+        concurrency: int = WORKER_CONCURRENCY,
+        worker_id: Optional[str] = None,
+    ) -> None:
+        self.runnable = runnable
+        self.concurrency = concurrency
+        self.id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._tasks: dict[UUID, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def wakeup(self, payload: str = "") -> None:
+        """Look for queued runs now rather than at the next poll."""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop claiming runs, and return from `run` once the current ones end."""
+        self._stopping = True
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Execute queued runs until stopped."""
+        logger.info("Worker %s started", self.id)
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                if free := self.concurrency - len(self._tasks):
+                    try:
+                        runs = await storage.claim_runs(self.id, free)
+                    except Exception:
+                        logger.exception("Claiming runs failed")
+                        runs = []
+                    for run in runs:
+                        self._execute(run)
+                    if runs and len(runs) == free:
+                        # There may be more, check again once a run ends.
+                        continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), WORKER_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            await self._drain()
+        finally:
+            heartbeat.cancel()
+        logger.info("Worker %s stopped", self.id)
+
+    def _execute(self, run: Run) -> None:
+        run_id = run["run_id"]
+        task = run_manager.execute(
+            run_id, str(run["thread_id"]), lambda: self._invoke(run)
+        )
+        self._tasks[run_id] = task
+
+        def done(_: asyncio.Task) -> None:
+            del self._tasks[run_id]
+            self._wakeup.set()
+
+        task.add_done_callback(done)
+
+    async def _invoke(self, run: Run) -> None:
+        config = run["config"]
+        input_ = run["input"]
+        if run["attempts"] > 1 and await self._started(run):
+            # Resume from the last checkpoint instead of adding the input again.
+            input_ = None
+        elif input_ is not None:
+            input_ = _unpack_input(
+                self.runnable.get_input_schema(config).validate(input_)
+            )
+        await self.runnable.ainvoke(input_, config)
+
+    async def _started(self, run: Run) -> bool:
+        """Whether a previous attempt of the run wrote a checkpoint."""
+        checkpoint = await CHECKPOINTER.aget(
+            {"configurable": {"thread_id": run["thread_id"]}}
+        )
+        return (
+            checkpoint is not None
+            and datetime.fromisoformat(checkpoint["ts"]) >= run["started_at"]
+        )
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT_SECONDS)
+            try:
+                if self._tasks:
+                    # Cancelled runs are also told through NOTIFY, this catches
+                    # those missed while disconnected.
+                    await run_manager.interrupt(
+                        await storage.heartbeat_runs(self.id, list(self._tasks))
+                    )
+                if requeued := await storage.requeue_stale_runs(
+                    WORKER_STALE_SECONDS, WORKER_MAX_ATTEMPTS
+                ):
+                    logger.warning("Requeued %d stale runs", requeued)
+            except Exception:
+                logger.exception("Heartbeat failed")
+
+    async def _drain(self) -> None:
+        """Wait for the current runs to end, requeueing those that don't in time."""
+        if not self._tasks:
+            return
+        await asyncio.wait(list(self._tasks.values()), timeout=WORKER_SHUTDOWN_SECONDS)
+        if remaining := list(self._tasks):
+            logger.warning("Requeueing %d unfinished runs", len(remaining))
+            await run_manager.interrupt(remaining)
+            await storage.requeue_runs(self.id, remaining)
+
+
+async def main() -> None:
+    worker = Worker()
+    add_listener(storage.RUNS_CHANNEL, worker.wakeup)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    async with lifespan(None):
+        await worker.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""Compare checkpoint codecs on synthetic but realistic agent threads.
+
+Threads alternate between a human question, an AI tool call, a tool result of
+a few KB and an AI answer, which is what a tool-using assistant accumulates.
+
+    poetry run python -m benchmarks.checkpoint_codec
+"""
+import random
+import time
+from typing import Callable
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from app.codec import Codec, CompactCodec, PickleCodec, decode
+from app.message_types import LiberalToolMessage
+
+THREAD_SIZES = [10, 100, 1000]
+WORDS = (
+    "weather san francisco forecast partly cloudy high low wind west mph fog "
+    "bay area temperature degrees humidity morning evening clear skies rain "
+    "chance percent weekend report national service update marine layer coast"
+).split()
+
+
+def _tool_output(i: int) -> str:
+    """A ~2KB search result; random words so it compresses like real text."""
+    rng = random.Random(i)
+    return "\n".join(
+        f"Title: {' '.join(rng.choices(WORDS, k=6))}\n"
+        f"Snippet: {' '.join(rng.choices(WORDS, k=40))}"
+        for _ in range(6)
+    )
+
+
+def make_thread(size: int) -> list:
+    messages = []
+    for i in range(size):
+        turn = i % 4
+        if turn == 0:
+            messages.append(HumanMessage(content=f"What's the weather like? ({i})"))
+        elif turn == 1:
+            messages.append(
+                AIMessage(
+                    content="",
+                    additional_kwargs={
+                        "tool_calls": [
+                            {
+                                "id": f"call_{i}",
+                                "type": "function",
+                                "function": {
+                                    "name": "search_tavily",
+                                    "arguments": '{"query": "weather in sf"}',
+                                },
+                            }
+                        ]
+                    },
+                )
+            )
+        elif turn == 2:
+            messages.append(
+                LiberalToolMessage(
+                    tool_call_id=f"call_{i - 1}",
+                    content=_tool_output(i),
+                    additional_kwargs={"name": "search_tavily"},
+                )
+            )
+        else:
+            messages.append(AIMessage(content="It is 64 degrees and partly cloudy."))
+    return messages
+
+
+def make_checkpoint(size: int) -> dict:
+    checkpoint = empty_checkpoint()
+    messages = make_thread(size)
+    # Like pregel, node inboxes and __end__ hold (prefixes of) the root list.
+    checkpoint["channel_values"] = {
+        "__root__": messages,
+        "__end__": messages,
+        "agent:inbox": messages[:-1],
+        "action:inbox": messages[:-2],
+        "agent": messages[-1],
+    }
+    checkpoint["channel_versions"].update({"__root__": size, "agent": size // 2})
+    checkpoint["versions_seen"]["agent"]["__root__"] = size
+    return checkpoint
+
+
+def _time(fn: Callable[[], object], min_seconds: float = 0.5) -> float:
+    """Average seconds per call."""
+    runs = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_seconds or runs < 3:
+        fn()
+        runs += 1
+    return elapsed / runs
+
+
+def main() -> None:
+    codecs: dict[str, Codec] = {"pickle": PickleCodec(), "compact": CompactCodec()}
+    try:
+        codecs["compact+zstd"] = CompactCodec(compress_threshold=4096)
+    except ImportError:
+        print("zstandard not installed, skipping compression\n")
+
+    for size in THREAD_SIZES:
+        checkpoint = make_checkpoint(size)
+        print(f"{size} messages")
+        for name, codec in codecs.items():
+            data = codec.encode(checkpoint)
+            encode = _time(lambda: codec.encode(checkpoint))
+            decode_ = _time(lambda: decode(data))
+            print(
+                f"  {name:<13} {len(data) / 1024:>9.1f} KiB  "
+                f"encode {encode * 1000:>8.3f} ms ({size / encode:>9.0f} msg/s)  "
+                f"decode {decode_ * 1000:>8.3f} ms ({size / decode_:>9.0f} msg/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
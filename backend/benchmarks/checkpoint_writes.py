@@ -0,0 +1,84 @@
+"""Compare checkpoint write costs of upsert and delta storage.
+
+Each thread is grown one message per step, the way an agent run checkpoints at
+the end of every step, and we record the WAL bytes and latency of every write.
+
+Requires a migrated database configured through the usual POSTGRES_* variables:
+
+    poetry run python -m benchmarks.checkpoint_writes
+"""
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from app.checkpoint import PostgresCheckpoint
+from app.lifespan import get_pg_pool, lifespan
+
+THREAD_SIZES = [10, 100, 1000]
+TOOL_OUTPUT = "lorem ipsum dolor sit amet " * 80  # ~2KB, like a search result
+
+
+def _message(i: int):
+    if i % 2 == 0:
+        return HumanMessage(content=f"question {i}")
+    return AIMessage(content=TOOL_OUTPUT)
+
+
+async def _wal_lsn() -> str:
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchval("SELECT pg_current_wal_lsn()")
+
+
+async def _wal_bytes_since(lsn: str) -> int:
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchval(
+            "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), $1)", lsn
+        )
+
+
+async def _bench(saver: PostgresCheckpoint, size: int) -> dict:
+    config = {"configurable": {"thread_id": str(uuid4())}}
+    checkpoint = empty_checkpoint()
+    latencies = []
+    lsn = await _wal_lsn()
+    for i in range(size):
+        values = checkpoint["channel_values"]
+        message = _message(i)
+        values["__root__"] = values.get("__root__", []) + [message]
+        values["agent"] = message
+        checkpoint["channel_versions"]["__root__"] += 1
+        start = time.perf_counter()
+        await saver.aput(config, checkpoint)
+        latencies.append(time.perf_counter() - start)
+    wal_bytes = await _wal_bytes_since(lsn)
+    return {
+        "wal_bytes": wal_bytes,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": statistics.quantiles(latencies, n=100)[98] * 1000
+        if len(latencies) > 1
+        else latencies[0] * 1000,
+    }
+
+
+async def main() -> None:
+    async with lifespan(None):
+        for size in THREAD_SIZES:
+            for name, saver in [
+                ("upsert", PostgresCheckpoint(delta_storage=False)),
+                ("delta", PostgresCheckpoint(delta_storage=True)),
+            ]:
+                result = await _bench(saver, size)
+                print(
+                    f"{size:>5} messages  {name:<6}  "
+                    f"WAL {result['wal_bytes'] / 1024:>10.1f} KiB  "
+                    f"p50 {result['p50_ms']:>7.2f} ms  "
+                    f"p99 {result['p99_ms']:>7.2f} ms"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
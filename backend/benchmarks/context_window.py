@@ -0,0 +1,51 @@
+"""Measure the prompt tokens of long threads with and without a token budget.
+
+Executors used to send the whole thread on every step, so prompt tokens grew
+with it. Now they send the latest messages fitting in the budget of the model.
+Also times fitting a thread with token counts cached, as on every step after
+the first, and without.
+
+    poetry run python -m benchmarks.context_window
+"""
+import time
+
+from app import context_window
+from app.context_window import CONTEXT_WINDOW_TOKENS, count_tokens, fit_messages
+from benchmarks.checkpoint_codec import make_thread
+
+THREAD_SIZES = [10, 100, 1000, 5000]
+BUDGETS = [4_000, CONTEXT_WINDOW_TOKENS["GPT 3.5 Turbo"]]
+
+
+def _tokens(messages: list) -> int:
+    return sum(count_tokens(m) for m in messages)
+
+
+def _time(fn, repeat: int = 5) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    if context_window._encoding() is None:
+        print("tiktoken encoding not available, tokens are estimated")
+    for thread_size in THREAD_SIZES:
+        messages = make_thread(thread_size)
+        full = _tokens(messages)
+        for budget in BUDGETS:
+            fitted = _tokens(fit_messages(messages, budget))
+            context_window._counts.clear()
+            cold = _time(lambda: fit_messages(messages, budget), repeat=1)
+            warm = _time(lambda: fit_messages(messages, budget))
+            print(
+                f"{thread_size:>5} messages  budget {budget:>6}  "
+                f"{full:>9} -> {fitted:>6} prompt tokens "
+                f"({1 - fitted / full:>4.0%} fewer)  "
+                f"fit {cold * 1000:>7.2f} ms cold {warm * 1000:>6.2f} ms cached"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare listing all threads of a user with keyset paginated listing.
+
+Inserts 1M threads spread over 10k users, with one heavy user owning 50k of
+them, then times `list_threads` against the first and a deep page of
+`list_threads_page` for that user and shows the plan used for a page. The
+inserted rows are deleted afterwards.
+
+Requires a migrated database configured through the usual POSTGRES_* variables:
+
+    poetry run python -m benchmarks.list_threads
+"""
+import asyncio
+import statistics
+import time
+
+from app import storage
+from app.lifespan import get_pg_pool, lifespan
+
+ROWS = 1_000_000
+USERS = 10_000
+HEAVY_USER_ROWS = 50_000
+PAGE_SIZE = 100
+RUNS = 20
+USER_PREFIX = "bench-list-"
+HEAVY_USER = f"{USER_PREFIX}heavy"
+
+
+async def _seed() -> None:
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            (
+                "INSERT INTO thread (user_id, name, updated_at) "
+                "SELECT CASE WHEN i <= $2 THEN $3 ELSE $4 || (i % $5) END, "
+                "'thread ' || i, now() - i * interval '1 second' "
+                "FROM generate_series(1, $1) AS i"
+            ),
+            ROWS,
+            HEAVY_USER_ROWS,
+            HEAVY_USER,
+            USER_PREFIX,
+            USERS,
+        )
+        await conn.execute("ANALYZE thread")
+
+
+async def _cleanup() -> None:
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "DELETE FROM thread WHERE user_id LIKE $1", f"{USER_PREFIX}%"
+        )
+
+
+async def _bench(name: str, fn) -> None:
+    latencies = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = await fn()
+        latencies.append(time.perf_counter() - start)
+    items = result["items"] if isinstance(result, dict) else result
+    print(
+        f"{name:<12} {len(items):>6} rows  "
+        f"p50 {statistics.median(latencies) * 1000:>8.2f} ms  "
+        f"max {max(latencies) * 1000:>8.2f} ms"
+    )
+
+
+async def _deep_cursor(pages: int) -> str:
+    cursor = None
+    for _ in range(pages):
+        page = await storage.list_threads_page(
+            HEAVY_USER, limit=PAGE_SIZE, cursor=cursor
+        )
+        cursor = page["next_cursor"]
+    return cursor
+
+
+async def main() -> None:
+    async with lifespan(None):
+        await _seed()
+        try:
+            await _bench("list all", lambda: storage.list_threads(HEAVY_USER))
+            await _bench(
+                "first page",
+                lambda: storage.list_threads_page(HEAVY_USER, limit=PAGE_SIZE),
+            )
+            cursor = await _deep_cursor(100)
+            await _bench(
+                "page 100",
+                lambda: storage.list_threads_page(
+                    HEAVY_USER, limit=PAGE_SIZE, cursor=cursor
+                ),
+            )
+            async with get_pg_pool().acquire() as conn:
+                plan = await conn.fetch(
+                    (
+                        "EXPLAIN SELECT thread_id, assistant_id, name, updated_at "
+                        "FROM thread WHERE user_id = $1 "
+                        "ORDER BY updated_at DESC, thread_id DESC LIMIT $2"
+                    ),
+                    HEAVY_USER,
+                    PAGE_SIZE + 1,
+                )
+            print("\n".join(row[0] for row in plan))
+        finally:
+            await _cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""Profile converting tool messages for the LLM on every step of a run.
+
+The OpenAI and Google agents send tool results as ToolMessage/FunctionMessage
+with string content. They used to build those from every tool message of the
+thread on every step, stringifying and validating large tool outputs again each
+time. Now each message is converted once and the result kept on it.
+
+Prints the CPU time per step for tool-heavy threads, and the functions taking
+the most of it in the last run of each.
+
+    poetry run python -m benchmarks.message_conversion
+"""
+import cProfile
+import pstats
+import time
+
+from langchain_core.messages import ToolMessage
+
+from app.message_types import LiberalToolMessage
+from benchmarks.checkpoint_codec import make_thread
+
+THREAD_SIZES = [100, 1000]
+STEPS = 20
+
+
+def _old_convert(messages: list) -> list:
+    """The conversion before messages kept theirs."""
+    msgs = []
+    for m in messages:
+        if isinstance(m, LiberalToolMessage):
+            _dict = m.dict()
+            _dict["content"] = str(_dict["content"])
+            msgs.append(ToolMessage(**_dict))
+        else:
+            msgs.append(m)
+    return msgs
+
+
+def _convert(messages: list) -> list:
+    return [
+        m.to_message() if isinstance(m, LiberalToolMessage) else m for m in messages
+    ]
+
+
+def _per_step(convert, messages: list, steps: int = STEPS) -> float:
+    start = time.process_time()
+    for _ in range(steps):
+        convert(messages)
+    return (time.process_time() - start) / steps
+
+
+def _profile(convert, messages: list) -> None:
+    profile = cProfile.Profile()
+    profile.runcall(lambda: [convert(messages) for _ in range(STEPS)])
+    pstats.Stats(profile).sort_stats("tottime").print_stats(5)
+
+
+def main() -> None:
+    for thread_size in THREAD_SIZES:
+        messages = make_thread(thread_size)
+        old = _per_step(_old_convert, messages)
+        # The first step of a run converts the messages, the others reuse them.
+        first = _per_step(_convert, messages, steps=1)
+        new = _per_step(_convert, messages)
+        print(
+            f"{thread_size:>5} messages  old {old * 1000:>7.2f} ms/step  "
+            f"new {first * 1000:>7.2f} ms first step, {new * 1000:>5.2f} ms after"
+        )
+        if thread_size == THREAD_SIZES[-1]:
+            print("Old conversion:")
+            _profile(_old_convert, messages)
+            print("New conversion:")
+            _profile(_convert, messages)
+
+
+if __name__ == "__main__":
+    main()
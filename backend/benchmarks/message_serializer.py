@@ -0,0 +1,59 @@
+"""Compare serializing message lists with langserve's serializer and ours.
+
+`langserve` is how `to_sse` and the thread endpoints used to serialize
+messages: map chunks to messages, then WellKnownLCSerializer. `fast` is
+`app.serialization`. AI messages are chunks, as they are when streamed.
+
+    poetry run python -m benchmarks.message_serializer
+"""
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langserve.serialization import WellKnownLCSerializer
+
+from app.serialization import dumps, message_dicts
+from app.stream import map_chunk_to_msg
+from benchmarks.checkpoint_codec import make_thread
+
+THREAD_SIZES = [10, 100, 1000]
+SECONDS = 1
+
+
+def _langserve(messages: list, serializer=WellKnownLCSerializer()) -> bytes:
+    return serializer.dumps([map_chunk_to_msg(msg) for msg in messages])
+
+
+def _fast(messages: list) -> bytes:
+    return dumps(message_dicts(messages))
+
+
+def _throughput(serialize, messages: list) -> tuple[float, int]:
+    runs = 0
+    size = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < SECONDS:
+        size += len(serialize(messages))
+        runs += 1
+    return runs * len(messages) / elapsed, size / elapsed
+
+
+def main() -> None:
+    for thread_size in THREAD_SIZES:
+        messages = [
+            AIMessageChunk(**msg.__dict__ | {"type": "AIMessageChunk"})
+            if isinstance(msg, AIMessage)
+            else msg
+            for msg in make_thread(thread_size)
+        ]
+        assert _fast(messages) == _langserve(messages)
+        for name, serialize in [("langserve", _langserve), ("fast", _fast)]:
+            per_second, size = _throughput(serialize, messages)
+            print(
+                f"{thread_size:>5} messages  {name:<10}"
+                f"{per_second / 1000:>9.1f} k messages/s  "
+                f"{size / 2**20:>8.1f} MiB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Load test the run queue: API latency while workers drain a burst of runs.
+
+Starts the API with RUN_QUEUE=postgres and WORKERS worker processes, which
+execute a stand-in for the agent that spends RUN_CPU_MS of CPU and waits
+RUN_WAIT_MS as if on an LLM. Then queues RUNS runs at once, and reports the
+latency of listing threads, an unrelated API call, before the burst and every
+second while the queue drains. The created rows are deleted afterwards.
+
+Requires a migrated database configured through the usual POSTGRES_* variables:
+
+    poetry run python -m benchmarks.run_queue
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from uuid import uuid4
+
+import httpx
+
+from app.lifespan import get_pg_pool, lifespan
+
+RUNS = 1000
+WORKERS = 2
+CONCURRENCY = 8
+RUN_CPU_MS = 2
+RUN_WAIT_MS = 500
+PORT = 8199
+USER = "bench-run-queue"
+HEADERS = {"Cookie": f"opengpts_user_id={USER}"}
+
+
+async def _fake_agent(input) -> None:
+    deadline = time.process_time() + RUN_CPU_MS / 1000
+    while time.process_time() < deadline:
+        pass
+    await asyncio.sleep(RUN_WAIT_MS / 1000)
+
+
+async def _worker() -> None:
+    from langchain_core.runnables import RunnableLambda
+
+    from app import storage
+    from app.lifespan import add_listener
+    from app.worker import Worker
+
+    worker = Worker(RunnableLambda(_fake_agent), concurrency=CONCURRENCY)
+    add_listener(storage.RUNS_CHANNEL, worker.wakeup)
+    async with lifespan(None):
+        await worker.run()
+
+
+async def _latencies(client: httpx.AsyncClient, seconds: float) -> list[float]:
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/threads/", headers=HEADERS)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.02)
+    return latencies
+
+
+def _summary(latencies: list[float]) -> str:
+    return (
+        f"p50 {statistics.median(latencies) * 1000:>6.2f} ms  "
+        f"max {max(latencies) * 1000:>6.2f} ms"
+    )
+
+
+async def _counts() -> dict[str, int]:
+    async with get_pg_pool().acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT status, count(*) FROM run WHERE user_id = $1 GROUP BY status",
+            USER,
+        )
+    return {row["status"]: row["count"] for row in rows}
+
+
+async def _burst(client: httpx.AsyncClient, assistant_id: str) -> list[float]:
+    semaphore = asyncio.Semaphore(50)
+    latencies = []
+
+    async def create() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(
+                "/runs",
+                json={
+                    "assistant_id": assistant_id,
+                    "thread_id": str(uuid4()),
+                    "input": [],
+                },
+                headers=HEADERS,
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(create() for _ in range(RUNS)))
+    return latencies
+
+
+async def main() -> None:
+    env = {**os.environ, "RUN_QUEUE": "postgres"}
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.server:app",
+                "--port",
+                str(PORT),
+                "--log-level",
+                "warning",
+            ],
+            env=env,
+        ),
+        *(
+            subprocess.Popen([sys.executable, "-m", "benchmarks.run_queue", "worker"])
+            for _ in range(WORKERS)
+        ),
+    ]
+    try:
+        async with lifespan(None), httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{PORT}", timeout=60
+        ) as client:
+            # Importing the app takes a while.
+            for _ in range(600):
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            assistant_id = str(uuid4())
+            response = await client.put(
+                f"/assistants/{assistant_id}",
+                json={"name": "bench", "config": {"configurable": {}}, "public": False},
+                headers=HEADERS,
+            )
+            response.raise_for_status()
+
+            print(f"idle          {_summary(await _latencies(client, 2))}")
+            start = time.perf_counter()
+            print(f"queue {RUNS} runs {_summary(await _burst(client, assistant_id))}")
+            while True:
+                latencies = await _latencies(client, 1)
+                counts = await _counts()
+                print(
+                    f"{time.perf_counter() - start:>5.1f} s  "
+                    f"queued {counts.get('queued', 0):>5}  "
+                    f"running {counts.get('running', 0):>3}  "
+                    f"succeeded {counts.get('succeeded', 0):>5}  "
+                    f"{_summary(latencies)}"
+                )
+                if counts.get("succeeded", 0) >= RUNS:
+                    break
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        async with lifespan(None):
+            async with get_pg_pool().acquire() as conn:
+                await conn.execute("DELETE FROM run WHERE user_id = $1", USER)
+                await conn.execute("DELETE FROM assistant WHERE user_id = $1", USER)
+
+
+if __name__ == "__main__":
+    asyncio.run(_worker() if sys.argv[1:] == ["worker"] else main())
@@ -0,0 +1,54 @@
+"""Measure how long it takes to set up the agent for a run.
+
+Every run configures the agent with its own thread ID, which constructs a new
+ConfigurableAgent. `uncached` clears the executor cache before every run, as
+if each run compiled its own graph, `cached` is the steady state.
+
+    poetry run python -m benchmarks.run_setup
+"""
+import os
+import statistics
+import time
+from uuid import uuid4
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app import agent as agent_module  # noqa: E402
+from app.agent import AgentType, ConfigurableAgent  # noqa: E402
+
+RUNS = 200
+TOOLS = [{"type": "ddg_search"}, {"type": "arxiv"}, {"type": "wikipedia"}]
+
+
+def _setup() -> None:
+    ConfigurableAgent(
+        agent=AgentType.GPT_35_TURBO,
+        tools=TOOLS,
+        system_message="You are a helpful assistant.",
+        assistant_id=str(uuid4()),
+        thread_id=str(uuid4()),
+    )
+
+
+def _bench(clear: bool) -> list[float]:
+    latencies = []
+    for _ in range(RUNS):
+        if clear:
+            agent_module._executors.clear()
+        start = time.perf_counter()
+        _setup()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    for name, clear in [("uncached", True), ("cached", False)]:
+        latencies = _bench(clear)
+        print(
+            f"{name:<9} p50 {statistics.median(latencies) * 1000:>7.3f} ms  "
+            f"p99 {statistics.quantiles(latencies, n=100)[98] * 1000:>7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
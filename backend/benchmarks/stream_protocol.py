@@ -0,0 +1,50 @@
+"""Compare the snapshot and delta SSE protocols while streaming a response.
+
+Streams a response of RESPONSE_TOKENS tokens at the end of a thread of
+THREAD_SIZE messages, the way astream_messages yields it, and reports CPU time
+per token and bytes sent for the whole response.
+
+    poetry run python -m benchmarks.stream_protocol
+"""
+import asyncio
+import time
+
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from app.stream import StreamProtocol, to_sse
+from benchmarks.checkpoint_codec import make_thread
+
+THREAD_SIZE = 200
+RESPONSE_TOKENS = 300
+
+
+async def _stream(history: list):
+    messages = list(history) + [HumanMessage(content="And tomorrow?")]
+    yield "run-id"
+    yield messages
+    messages.append(AIMessageChunk(content=""))
+    for i in range(RESPONSE_TOKENS):
+        messages[-1] = messages[-1] + AIMessageChunk(content=f" token{i}")
+        yield messages
+
+
+async def _bench(history: list, protocol: StreamProtocol) -> tuple[float, int]:
+    start = time.process_time()
+    sent = 0
+    async for event in to_sse(_stream(history), protocol):
+        sent += len(event.get("data", ""))
+    return time.process_time() - start, sent
+
+
+async def main() -> None:
+    history = make_thread(THREAD_SIZE)
+    for protocol in ["snapshot", "delta"]:
+        cpu, sent = await _bench(history, protocol)
+        print(
+            f"{protocol:<9} {cpu / RESPONSE_TOKENS * 1e6:>9.1f} us CPU/token  "
+            f"{sent / 1024:>10.1f} KiB/response"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Compare reading thread messages through a compiled agent graph and directly.
+
+`before` is how GET /threads/{tid}/messages used to work: build an agent
+executor, load the checkpoint into its channels and ask pregel for the next
+tasks. `after` is the current `storage.get_thread_messages` and `page` reads
+only the newest PAGE_SIZE messages with `storage.get_thread_messages_page`.
+
+Requires a migrated database configured through the usual POSTGRES_* variables:
+
+    poetry run python -m benchmarks.thread_messages
+"""
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+from langgraph.channels.base import ChannelsManager
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.pregel import _prepare_next_tasks
+
+from app import storage
+from app.agent import CHECKPOINTER, AgentType, get_agent_executor
+from app.lifespan import lifespan
+from app.stream import map_chunk_to_msg
+from benchmarks.checkpoint_codec import make_thread
+
+THREAD_SIZES = [10, 100, 1000, 5000]
+PAGE_SIZE = 50
+RUNS = 50
+
+
+async def _before(user_id: str, thread_id: str) -> dict:
+    config = {"configurable": {"thread_id": thread_id}}
+    app = get_agent_executor([], AgentType.GPT_35_TURBO, "", False)
+    checkpoint = await app.checkpointer.aget(config) or empty_checkpoint()
+    with ChannelsManager(app.channels, checkpoint) as channels:
+        return {
+            "messages": [map_chunk_to_msg(msg) for msg in channels["__root__"].get()],
+            "resumeable": bool(_prepare_next_tasks(checkpoint, app.nodes, channels)),
+        }
+
+
+async def _page(user_id: str, thread_id: str) -> dict:
+    return await storage.get_thread_messages_page(user_id, thread_id, limit=PAGE_SIZE)
+
+
+async def _bench(read, thread_id: str) -> list[float]:
+    latencies = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await read("1", thread_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main() -> None:
+    async with lifespan(None):
+        for size in THREAD_SIZES:
+            thread_id = str(uuid4())
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"]["__root__"] = make_thread(size)
+            checkpoint["channel_versions"]["__root__"] = 1
+            await CHECKPOINTER.aput(
+                {"configurable": {"thread_id": thread_id}}, checkpoint
+            )
+            assert await _before("1", thread_id) == await storage.get_thread_messages(
+                "1", thread_id
+            )
+            for name, read in [
+                ("before", _before),
+                ("after", storage.get_thread_messages),
+                ("page", _page),
+            ]:
+                latencies = await _bench(read, thread_id)
+                print(
+                    f"{size:>5} messages  {name:<6}  "
+                    f"p50 {statistics.median(latencies) * 1000:>7.2f} ms  "
+                    f"p99 {statistics.quantiles(latencies, n=100)[98] * 1000:>7.2f} ms"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
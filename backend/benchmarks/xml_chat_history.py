@@ -0,0 +1,102 @@
+"""Time collapsing the chat history for the XML agent over long runs.
+
+The XML agent sends each of its turns, actions, observations and answer, as a
+single AI message. That message used to be rebuilt from all messages of the
+thread on every step, with repeated string concatenation. Now the history of
+each thread is kept between steps and extended with the new messages.
+
+Runs are a question followed by steps of an action and a ~2KB observation.
+
+    poetry run python -m benchmarks.xml_chat_history
+"""
+import time
+
+from langchain_core.messages import AIMessage, FunctionMessage, HumanMessage
+
+from app.agent_types.xml_agent import ChatHistory, construct_chat_history
+from app.message_types import LiberalFunctionMessage
+from benchmarks.checkpoint_codec import _tool_output
+
+RUN_STEPS = [50, 200, 500]
+
+
+def _old_collapse_messages(messages):
+    log = ""
+    if isinstance(messages[-1], AIMessage):
+        scratchpad = messages[:-1]
+        final = messages[-1]
+    else:
+        scratchpad = messages
+        final = None
+    if len(scratchpad) % 2 != 0:
+        raise ValueError("Unexpected")
+    for i in range(0, len(scratchpad), 2):
+        action = messages[i]
+        observation = messages[i + 1]
+        log += f"{action.content}<observation>{observation.content}</observation>"
+    if final is not None:
+        log += final.content
+    return AIMessage(content=log)
+
+
+def _old_construct_chat_history(messages):
+    """The implementation before histories were kept between steps."""
+    collapsed_messages = []
+    temp_messages = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            if temp_messages:
+                collapsed_messages.append(_old_collapse_messages(temp_messages))
+                temp_messages = []
+            collapsed_messages.append(message)
+        elif isinstance(message, LiberalFunctionMessage):
+            _dict = message.dict()
+            _dict["content"] = str(_dict["content"])
+            temp_messages.append(FunctionMessage(**_dict))
+        else:
+            temp_messages.append(message)
+    if temp_messages:
+        collapsed_messages.append(_old_collapse_messages(temp_messages))
+    return collapsed_messages
+
+
+def make_run(steps: int) -> list:
+    messages = [HumanMessage(content="What's the weather like in SF this week?")]
+    for i in range(steps):
+        messages.append(
+            AIMessage(
+                content=f"<tool>search_tavily</tool><tool_input>weather sf day {i}"
+            )
+        )
+        messages.append(
+            LiberalFunctionMessage(content=_tool_output(i), name="search_tavily")
+        )
+    return messages
+
+
+def _time_run(messages: list, collapse) -> float:
+    """Seconds spent collapsing the history before each step of the run."""
+    start = time.perf_counter()
+    for end in range(1, len(messages) + 1, 2):
+        collapse(messages[:end])
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    for steps in RUN_STEPS:
+        messages = make_run(steps)
+        history = ChatHistory()
+        assert history.add(messages) == _old_construct_chat_history(messages)
+        old = _time_run(messages, _old_construct_chat_history)
+        rebuilt = _time_run(messages, construct_chat_history)
+        history = ChatHistory()
+        kept = _time_run(messages, history.add)
+        print(
+            f"{steps:>4} steps  old {old * 1000:>8.1f} ms  "
+            f"rebuilt {rebuilt * 1000:>8.1f} ms  kept {kept * 1000:>7.1f} ms  "
+            f"({old / kept:>5.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS checkpoint_delta;
+ALTER TABLE checkpoints DROP COLUMN IF EXISTS step;
@@ -0,0 +1,8 @@
+ALTER TABLE checkpoints ADD COLUMN IF NOT EXISTS step INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS checkpoint_delta (
+    thread_id TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    delta BYTEA NOT NULL,
+    PRIMARY KEY (thread_id, step)
+);
@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS checkpoint_versions;
+DROP TABLE IF EXISTS thread_message;
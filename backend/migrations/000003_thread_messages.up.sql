@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS thread_message (
+    thread_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    message BYTEA NOT NULL,
+    PRIMARY KEY (thread_id, idx)
+);
+
+CREATE TABLE IF NOT EXISTS checkpoint_versions (
+    thread_id TEXT PRIMARY KEY,
+    message_count INTEGER NOT NULL,
+    versions JSON NOT NULL
+);
@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS run_thread_id_created_at_idx;
+DROP TABLE IF EXISTS run;
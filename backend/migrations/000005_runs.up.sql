@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS run (
+    run_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    thread_id TEXT NOT NULL,
+    assistant_id UUID,
+    user_id VARCHAR(255) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    started_at TIMESTAMP WITH TIME ZONE,
+    ended_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS run_thread_id_created_at_idx
+    ON run (thread_id, created_at DESC);
@@ -0,0 +1,7 @@
+DROP INDEX IF EXISTS run_running_heartbeat_at_idx;
+DROP INDEX IF EXISTS run_queued_idx;
+ALTER TABLE run DROP COLUMN IF EXISTS attempts;
+ALTER TABLE run DROP COLUMN IF EXISTS heartbeat_at;
+ALTER TABLE run DROP COLUMN IF EXISTS worker_id;
+ALTER TABLE run DROP COLUMN IF EXISTS config;
+ALTER TABLE run DROP COLUMN IF EXISTS input;
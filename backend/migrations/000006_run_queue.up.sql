@@ -0,0 +1,12 @@
+ALTER TABLE run ADD COLUMN IF NOT EXISTS input JSON;
+ALTER TABLE run ADD COLUMN IF NOT EXISTS config JSON;
+ALTER TABLE run ADD COLUMN IF NOT EXISTS worker_id TEXT;
+ALTER TABLE run ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE run ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+-- Runs with a config are executed by workers.
+CREATE INDEX IF NOT EXISTS run_queued_idx
+    ON run (created_at) WHERE status = 'queued' AND config IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS run_running_heartbeat_at_idx
+    ON run (heartbeat_at) WHERE status = 'running' AND config IS NOT NULL;
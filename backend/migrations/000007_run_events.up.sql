@@ -0,0 +1,8 @@
+-- Events of streamed runs, relayed to the processes following them.
+CREATE TABLE IF NOT EXISTS run_event (
+    run_id UUID NOT NULL,
+    event_id INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (run_id, event_id)
+);
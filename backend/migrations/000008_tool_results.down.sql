@@ -0,0 +1 @@
+DROP TABLE IF EXISTS tool_result;
@@ -0,0 +1,10 @@
+-- Cached results of tools searching public data, shared by all processes.
+CREATE TABLE IF NOT EXISTS tool_result (
+    tool VARCHAR NOT NULL,
+    key VARCHAR NOT NULL,
+    value BYTEA NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (tool, key)
+);
+
+CREATE INDEX IF NOT EXISTS tool_result_expires_at_idx ON tool_result (expires_at);
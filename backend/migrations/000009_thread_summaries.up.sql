@@ -0,0 +1,7 @@
+-- Summaries of the earlier messages of long threads, the first message_count.
+CREATE TABLE IF NOT EXISTS thread_summary (
+    thread_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS run_event_created_at_idx;
+ALTER TABLE run_event ALTER COLUMN created_at DROP NOT NULL;
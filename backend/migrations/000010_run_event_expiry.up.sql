@@ -0,0 +1,5 @@
+UPDATE run_event SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE run_event ALTER COLUMN created_at SET NOT NULL;
+
+-- Events are deleted by age, see delete_expired_run_events.
+CREATE INDEX IF NOT EXISTS run_event_created_at_idx ON run_event (created_at);
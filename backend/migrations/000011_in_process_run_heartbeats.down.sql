@@ -0,0 +1 @@
+DROP INDEX IF EXISTS run_running_in_process_heartbeat_at_idx;
@@ -0,0 +1,8 @@
+-- Runs executed by the process that created them, without a config, are
+-- heartbeated too, see fail_stale_runs. Those running before then are given
+-- one, so that they are failed unless still heartbeated.
+UPDATE run SET heartbeat_at = COALESCE(started_at, created_at)
+    WHERE status = 'running' AND config IS NULL AND heartbeat_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS run_running_in_process_heartbeat_at_idx
+    ON run (heartbeat_at) WHERE status = 'running' AND config IS NULL;
@@ -0,0 +1,89 @@
+"""Test deadlines and concurrency limits of tool calls."""
+import asyncio
+import time
+import weakref
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tools import tool
+from langgraph.prebuilt import ToolInvocation
+
+from app.agent_types import tool_executor
+from app.agent_types.tool_executor import TIMEOUT_MESSAGE, ToolExecutor, ToolTimeout
+
+running = 0
+most_running = 0
+
+
+@tool
+async def wait(seconds: float) -> str:
+    """Wait for some seconds."""
+    global running, most_running
+    running += 1
+    most_running = max(most_running, running)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        running -= 1
+    return "done"
+
+
+def _call(seconds: float) -> ToolInvocation:
+    return ToolInvocation(tool="wait", tool_input={"seconds": seconds})
+
+
+async def test_timeout(monkeypatch) -> None:
+    """Calls past their deadline return a message instead."""
+    monkeypatch.setattr(tool_executor, "TOOL_TIMEOUTS", {"wait": 0.05})
+    executor = ToolExecutor([wait])
+    assert await executor.ainvoke(_call(0)) == "done"
+    assert await executor.ainvoke(_call(1)) == TIMEOUT_MESSAGE.format(
+        tool="wait", timeout=0.05
+    )
+
+
+class _Ended(BaseCallbackHandler):
+    def __init__(self) -> None:
+        self.ended: list = []
+
+    def on_tool_end(self, output: str, **kwargs) -> None:
+        self.ended.append(output)
+
+    def on_tool_error(self, error: BaseException, **kwargs) -> None:
+        self.ended.append(error)
+
+
+async def test_timeout_ends_run(monkeypatch) -> None:
+    """Callbacks see the runs of calls past their deadline end."""
+    monkeypatch.setattr(tool_executor, "TOOL_TIMEOUTS", {"wait": 0.05})
+    ended = _Ended()
+    await ToolExecutor([wait]).ainvoke(_call(1), {"callbacks": [ended]})
+    assert [type(e) for e in ended.ended] == [ToolTimeout]
+
+
+async def test_parallel(monkeypatch) -> None:
+    """Calls emitted together run in parallel, up to the limit per tool."""
+    global most_running
+    monkeypatch.setattr(tool_executor, "TOOL_CONCURRENCY_LIMITS", {"wait": 2})
+    monkeypatch.setattr(tool_executor, "_semaphores", weakref.WeakKeyDictionary())
+    most_running = 0
+    executor = ToolExecutor([wait])
+
+    start = time.monotonic()
+    assert await executor.abatch([_call(0.1)] * 4) == ["done"] * 4
+    assert 0.2 <= time.monotonic() - start < 0.35
+    assert most_running == 2
+
+
+def test_event_loops(monkeypatch) -> None:
+    """Limits hold in any number of event loops, each with its own slots."""
+    monkeypatch.setattr(tool_executor, "TOOL_CONCURRENCY_LIMITS", {"wait": 1})
+    executor = ToolExecutor([wait])
+    for _ in range(2):
+        # Waiting for the slot binds it to the loop.
+        assert asyncio.run(executor.abatch([_call(0.01)] * 2)) == ["done"] * 2
+
+
+async def test_unknown_tool() -> None:
+    executor = ToolExecutor([wait])
+    output = await executor.ainvoke(ToolInvocation(tool="nope", tool_input={}))
+    assert "nope is not a valid tool" in output
@@ -0,0 +1,83 @@
+"""Test collapsing the chat history for the XML agent."""
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.agent_types import xml_agent
+from app.agent_types.xml_agent import ChatHistory, construct_chat_history
+from app.message_types import LiberalFunctionMessage
+
+
+def _run(steps: int, question: str = "q") -> list:
+    messages = [HumanMessage(content=question)]
+    for i in range(steps):
+        messages.append(AIMessage(content=f"<tool>t</tool><tool_input>{i}"))
+        messages.append(LiberalFunctionMessage(content={"step": i}, name="t"))
+    return messages
+
+
+def test_construct_chat_history() -> None:
+    messages = [
+        *_run(2),
+        AIMessage(content="answer"),
+        HumanMessage(content="thanks"),
+        AIMessage(content="welcome"),
+    ]
+    assert construct_chat_history(messages) == [
+        HumanMessage(content="q"),
+        AIMessage(
+            content="<tool>t</tool><tool_input>0<observation>{'step': 0}</observation>"
+            "<tool>t</tool><tool_input>1<observation>{'step': 1}</observation>"
+            "answer"
+        ),
+        HumanMessage(content="thanks"),
+        AIMessage(content="welcome"),
+    ]
+    with pytest.raises(ValueError):
+        construct_chat_history(
+            [*_run(1), AIMessage(content="a"), AIMessage(content="b")]
+        )
+
+
+def test_chat_history_extended() -> None:
+    messages = [*_run(20), AIMessage(content="answer"), *_run(20, "again")]
+    history = ChatHistory()
+    for end in range(1, len(messages) + 1):
+        assert history.add(messages[:end]) == construct_chat_history(messages[:end])
+    # From a message of the user, as when earlier messages don't fit.
+    start = messages.index(HumanMessage(content="again"))
+    assert history.add(messages, start) == construct_chat_history(messages[start:])
+    # Other messages than those it was extended with start over.
+    other = _run(3, "other")
+    assert history.add(other) == construct_chat_history(other)
+    # As do messages replaced in the middle, with the same first and last.
+    edited = LiberalFunctionMessage(content={"step": "edited"}, name="t")
+    replaced = [*other[:2], edited, *other[3:]]
+    assert history.add(replaced) == construct_chat_history(replaced)
+
+
+def test_chat_history_kept_per_thread() -> None:
+    messages = _run(5)
+    config = {"configurable": {"thread_id": "xml-thread"}}
+    xml_agent._histories.clear()
+    assert xml_agent._chat_history(messages, messages, config) == (
+        construct_chat_history(messages)
+    )
+    assert xml_agent._histories.peek("xml-thread") is not None
+    # Windows not ending the thread's messages are collapsed on their own.
+    window = [HumanMessage(content="asked"), *messages[-2:]]
+    assert xml_agent._chat_history(messages, window, config) == (
+        construct_chat_history(window)
+    )
+
+
+def test_chat_history_dropped() -> None:
+    messages = _run(5)
+    config = {"configurable": {"thread_id": "xml-thread"}}
+    xml_agent._histories.clear()
+    xml_agent._chat_history(messages, messages, config)
+    assert xml_agent._histories.size == len(messages)
+    # Kept while the agent calls tools, dropped once it answers.
+    xml_agent._end_run(AIMessage(content="<tool>t</tool>"), config)
+    assert xml_agent._histories.peek("xml-thread") is not None
+    xml_agent._end_run(AIMessage(content="answer"), config)
+    assert xml_agent._histories.peek("xml-thread") is None
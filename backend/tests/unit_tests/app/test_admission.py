@@ -0,0 +1,105 @@
+"""Test admission control."""
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, Rejected, llm_type
+
+
+def _controller(**kwargs) -> AdmissionController:
+    return AdmissionController(
+        **{
+            "user_concurrency": 1,
+            "llm_limits": {},
+            "default_llm_limit": (1000, 1000),
+            "queue_size": 10,
+            "user_queue_size": 3,
+            "timeout": 5,
+            **kwargs,
+        }
+    )
+
+
+async def test_fair_queue() -> None:
+    """Waiting runs start in turns between users, not in order of arrival."""
+    controller = _controller(user_concurrency=10, llm_limits={"llm": (50, 1)})
+    started = []
+
+    async def run(name: str) -> None:
+        (await controller.admit(name[0], "llm"))()
+        started.append(name)
+
+    tasks = []
+    for name in ["a1", "a2", "a3", "a4", "b1", "b2"]:
+        tasks.append(asyncio.create_task(run(name)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert started == ["a1", "a2", "b1", "a3", "b2", "a4"]
+
+
+async def test_user_concurrency() -> None:
+    """Users can't have more runs going than their cap, other users can."""
+    controller = _controller()
+    done = await controller.admit("a", "llm")
+    waiting = asyncio.create_task(controller.admit("a", "llm"))
+    (await controller.admit("b", "llm"))()
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    done()
+    (await waiting)()
+
+
+async def test_rejections() -> None:
+    """Runs are rejected when the queue overflows or they waited too long."""
+    controller = _controller(user_queue_size=1, timeout=0.05)
+    done = await controller.admit("a", "llm")
+    waiting = asyncio.create_task(controller.admit("a", "llm"))
+    await asyncio.sleep(0)
+    with pytest.raises(Rejected) as e:
+        await controller.admit("a", "llm")
+    assert e.value.reason == "user_queue_full"
+    assert e.value.retry_after >= 1
+    with pytest.raises(Rejected) as e:
+        await waiting
+    assert e.value.reason == "timeout"
+    done()
+    (await controller.admit("a", "llm"))()
+
+
+async def test_token_bucket() -> None:
+    """Runs of an LLM start at the rate of its bucket once the burst is used."""
+    controller = _controller(user_concurrency=10, llm_limits={"slow": (20, 2)})
+    for _ in range(2):
+        (await controller.admit("a", "slow"))()
+    # Other LLMs are not held back.
+    (await controller.admit("a", "fast"))()
+    start = asyncio.get_running_loop().time()
+    (await controller.admit("a", "slow"))()
+    assert asyncio.get_running_loop().time() - start >= 0.04
+
+
+async def test_cancelled_waiter() -> None:
+    """Runs whose client went away while waiting leave the queue."""
+    controller = _controller()
+    done = await controller.admit("a", "llm")
+    waiting = asyncio.create_task(controller.admit("a", "llm"))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    await asyncio.sleep(0)
+    assert not controller._waiting
+    done()
+    assert controller._running["a"] == 0
+
+
+def test_llm_type() -> None:
+    assert llm_type({"configurable": {}}) == "GPT 3.5 Turbo"
+    assert (
+        llm_type({"configurable": {"type==agent/agent_type": "GPT 4 Turbo"}})
+        == "GPT 4 Turbo"
+    )
+    assert (
+        llm_type(
+            {"configurable": {"type": "chatbot", "type==chatbot/llm_type": "GEMINI"}}
+        )
+        == "GEMINI"
+    )
@@ -0,0 +1,73 @@
+"""Test the configurable agents."""
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app import tools
+from app.agent import AgentType, ConfigurableAgent
+from app.tools import ThreadRetrievalTool, ThreadRetriever
+
+
+def _agent(tools: list, thread_id: str, **kwargs) -> ConfigurableAgent:
+    return ConfigurableAgent(
+        agent=AgentType.GPT_35_TURBO,
+        tools=tools,
+        system_message="Be helpful.",
+        assistant_id="a",
+        thread_id=thread_id,
+        **kwargs,
+    )
+
+
+def test_executor_cache() -> None:
+    """Runs with the same configuration share a compiled executor."""
+    tools = [{"type": "wikipedia"}]
+    assert _agent(tools, "1").bound is _agent(list(tools), "2").bound
+    assert (
+        _agent(tools, "1").bound
+        is not _agent(tools, "1", interrupt_before_action=True).bound
+    )
+
+    # The retrieval tool finds the thread in the config of each call.
+    tools = [{"type": "retrieval"}]
+    assert _agent(tools, "1").bound is _agent(tools, "2").bound
+    assert (
+        _agent(tools, "1").bound
+        is not _agent(tools, "1", retrieval_description="Search.").bound
+    )
+
+
+class _Searched(BaseRetriever):
+    ids: tuple[str, str]
+    searched: list
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        self.searched.append(self.ids)
+        return [Document(page_content=query)]
+
+
+async def test_thread_retrieval(monkeypatch) -> None:
+    """Retrieval searches the files of the assistant and thread of the call."""
+    searched: list = []
+
+    def get_retriever(assistant_id: str, thread_id: str) -> BaseRetriever:
+        return _Searched(ids=(assistant_id, thread_id), searched=searched)
+
+    monkeypatch.setattr(tools, "get_retriever", get_retriever)
+    retriever = ThreadRetriever()
+    tool = ThreadRetrievalTool(description="Search.")
+    cats = [Document(page_content="cats")]
+    for thread_id in ("1", "2"):
+        config = {"configurable": {"assistant_id": "a", "thread_id": thread_id}}
+        assert await retriever.ainvoke("cats", config) == cats
+        assert retriever.invoke("cats", config) == cats
+        assert await tool.ainvoke({"query": "cats"}, config) == cats
+        assert tool.invoke("cats", config) == cats
+    assert searched == [("a", "1")] * 4 + [("a", "2")] * 4
+
+
+def test_thread_retrieval_unconfigured() -> None:
+    """Retrieval without the thread in the config fails, not searches everything."""
+    with pytest.raises(ValueError):
+        ThreadRetrievalTool(description="Search.").run("cats")
@@ -143,3 +143,43 @@ async def test_threads() -> None:
             "/threads/",
         )
         assert response.status_code == 422
+
+
+async def test_list_threads_page() -> None:
+    """Threads are listed most recently updated first, a page at a time."""
+    headers = {"Cookie": "opengpts_user_id=1"}
+    aid = str(uuid4())
+    tids = [str(uuid4()) for _ in range(3)]
+
+    async with get_client() as client:
+        await client.put(
+            f"/assistants/{aid}",
+            json={"name": "assistant", "config": {}, "public": False},
+            headers=headers,
+        )
+        for i, tid in enumerate(tids):
+            await client.put(
+                f"/threads/{tid}",
+                json={"name": f"thread {i}", "assistant_id": aid},
+                headers=headers,
+            )
+
+        response = await client.get("/threads/page?limit=2", headers=headers)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert [t["thread_id"] for t in page["items"]] == [tids[2], tids[1]]
+        assert "user_id" not in page["items"][0]
+
+        response = await client.get(
+            "/threads/page",
+            params={"limit": 2, "cursor": page["next_cursor"]},
+            headers=headers,
+        )
+        page = response.json()
+        assert [t["thread_id"] for t in page["items"]] == [tids[0]]
+        assert page["next_cursor"] is None
+
+        response = await client.get(
+            "/threads/page", params={"cursor": "nope"}, headers=headers
+        )
+        assert response.status_code == 400
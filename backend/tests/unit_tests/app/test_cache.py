@@ -0,0 +1,68 @@
+"""Test the in-process caches."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.cache import LRUCache, cached
+from app.metrics import counter
+
+
+def test_lru_cache() -> None:
+    """Least recently used values are evicted to stay within maxsize."""
+    cache = LRUCache("test", maxsize=10)
+    hits = counter("cache_hits", "").value(cache="test")
+    evictions = counter("cache_evictions", "").value(cache="test")
+
+    cache.put("a", 1, size=4)
+    cache.put("b", 2, size=4)
+    assert cache.get("a") == 1
+    cache.put("c", 3, size=4)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.size == 8
+
+    cache.put("d", 4, size=11)
+    assert "d" not in cache
+    assert cache.pop("a") == 1
+    assert cache.size == 4
+
+    assert counter("cache_hits", "").value(cache="test") == hits + 3
+    assert counter("cache_evictions", "").value(cache="test") == evictions + 1
+
+
+def test_cached() -> None:
+    """Values are computed once per arguments, even by concurrent calls."""
+    calls = []
+
+    @cached("test_cached", maxsize=2, ttl=0.2)
+    def build(key: str) -> str:
+        calls.append(key)
+        time.sleep(0.05)
+        return key.upper()
+
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(build, ["a"] * 4)) == ["A"] * 4
+    assert calls == ["a"]
+    assert build("b") == "B"
+    assert calls == ["a", "b"]
+
+    time.sleep(0.2)
+    assert build("a") == "A"
+    assert calls == ["a", "b", "a"]
+
+
+def test_get_or_compute() -> None:
+    """Concurrent misses of a key compute its value once."""
+    cache: LRUCache[str] = LRUCache("test_get_or_compute", maxsize=2)
+    calls = []
+
+    def compute() -> str:
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: cache.get_or_compute("a", compute), range(4)))
+    assert results == ["value"] * 4
+    assert calls == [1]
@@ -0,0 +1,224 @@
+"""Test the Postgres checkpoint saver."""
+
+import asyncio
+import pickle
+
+import asyncpg
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from app import checkpoint as checkpoint_module
+from app import lifespan
+from app.checkpoint import PostgresCheckpoint, _apply_delta, _diff_checkpoint
+from app.codec import CompactCodec, is_compact
+
+
+def _step(checkpoint, i: int):
+    """Simulate a graph step that appends a message to the root channel."""
+    values = checkpoint["channel_values"]
+    message = (HumanMessage if i % 2 == 0 else AIMessage)(content=f"message {i}")
+    values["__root__"] = values.get("__root__", []) + [message]
+    values["agent"] = message
+    checkpoint["channel_versions"]["__root__"] += 1
+    checkpoint["versions_seen"]["agent"]["__root__"] += 1
+    return checkpoint
+
+
+def test_diff_and_apply_delta() -> None:
+    """Deltas only carry the appended tail and rebuild the same checkpoint."""
+    checkpoint = _step(_step(empty_checkpoint(), 0), 1)
+    prev_values = dict(checkpoint["channel_values"])
+    checkpoint = _step(checkpoint, 2)
+
+    delta = _diff_checkpoint(prev_values, checkpoint)
+    assert delta["extend"] == {"__root__": [HumanMessage(content="message 2")]}
+    assert delta["set"] == {"agent": HumanMessage(content="message 2")}
+
+    rebuilt = _step(_step(empty_checkpoint(), 0), 1)
+    _apply_delta(rebuilt, delta)
+    assert rebuilt["channel_values"] == checkpoint["channel_values"]
+    assert rebuilt["channel_versions"] == checkpoint["channel_versions"]
+    assert rebuilt["versions_seen"] == checkpoint["versions_seen"]
+
+
+async def test_delta_storage(pool: asyncpg.pool.Pool) -> None:
+    """Test that delta storage round trips and snapshots periodically."""
+    saver = PostgresCheckpoint(delta_storage=True, snapshot_every=3)
+    config = {"configurable": {"thread_id": "1"}}
+    checkpoint = empty_checkpoint()
+
+    for i in range(6):
+        await saver.aput(config, _step(checkpoint, i))
+        read = await PostgresCheckpoint(delta_storage=True).aget(config)
+        assert read["channel_values"] == checkpoint["channel_values"]
+        assert read["channel_versions"] == checkpoint["channel_versions"]
+
+    async with pool.acquire() as conn:
+        # One snapshot, three deltas, then a new snapshot and one delta.
+        assert await conn.fetchval("SELECT step FROM checkpoints") == 4
+        assert await conn.fetchval("SELECT COUNT(*) FROM checkpoint_delta") == 1
+
+    assert await saver.compact() == 1
+    async with pool.acquire() as conn:
+        assert await conn.fetchval("SELECT step FROM checkpoints") == 5
+        assert await conn.fetchval("SELECT COUNT(*) FROM checkpoint_delta") == 0
+
+    read = await saver.aget(config)
+    assert (
+        read["channel_values"]["__root__"] == checkpoint["channel_values"]["__root__"]
+    )
+
+
+async def test_delta_storage_concurrent_writer(pool: asyncpg.pool.Pool) -> None:
+    """A writer with a stale view of the thread falls back to a snapshot."""
+    config = {"configurable": {"thread_id": "1"}}
+    first = PostgresCheckpoint(delta_storage=True)
+    second = PostgresCheckpoint(delta_storage=True)
+
+    checkpoint = _step(empty_checkpoint(), 0)
+    await first.aput(config, checkpoint)
+    await second.aget(config)
+    await first.aput(config, _step(checkpoint, 1))
+    await second.aput(config, _step(checkpoint, 2))
+
+    read = await first.aget(config)
+    assert read["channel_values"] == checkpoint["channel_values"]
+
+
+async def test_delta_after_concurrent_snapshot(pool: asyncpg.pool.Pool) -> None:
+    """A delta isn't written under a snapshot another writer wrote meanwhile."""
+    config = {"configurable": {"thread_id": "1"}}
+    first = PostgresCheckpoint(delta_storage=True)
+    second = PostgresCheckpoint(delta_storage=True, snapshot_every=1)
+
+    checkpoint = _step(empty_checkpoint(), 0)
+    await first.aput(config, checkpoint)
+    await first.aput(config, _step(checkpoint, 1))
+    # Takes the next step as a snapshot, dropping the deltas up to it.
+    other = await second.aget(config)
+    await second.aput(config, _step(other, 2))
+
+    await first.aput(config, _step(checkpoint, 3))
+    read = await PostgresCheckpoint(delta_storage=True).aget(config)
+    assert read["channel_values"] == checkpoint["channel_values"]
+    await first.aput(config, _step(checkpoint, 4))
+    read = await PostgresCheckpoint(delta_storage=True).aget(config)
+    assert read["channel_values"] == checkpoint["channel_values"]
+
+
+async def test_legacy_pickle_backfill(pool: asyncpg.pool.Pool) -> None:
+    """Pickled rows are still readable and get rewritten on first read."""
+    checkpoint = _step(empty_checkpoint(), 0)
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO checkpoints (thread_id, checkpoint) VALUES ($1, $2)",
+            "1",
+            pickle.dumps(checkpoint),
+        )
+
+    saver = PostgresCheckpoint(codec=CompactCodec())
+    read = await saver.aget({"configurable": {"thread_id": "1"}})
+    assert read["channel_values"] == checkpoint["channel_values"]
+    async with pool.acquire() as conn:
+        assert is_compact(await conn.fetchval("SELECT checkpoint FROM checkpoints"))
+
+
+async def test_checkpoint_cache(pool: asyncpg.pool.Pool) -> None:
+    """Writes go through the cache and notifications evict stale copies."""
+    config = {"configurable": {"thread_id": "1"}}
+    saver = PostgresCheckpoint(cache_bytes=1024 * 1024)
+    checkpoint = _step(empty_checkpoint(), 0)
+    await saver.aput(config, checkpoint)
+
+    # Served from memory, and a copy so callers can't change the cached one.
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM checkpoints")
+    read = await saver.aget(config)
+    assert read["channel_values"] == checkpoint["channel_values"]
+    read["channel_versions"]["__root__"] += 1
+    assert (await saver.aget(config))["channel_versions"]["__root__"] == 1
+
+    checkpoint_module._on_notify("1:0")
+    assert await saver.aget(config) is not None
+    checkpoint_module._on_notify("1:1")
+    assert await saver.aget(config) is None
+
+
+async def test_messages_pages(pool: asyncpg.pool.Pool) -> None:
+    """Messages are stored one per row and read back newest first."""
+    config = {"configurable": {"thread_id": "1"}}
+    saver = PostgresCheckpoint()
+    checkpoint = empty_checkpoint()
+    for i in range(5):
+        await saver.aput(config, _step(checkpoint, i))
+
+    page = await saver.aget_messages(config, limit=2)
+    assert [m.content for m in page.messages] == ["message 3", "message 4"]
+    assert page.start == 3
+    assert page.versions["channel_versions"] == {"__root__": 5}
+    page = await saver.aget_messages(config, limit=5, before=page.start)
+    assert [m.content for m in page.messages] == [f"message {i}" for i in range(3)]
+    assert page.start == 0
+
+    # Threads written before messages had their own rows are indexed on read.
+    async with pool.acquire() as conn:
+        await conn.execute("TRUNCATE thread_message, checkpoint_versions")
+    page = await PostgresCheckpoint().aget_messages(config, limit=2, before=4)
+    assert [m.content for m in page.messages] == ["message 2", "message 3"]
+    async with pool.acquire() as conn:
+        assert await conn.fetchval("SELECT COUNT(*) FROM thread_message") == 5
+
+
+async def test_messages_written_with_checkpoint(
+    pool: asyncpg.pool.Pool, monkeypatch
+) -> None:
+    """The checkpoint isn't written if its messages can't be, and vice versa."""
+    config = {"configurable": {"thread_id": "1"}}
+    saver = PostgresCheckpoint(delta_storage=True, cache_bytes=1024 * 1024)
+    checkpoint = _step(empty_checkpoint(), 0)
+    await saver.aput(config, checkpoint)
+
+    async def fail(*args) -> None:
+        raise ValueError()
+
+    with monkeypatch.context() as m:
+        m.setattr(PostgresCheckpoint, "_index_messages", fail)
+        with pytest.raises(ValueError):
+            await saver.aput(config, _step(checkpoint, 1))
+    async with pool.acquire() as conn:
+        assert await conn.fetchval("SELECT COUNT(*) FROM checkpoint_delta") == 0
+        assert await conn.fetchval("SELECT COUNT(*) FROM thread_message") == 1
+
+    # Nothing remembered of the failed write is used for the next one.
+    await saver.aput(config, checkpoint)
+    read = await PostgresCheckpoint(delta_storage=True).aget(config)
+    assert read["channel_values"] == checkpoint["channel_values"]
+    page = await saver.aget_messages(config, limit=5)
+    assert [m.content for m in page.messages] == ["message 0", "message 1"]
+
+
+async def test_checkpoint_cache_reconnect(pool: asyncpg.pool.Pool, monkeypatch) -> None:
+    """The cache isn't used while notifications can't be heard, and is cleared
+    once they can again."""
+    config = {"configurable": {"thread_id": "1"}}
+    saver = PostgresCheckpoint(cache_bytes=1024 * 1024)
+    await saver.aput(config, _step(empty_checkpoint(), 0))
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM checkpoints")
+
+    with monkeypatch.context() as m:
+        m.setattr(checkpoint_module, "listening", lambda: False)
+        assert await saver.aget(config) is None
+    assert await saver.aget(config) is not None
+
+    lost = lifespan._listen_conn
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_terminate_backend($1)", lost.get_server_pid())
+    for _ in range(100):
+        if lifespan._listen_conn not in (None, lost) and lifespan.listening():
+            break
+        await asyncio.sleep(0.05)
+    assert lifespan._listen_conn not in (None, lost)
+    assert lifespan.listening()
+    assert await saver.aget(config) is None
@@ -0,0 +1,111 @@
+"""Test the checkpoint codecs."""
+
+import pickle
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from enum import Enum
+from uuid import UUID
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    HumanMessage,
+)
+
+from app.codec import CompactCodec, PickleCodec, decode, get_codec, is_compact
+from app.message_types import LiberalFunctionMessage, LiberalToolMessage
+
+VALUE = {
+    "__root__": [
+        HumanMessage(content="what is the weather in sf?"),
+        AIMessage(
+            content="",
+            additional_kwargs={
+                "tool_calls": [
+                    {
+                        "id": "call_1",
+                        "type": "function",
+                        "function": {"name": "search", "arguments": "{}"},
+                    }
+                ]
+            },
+        ),
+        LiberalToolMessage(tool_call_id="call_1", content={"temperature": 64}),
+        LiberalFunctionMessage(
+            name="retrieval", content=[Document(page_content="64 degrees")]
+        ),
+        AIMessageChunk(content="It is 64 degrees"),
+    ],
+    "is_last_step": False,
+    "other": {"a set": {1, 2}},
+}
+
+
+def test_compact_round_trip() -> None:
+    """Values survive a round trip, including ones that need the pickle fallback."""
+    data = CompactCodec().encode(VALUE)
+    assert is_compact(data)
+    assert decode(data) == VALUE
+    assert [type(m) for m in decode(data)["__root__"]] == [
+        type(m) for m in VALUE["__root__"]
+    ]
+
+
+class Color(Enum):
+    RED = "red"
+
+
+@dataclass
+class Point:
+    x: int
+    y: int
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        (1, "a", (2, 3)),
+        Point(1, 2),
+        datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        date(2024, 1, 2),
+        UUID("12345678-1234-5678-1234-567812345678"),
+        Color.RED,
+        {1: "a", "b": 2},
+        AIMessage(content="", additional_kwargs={"at": (1, 2)}),
+    ],
+)
+def test_compact_round_trip_types(value) -> None:
+    """Values orjson would write as another type come back as they were."""
+    decoded = decode(CompactCodec().encode({"value": [value, value]}))["value"]
+    assert decoded == [value, value]
+    assert type(decoded[0]) is type(value)
+    if isinstance(value, AIMessage):
+        assert type(decoded[0].additional_kwargs["at"]) is tuple
+
+
+def test_default_codec(monkeypatch) -> None:
+    monkeypatch.delenv("CHECKPOINT_CODEC", raising=False)
+    assert isinstance(get_codec(), PickleCodec)
+    monkeypatch.setenv("CHECKPOINT_CODEC", "compact")
+    assert isinstance(get_codec(), CompactCodec)
+
+
+def test_compact_is_smaller_than_pickle() -> None:
+    assert len(CompactCodec().encode(VALUE)) < len(pickle.dumps(VALUE))
+
+
+def test_decode_legacy_pickle() -> None:
+    data = pickle.dumps(VALUE)
+    assert not is_compact(data)
+    assert decode(data) == VALUE
+
+
+def test_compression() -> None:
+    pytest.importorskip("zstandard")
+    codec = CompactCodec(compress_threshold=100)
+    value = {"__root__": [HumanMessage(content="hello " * 1000)]}
+    data = codec.encode(value)
+    assert len(data) < 1000
+    assert decode(data) == value
@@ -0,0 +1,85 @@
+"""Test summarizing the earlier messages of long threads."""
+import asyncio
+from uuid import uuid4
+
+import asyncpg
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from app import compaction, context_window, run_manager
+from app.context_window import fit_prompt
+from app.storage import post_thread_messages
+
+prompts = []
+
+
+def _llm(prompt):
+    prompts.append(prompt.to_string())
+    return AIMessage(content=f"summary {len(prompts)}")
+
+
+@pytest.fixture(autouse=True)
+def _enable(monkeypatch) -> None:
+    monkeypatch.setattr(context_window, "_encoding", lambda: None)
+    monkeypatch.setattr(context_window, "THREAD_SUMMARY_TOKENS", 60)
+    monkeypatch.setattr(compaction, "THREAD_SUMMARY_TOKENS", 60)
+    monkeypatch.setattr(compaction, "THREAD_SUMMARY_KEEP_TOKENS", 30)
+    monkeypatch.setattr(compaction, "get_summary_llm", lambda: RunnableLambda(_llm))
+    prompts.clear()
+
+
+def _turn(i: int) -> list:
+    # 14 tokens each.
+    return [HumanMessage(content=f"{i}" * 40), AIMessage(content="a" * 40)]
+
+
+async def _run(thread_id: str) -> None:
+    """Run on the thread, and wait for it to be summarized."""
+    run = await run_manager.start("1", thread_id, None, lambda: asyncio.sleep(0))
+    while (task := run_manager._tasks.get(run["run_id"])) is not None:
+        await asyncio.wait({task})
+    if (task := compaction._tasks.get(thread_id)) is not None:
+        await task
+
+
+async def test_compaction(pool: asyncpg.pool.Pool) -> None:
+    """Summaries cover all but the latest messages, once they take too many tokens."""
+    thread_id = str(uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    messages = _turn(1) + _turn(2)
+    await post_thread_messages("1", thread_id, messages)
+    await _run(thread_id)
+    assert prompts == []
+
+    messages += _turn(3) + _turn(4) + _turn(5)
+    await post_thread_messages("1", thread_id, messages[4:])
+    await _run(thread_id)
+    assert len(prompts) == 1
+    assert "Human: " + "1" * 40 in prompts[0]
+    assert "4" * 40 in prompts[0]
+    assert "5" * 40 not in prompts[0]
+    system, sent = await fit_prompt("Be nice.", messages, config, None)
+    assert system.content.startswith("Be nice.")
+    assert system.content.endswith("summary 1")
+    assert sent == messages[8:]
+
+    # The summary so far is extended with the messages since.
+    messages += _turn(6) + _turn(7)
+    await post_thread_messages("1", thread_id, messages[10:])
+    await _run(thread_id)
+    assert len(prompts) == 2
+    assert "summary 1" in prompts[1]
+    assert "5" * 40 in prompts[1]
+    assert "4" * 40 not in prompts[1]
+    system, sent = await fit_prompt("Be nice.", messages, config, None)
+    assert system.content.endswith("summary 2")
+    assert sent == messages[12:]
+
+
+async def test_off(pool: asyncpg.pool.Pool, monkeypatch) -> None:
+    monkeypatch.setattr(compaction, "THREAD_SUMMARY_TOKENS", None)
+    thread_id = str(uuid4())
+    await post_thread_messages("1", thread_id, sum((_turn(i) for i in range(9)), []))
+    await _run(thread_id)
+    assert prompts == []
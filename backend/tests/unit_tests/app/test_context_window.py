@@ -0,0 +1,91 @@
+"""Test fitting conversations into a budget of tokens."""
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+
+from app import context_window
+from app.chatbot import get_chatbot_executor
+from app.context_window import MESSAGE_TOKENS, count_tokens, fit_messages
+from app.message_types import LiberalToolMessage
+
+
+@pytest.fixture(autouse=True)
+def _estimate(monkeypatch) -> None:
+    # Four characters a token, and no download of the encoding.
+    monkeypatch.setattr(context_window, "_encoding", lambda: None)
+    context_window._counts.clear()
+
+
+def _call(id: str) -> AIMessage:
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_calls": [
+                {"id": id, "function": {"name": "search", "arguments": "{}"}}
+            ]
+        },
+    )
+
+
+def _thread() -> list:
+    return [
+        HumanMessage(content="a" * 40),
+        AIMessage(content="b" * 40),
+        HumanMessage(content="c" * 40),
+        _call("1"),
+        LiberalToolMessage(tool_call_id="1", content=["d" * 400]),
+        AIMessage(content="e" * 40),
+        HumanMessage(content="f" * 40),
+        AIMessage(content="g" * 40),
+    ]
+
+
+def test_count_tokens() -> None:
+    assert count_tokens(HumanMessage(content="a" * 40)) == MESSAGE_TOKENS + 10
+    assert count_tokens(_call("1")) > MESSAGE_TOKENS
+    assert count_tokens(ToolMessage(tool_call_id="1", content="")) == MESSAGE_TOKENS
+
+
+def test_fit_messages() -> None:
+    """The latest messages that fit are kept, from a message of the user."""
+    messages = _thread()
+    assert fit_messages(messages, None) == messages
+    assert fit_messages(messages, 10_000) == messages
+    # The tool call and its result don't fit, so neither is kept.
+    assert fit_messages(messages, 100) == messages[6:]
+    assert fit_messages(messages, 200) == messages[2:]
+
+
+def test_fit_latest_turn() -> None:
+    """The latest message is kept if it doesn't fit, with the question it answers."""
+    messages = _thread()[:5]
+    assert fit_messages(messages, 10) == [messages[2], *messages[3:]]
+    assert fit_messages(messages[3:], 10) == messages[3:]
+
+
+def test_count_cache(monkeypatch) -> None:
+    """Texts are counted once."""
+    count_tokens(HumanMessage(content="x" * 100))
+    monkeypatch.setattr(context_window, "_encoding", None)
+    assert count_tokens(HumanMessage(content="x" * 100)) == MESSAGE_TOKENS + 25
+
+
+def test_count_kept_with_message(monkeypatch) -> None:
+    """Messages with content that isn't text are counted once."""
+    message = LiberalToolMessage(tool_call_id="1", content=["d" * 400])
+    tokens = count_tokens(message)
+    monkeypatch.setattr(context_window, "_count_text", None)
+    assert count_tokens(message) == tokens
+
+
+async def test_executor() -> None:
+    """Executors send the LLM the system message and the messages that fit."""
+    prompts = []
+
+    def llm(messages):
+        prompts.append(messages)
+        return AIMessage(content="h" * 40)
+
+    executor = get_chatbot_executor(RunnableLambda(llm), "i" * 40, None, 50)
+    await executor.ainvoke(_thread()[:-1])
+    assert [m.content[0] for m in prompts[0]] == ["i", "f"]
@@ -0,0 +1,30 @@
+"""Test the HTTP clients shared by LLMs."""
+from app import http_clients
+from app.http_clients import close_connections, get_http_client
+from app.llms import _with_http_client, get_openai_llm
+
+
+def test_llms_share_clients() -> None:
+    client = get_http_client("openai")
+    assert get_http_client("openai") is client
+    assert get_http_client("anthropic") is not client
+    for llm in (get_openai_llm(), get_openai_llm(gpt_4=True)):
+        assert llm.async_client._client._client is client
+
+
+async def test_close_connections() -> None:
+    client = get_http_client("openai")
+    await close_connections()
+    # Clients of cached LLMs stay usable after the app shut down.
+    assert not client.is_closed
+    assert http_clients._connections.value(provider="openai", state="idle") == 0
+
+
+def test_private_attributes_missing(monkeypatch) -> None:
+    """Clients still work if a newer library hides what they are shared with."""
+    client = get_http_client("openai")
+    completions = object()
+    assert _with_http_client(completions, client) is completions
+
+    monkeypatch.setitem(http_clients._transports, "other", object())
+    http_clients._update_connections("other")
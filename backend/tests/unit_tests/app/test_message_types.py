@@ -0,0 +1,52 @@
+"""Test the messages with content of any type."""
+import pickle
+
+from langchain_core.documents import Document
+from langchain_core.messages import FunctionMessage, ToolMessage
+
+from app.codec import CompactCodec, PickleCodec, decode
+from app.message_types import LiberalFunctionMessage, LiberalToolMessage
+
+
+def _messages() -> list:
+    return [
+        LiberalToolMessage(
+            tool_call_id="call_1",
+            content={"temperature": 64},
+            additional_kwargs={"name": "weather"},
+        ),
+        LiberalFunctionMessage(
+            name="retrieval", content=[Document(page_content="64 degrees")]
+        ),
+    ]
+
+
+def test_converted_once() -> None:
+    """Messages convert for the LLM once."""
+    tool_message, function_message = _messages()
+    converted = tool_message.to_message()
+    assert type(converted) is ToolMessage
+    assert converted.content == "{'temperature': 64}"
+    assert tool_message.to_message() is converted
+    converted = function_message.to_message()
+    assert type(converted) is FunctionMessage
+    assert converted.content == (
+        "[{'page_content': '64 degrees', 'metadata': {}, 'type': 'Document'}]"
+    )
+
+
+def test_conversion_not_stored() -> None:
+    """The conversion isn't pickled or encoded with the message."""
+    messages = _messages()
+    for message in messages:
+        message.to_message()
+    assert pickle.dumps(messages) == pickle.dumps(_messages())
+    for codec in (PickleCodec(), CompactCodec()):
+        assert codec.encode(messages) == codec.encode(_messages())
+
+    restored = pickle.loads(pickle.dumps(messages))
+    assert restored == messages
+    assert restored[0].to_message() == messages[0].to_message()
+    assert decode(CompactCodec().encode(messages))[1].to_message() == (
+        messages[1].to_message()
+    )
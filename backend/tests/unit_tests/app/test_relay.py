@@ -0,0 +1,83 @@
+"""Test the relay of streamed runs between processes."""
+import asyncio
+from uuid import uuid4
+
+import asyncpg
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from app import relay, run_manager
+from app.storage import delete_expired_run_events, get_run_events
+from tests.unit_tests.app.test_app import get_client
+
+
+async def _messages(fail: bool = False):
+    messages = [HumanMessage(content="hi")]
+    yield "run-id"
+    yield messages
+    for token in ["a", "b", "c"]:
+        await asyncio.sleep(0.02)
+        if messages[-1].type == "human":
+            messages.append(AIMessageChunk(content=token))
+        else:
+            messages[-1] = messages[-1] + AIMessageChunk(content=token)
+        yield messages
+    if fail:
+        raise ValueError()
+
+
+async def test_relay(pool: asyncpg.pool.Pool, monkeypatch) -> None:
+    """Mirrors of a run get the same chunks, with the same IDs, as its buffer."""
+    monkeypatch.setattr(relay, "STREAM_BUFFER_TTL", 0.05)
+    run, buffer = await run_manager.start_stream("1", str(uuid4()), None, _messages())
+    # Like the handler of another process, which follows the run once started.
+    await asyncio.sleep(0.03)
+    mirror = relay.follow("1", run["run_id"])
+    assert relay.follow("1", run["run_id"]) is mirror
+
+    chunks = [entry async for entry in mirror.follow()]
+    assert chunks == [entry async for entry in buffer.follow()]
+    assert [m.content for m in chunks[-1][1]] == ["hi", "abc"]
+    # Unchanged messages are only sent once.
+    assert chunks[-1][1][0] is chunks[1][1][0]
+
+    await asyncio.sleep(0.1)
+    assert run["run_id"] not in relay._mirrors
+    # Events are deleted by age, whichever process wrote them.
+    assert await delete_expired_run_events(60) == 0
+    assert await delete_expired_run_events(0) == len(chunks) + 1
+    assert await get_run_events(run["run_id"], 0) == []
+
+
+async def test_relay_failed(pool: asyncpg.pool.Pool) -> None:
+    """Mirrors of a failed run end with an error."""
+    run, _ = await run_manager.start_stream(
+        "1", str(uuid4()), None, _messages(fail=True)
+    )
+    mirror = relay.follow("1", run["run_id"])
+    with pytest.raises(relay.RunFailed):
+        async for _ in mirror.follow():
+            pass
+
+
+async def test_stream_thread_api(pool: asyncpg.pool.Pool) -> None:
+    """Any number of clients can follow the run going on in a thread."""
+    thread_id = str(uuid4())
+    headers = {"Cookie": "opengpts_user_id=1"}
+
+    async with get_client() as client:
+        response = await client.get(f"/threads/{thread_id}/stream", headers=headers)
+        assert response.status_code == 404
+
+        run, _ = await run_manager.start_stream("1", thread_id, None, _messages())
+        responses = await asyncio.gather(
+            *(
+                client.get(f"/threads/{thread_id}/stream", headers=headers)
+                for _ in range(3)
+            )
+        )
+        for response in responses:
+            assert response.status_code == 200
+            assert response.headers["X-Run-Id"] == str(run["run_id"])
+            assert response.text == responses[0].text
+            assert '"content":"abc"' in response.text
@@ -0,0 +1,90 @@
+"""Test the retrieval executor."""
+import asyncio
+from typing import Optional
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompt_values import StringPromptValue
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+
+from app.metrics import counter
+from app.retrieval import get_retrieval_executor
+
+
+class _Retriever(BaseRetriever):
+    queries: list = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        raise NotImplementedError
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager
+    ) -> list[Document]:
+        self.queries.append(query)
+        await asyncio.sleep(0.05)
+        return [Document(page_content=query)]
+
+
+class _Embeddings(Embeddings):
+    """Embeds texts starting with "cat" and "dog" far apart."""
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return [1.0, 0.1] if text.lower().startswith("cat") else [0.1, 1.0]
+
+
+def _executor(search_query: str, embeddings: Optional[Embeddings] = None):
+    async def llm(prompt):
+        await asyncio.sleep(0.05)
+        if isinstance(prompt, StringPromptValue):
+            return AIMessage(content=search_query)
+        return AIMessage(content="answer")
+
+    retriever = _Retriever()
+    executor = get_retrieval_executor(
+        RunnableLambda(llm), retriever, "", None, True, embeddings
+    )
+    return executor, retriever
+
+
+@pytest.mark.parametrize(
+    "search_query,embeddings,outcome,queries",
+    [
+        ("Cats?", None, "same", ["cats"]),
+        ("cat food", None, "different", ["cats", "cat food"]),
+        ("cat food", _Embeddings(), "similar", ["cats"]),
+        ("dog food", _Embeddings(), "different", ["cats", "dog food"]),
+    ],
+)
+async def test_speculative_retrieval(search_query, embeddings, outcome, queries):
+    """Documents retrieved with the message are used if the query is close."""
+    speculations = counter("retrieval_speculations", "")
+    before = speculations.value(outcome=outcome)
+    executor, retriever = _executor(search_query, embeddings)
+    messages = [
+        HumanMessage(content="hi"),
+        AIMessage(content="hello"),
+        HumanMessage(content="cats"),
+    ]
+
+    output = await executor.ainvoke(messages)
+    call, documents, answer = output[3:]
+    assert call.additional_kwargs["function_call"]["arguments"] == (
+        f'{{"query": "{search_query}"}}'
+    )
+    assert documents.content == [Document(page_content=queries[-1])]
+    assert answer.content == "answer"
+    assert retriever.queries == queries
+    assert speculations.value(outcome=outcome) == before + 1
+
+
+async def test_first_message() -> None:
+    executor, retriever = _executor("unused")
+    output = await executor.ainvoke([HumanMessage(content="cats")])
+    assert [m.type for m in output] == ["human", "ai", "function", "ai"]
+    assert retriever.queries == ["cats"]
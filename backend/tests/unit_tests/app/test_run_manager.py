@@ -0,0 +1,160 @@
+"""Test the run registry."""
+import asyncio
+from uuid import uuid4
+
+import asyncpg
+from langchain_core.messages import HumanMessage
+
+from app import run_manager, storage
+from app.storage import get_run
+from tests.unit_tests.app.test_app import get_client
+
+
+async def _wait_for(run_id, *statuses: str) -> dict:
+    for _ in range(100):
+        run = await get_run("1", run_id)
+        if run["status"] in statuses:
+            return run
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Run is still {run['status']}")
+
+
+async def test_runs(pool: asyncpg.pool.Pool) -> None:
+    """Runs record their status and timings."""
+    thread_id = str(uuid4())
+
+    async def succeed():
+        await asyncio.sleep(0.01)
+
+    run = await run_manager.start("1", thread_id, None, succeed)
+    assert run["status"] == "queued"
+    run = await _wait_for(run["run_id"], "succeeded")
+    assert run["created_at"] <= run["started_at"] <= run["ended_at"]
+
+    async def fail():
+        raise ValueError("secret")
+
+    run = await run_manager.start("1", thread_id, None, fail)
+    run = await _wait_for(run["run_id"], "failed")
+    assert run["error"] == "ValueError"
+
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(60)
+
+    run = await run_manager.start("1", thread_id, None, hang)
+    await started.wait()
+    assert (await get_run("1", run["run_id"]))["status"] == "running"
+    await run_manager.cancel(run["run_id"])
+    run = await get_run("1", run["run_id"])
+    assert run["status"] == "cancelled"
+    assert run["ended_at"] is not None
+    assert run["run_id"] not in run_manager._tasks
+
+
+async def test_stale_runs(pool: asyncpg.pool.Pool) -> None:
+    """Runs of a process that stopped heartbeating them are failed."""
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(60)
+
+    alive = await run_manager.start("1", str(uuid4()), None, hang)
+    await started.wait()
+    lost = await storage.put_run("1", thread_id=str(uuid4()), assistant_id=None)
+    await storage.update_run(lost["run_id"], "running", worker_id="gone")
+    async with pool.acquire() as conn:
+        await conn.execute("UPDATE run SET heartbeat_at = now() - interval '2 minutes'")
+
+    # This process heartbeats its own runs before failing the stale ones.
+    await run_manager._heartbeat()
+    run = await get_run("1", lost["run_id"])
+    assert run["status"] == "failed"
+    assert run["error"] == "ProcessLost"
+    run = await get_run("1", alive["run_id"])
+    assert run["status"] == "running"
+    assert run["worker_id"] == run_manager.PROCESS_ID
+    await run_manager.cancel(alive["run_id"])
+
+
+async def test_stream_runs(pool: asyncpg.pool.Pool, monkeypatch) -> None:
+    """Streamed runs go on without followers, and keep their buffer for a while
+    after they end."""
+    monkeypatch.setattr(run_manager, "STREAM_BUFFER_TTL", 0.05)
+
+    async def messages():
+        yield "run-id"
+        for _ in range(3):
+            await asyncio.sleep(0.01)
+            yield []
+
+    run, buffer = await run_manager.start_stream("1", str(uuid4()), None, messages())
+    follower = buffer.follow()
+    assert await follower.__anext__() == (1, "run-id")
+    await follower.aclose()
+    await _wait_for(run["run_id"], "succeeded")
+    buffer = run_manager.get_stream(run["run_id"])
+    assert [id async for id, _ in buffer.follow()] == [1, 2, 3, 4]
+    await asyncio.sleep(0.1)
+    assert run_manager.get_stream(run["run_id"]) is None
+
+
+async def test_runs_api(pool: asyncpg.pool.Pool) -> None:
+    """Runs can be read and cancelled by their user only."""
+    run = await run_manager.start("1", str(uuid4()), None, lambda: asyncio.sleep(60))
+
+    async with get_client() as client:
+        response = await client.get(
+            f"/runs/{run['run_id']}", headers={"Cookie": "opengpts_user_id=2"}
+        )
+        assert response.status_code == 404
+
+        headers = {"Cookie": "opengpts_user_id=1"}
+        response = await client.get(f"/runs/{run['run_id']}", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["status"] in ("queued", "running")
+
+        response = await client.post(f"/runs/{run['run_id']}/cancel", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["status"] == "cancelled"
+
+        response = await client.post(f"/runs/{run['run_id']}/cancel", headers=headers)
+        assert response.status_code == 409
+
+
+async def test_resume_stream_api(pool: asyncpg.pool.Pool) -> None:
+    """Streams resume after Last-Event-ID, or start from the thread's messages."""
+
+    async def messages():
+        yield "run-id"
+        for i in range(3):
+            yield [HumanMessage(content=str(i))]
+
+    run, _ = await run_manager.start_stream("1", str(uuid4()), None, messages())
+    await _wait_for(run["run_id"], "succeeded")
+    headers = {"Cookie": "opengpts_user_id=1"}
+
+    async with get_client() as client:
+        response = await client.get(
+            f"/runs/{run['run_id']}/stream",
+            headers={**headers, "Last-Event-ID": "2"},
+        )
+        assert response.status_code == 200
+        assert response.headers["X-Run-Id"] == str(run["run_id"])
+        assert "id: 2" not in response.text
+        assert "id: 3" in response.text
+        assert "id: 4" in response.text
+
+        run = await run_manager.start("1", str(uuid4()), None, lambda: asyncio.sleep(0))
+        await _wait_for(run["run_id"], "succeeded")
+        response = await client.get(f"/runs/{run['run_id']}/stream", headers=headers)
+        assert "event: data" in response.text
+        assert "id:" not in response.text
+
+        response = await client.get(
+            f"/runs/{run['run_id']}/stream", headers={"Cookie": "opengpts_user_id=2"}
+        )
+        assert response.status_code == 404
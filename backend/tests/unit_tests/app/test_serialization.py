@@ -0,0 +1,116 @@
+"""Test the fast message serializer against langserve's."""
+import random
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    ChatMessage,
+    ChatMessageChunk,
+    FunctionMessage,
+    FunctionMessageChunk,
+    HumanMessage,
+    HumanMessageChunk,
+    SystemMessage,
+    SystemMessageChunk,
+    ToolMessage,
+)
+from langserve.serialization import WellKnownLCSerializer
+
+from app.message_types import LiberalFunctionMessage, LiberalToolMessage
+from app.serialization import MessagesResponse, dumps, message_dicts
+from app.stream import map_chunk_to_msg
+
+_STRINGS = ["", "hi", "héllo wörld", "日本語", "emoji 🤖", 'quote " \\', "\n\t\x00\x1f"]
+
+
+def _value(rng: random.Random, depth: int = 0):
+    kinds = ["str", "int", "float", "bool", "none"]
+    if depth < 3:
+        kinds += ["list", "dict", "document"]
+    kind = rng.choice(kinds)
+    if kind == "str":
+        return rng.choice(_STRINGS) + str(rng.randint(0, 9))
+    if kind == "int":
+        return rng.randint(-(2**40), 2**40)
+    if kind == "float":
+        return rng.uniform(-1e6, 1e6)
+    if kind == "bool":
+        return rng.random() < 0.5
+    if kind == "none":
+        return None
+    if kind == "list":
+        return [_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    if kind == "document":
+        return Document(page_content=rng.choice(_STRINGS), metadata=_kwargs(rng, 2))
+    return _kwargs(rng, depth + 1)
+
+
+def _kwargs(rng: random.Random, depth: int = 0) -> dict:
+    return {
+        rng.choice(_STRINGS) + str(i): _value(rng, depth)
+        for i in range(rng.randint(0, 3))
+    }
+
+
+def _content(rng: random.Random):
+    if rng.random() < 0.8:
+        return rng.choice(_STRINGS)
+    return [
+        rng.choice([rng.choice(_STRINGS), {"type": "text", "text": "a"}])
+        for _ in range(rng.randint(0, 3))
+    ]
+
+
+def _message(rng: random.Random):
+    kwargs = {"content": _content(rng), "additional_kwargs": _kwargs(rng)}
+    if rng.random() < 0.2:
+        kwargs["extra"] = _value(rng)
+    make = rng.choice(
+        [
+            lambda: HumanMessage(**kwargs, example=rng.random() < 0.5),
+            lambda: HumanMessageChunk(**kwargs),
+            lambda: AIMessage(**kwargs),
+            lambda: AIMessageChunk(**kwargs, example=rng.random() < 0.5),
+            lambda: AIMessageChunk(**{**kwargs, "content": "a"})
+            + AIMessageChunk(content="b"),
+            lambda: SystemMessage(**kwargs),
+            lambda: FunctionMessage(**kwargs, name="search"),
+            lambda: FunctionMessageChunk(**kwargs, name="search"),
+            lambda: LiberalFunctionMessage(
+                **{**kwargs, "content": _value(rng)}, name="f"
+            ),
+            lambda: ToolMessage(**kwargs, tool_call_id="1"),
+            lambda: LiberalToolMessage(
+                **{**kwargs, "content": _value(rng)}, tool_call_id="1"
+            ),
+            lambda: ChatMessage(**kwargs, role="critic"),
+            lambda: ChatMessageChunk(**kwargs, role="critic"),
+        ]
+    )
+    return make()
+
+
+def test_same_bytes() -> None:
+    """Random messages serialize to the same bytes as with langserve."""
+    rng = random.Random(0)
+    serializer = WellKnownLCSerializer()
+    for _ in range(500):
+        messages = [_message(rng) for _ in range(rng.randint(0, 5))]
+        expected = serializer.dumps([map_chunk_to_msg(msg) for msg in messages])
+        assert dumps(message_dicts(messages)) == expected
+        assert dumps(messages) == serializer.dumps(messages)
+        assert dumps({"index": 1, "messages": message_dicts(messages)}) == (
+            serializer.dumps(
+                {"index": 1, "messages": [map_chunk_to_msg(m) for m in messages]}
+            )
+        )
+        assert MessagesResponse({"messages": messages}).body == dumps(
+            {"messages": messages}
+        )
+
+
+def test_unknown_chunk() -> None:
+    with pytest.raises(ValueError):
+        message_dicts([SystemMessageChunk(content="hi")])
@@ -0,0 +1,212 @@
+"""Test the SSE stream protocols."""
+import asyncio
+
+import orjson
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from app.stream import (
+    StreamBuffer,
+    _flush_latency,
+    _merged_chunks,
+    buffer_to_sse,
+    coalesce,
+    to_sse,
+)
+
+
+async def _stream():
+    """Yield message lists the way astream_messages does."""
+    messages = [HumanMessage(content="hi")]
+    yield "run-id"
+    yield messages
+    messages.append(AIMessageChunk(content="Hel"))
+    yield messages
+    for token in ["lo", " there"]:
+        messages[-1] = messages[-1] + AIMessageChunk(content=token)
+        yield messages
+    messages[-1] = messages[-1] + AIMessageChunk(
+        content="", additional_kwargs={"function_call": {"name": "search"}}
+    )
+    yield messages
+    yield list(messages)
+
+
+def _apply(messages: list, event: dict) -> list:
+    data = orjson.loads(event["data"])
+    if event["event"] == "data":
+        return data
+    if event["event"] == "messages":
+        return messages[: data["index"]] + data["messages"]
+    message = dict(messages[data["index"]])
+    message["content"] += data["content"]
+    return messages[: data["index"]] + [message] + messages[data["index"] + 1 :]
+
+
+async def test_delta_protocol() -> None:
+    """Applying delta events gives the same messages as snapshots."""
+    snapshots = [e async for e in to_sse(_stream())]
+    deltas = [e async for e in to_sse(_stream(), "delta")]
+
+    assert [e["event"] for e in deltas] == [
+        "metadata",
+        "data",
+        "messages",
+        "delta",
+        "delta",
+        "messages",
+        "end",
+    ]
+    messages = None
+    for event in deltas[1:-1]:
+        messages = _apply(messages, event)
+        if event["event"] == "delta":
+            assert orjson.loads(event["data"])["content"] in ["lo", " there"]
+    assert messages == orjson.loads(snapshots[-2]["data"])
+
+
+async def _paced(stream):
+    """Let the consumer run between updates, like tokens arriving from an LLM."""
+    async for chunk in stream:
+        yield chunk
+        await asyncio.sleep(0)
+
+
+async def test_coalesce() -> None:
+    """Token updates are batched, new messages and the last update are not."""
+    expected = [e async for e in to_sse(_stream(), "delta")]
+
+    chunks = [
+        c async for c in coalesce(_paced(_stream()), interval_ms=1000, max_tokens=0)
+    ]
+    assert [len(c) if isinstance(c, list) else c for c in chunks] == [
+        "run-id",
+        1,
+        2,
+        2,
+    ]
+    assert chunks[-1][-1].content == "Hello there"
+    assert chunks[-1][-1].additional_kwargs == {"function_call": {"name": "search"}}
+
+    flushes = _flush_latency.count()
+    chunks = [
+        c async for c in coalesce(_paced(_stream()), interval_ms=1000, max_tokens=2)
+    ]
+    assert [len(c) if isinstance(c, list) else c for c in chunks] == [
+        "run-id",
+        1,
+        2,
+        2,
+        2,
+    ]
+    assert chunks[-2][-1].content == "Hello there"
+    assert _flush_latency.count() == flushes + 4
+
+    events = [e async for e in to_sse(coalesce(_paced(_stream()), 1000, 0), "delta")]
+    messages = None
+    for event in events[1:-1]:
+        messages = _apply(messages, event)
+    final = None
+    for event in expected[1:-1]:
+        final = _apply(final, event)
+    assert messages == final
+
+
+async def test_coalesce_interval() -> None:
+    """Updates are flushed when the interval ends, even without new tokens."""
+
+    async def slow():
+        messages = [AIMessageChunk(content="a")]
+        yield messages
+        messages[-1] = messages[-1] + AIMessageChunk(content="b")
+        yield messages
+        await asyncio.sleep(0.1)
+        messages[-1] = messages[-1] + AIMessageChunk(content="c")
+        yield messages
+
+    stream = coalesce(_paced(slow()), interval_ms=10, max_tokens=0)
+    assert [m.content for m in await stream.__anext__()] == ["a"]
+    assert [m.content for m in await stream.__anext__()] == ["ab"]
+    assert [m.content for m in await stream.__anext__()] == ["abc"]
+    await stream.aclose()
+
+
+async def _buffered(maxlen: int = 100) -> StreamBuffer:
+    buffer = StreamBuffer(maxlen)
+    async for chunk in _stream():
+        buffer.append(list(chunk) if isinstance(chunk, list) else chunk)
+    buffer.close()
+    return buffer
+
+
+async def test_stream_buffer() -> None:
+    """Followers get the chunks after the one they ask for, as they are added."""
+    buffer = StreamBuffer()
+    follower = buffer.follow()
+    buffer.append("run-id")
+    assert await follower.__anext__() == (1, "run-id")
+    waiting = asyncio.create_task(follower.__anext__())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    buffer.append([])
+    assert await waiting == (2, [])
+    buffer.close(ValueError())
+    with pytest.raises(ValueError):
+        await follower.__anext__()
+
+    buffer = await _buffered()
+    assert [id async for id, _ in buffer.follow(5)] == [6, 7]
+
+
+async def test_stream_buffer_evicted() -> None:
+    """Followers that fell behind the buffer get the metadata and latest messages."""
+    buffer = await _buffered(maxlen=2)
+    assert [id async for id, _ in buffer.follow()] == [1, 7]
+    assert [id async for id, _ in buffer.follow(2)] == [7]
+    assert [id async for id, _ in buffer.follow(6)] == [7]
+    assert buffer.state_at(2) is None
+    assert buffer.state_at(6) is not None
+
+
+async def test_resume() -> None:
+    """Resuming after any event ends with the same messages as following the
+    stream from the start."""
+    for protocol in ("snapshot", "delta"):
+        events = [e async for e in buffer_to_sse(await _buffered(), protocol)]
+        assert events[0]["id"] == "1"
+        assert "id" not in events[-1]
+        final = None
+        for event in events[1:-1]:
+            final = _apply(final, event)
+
+        for maxlen in (100, 2):
+            buffer = await _buffered(maxlen)
+            messages = None
+            for event in events[1:-1]:
+                messages = _apply(messages, event)
+                resumed = messages
+                async for e in buffer_to_sse(buffer, protocol, int(event["id"])):
+                    if e["event"] != "end":
+                        resumed = _apply(resumed, e)
+                assert resumed == final
+
+
+async def test_slow_follower() -> None:
+    """Followers that fall behind skip superseded token updates, but not message
+    boundaries or metadata, and still end with the same messages."""
+    merged = _merged_chunks.value()
+    buffer = await _buffered()
+    assert [id async for id, _ in buffer.follow(max_backlog=2)] == [1, 2, 7]
+    assert _merged_chunks.value() == merged + 4
+    assert [id async for id, _ in buffer.follow(max_backlog=10)] == list(range(1, 8))
+
+    for protocol in ("snapshot", "delta"):
+        expected = None
+        async for event in buffer_to_sse(buffer, protocol, max_backlog=None):
+            if event["event"] not in ("metadata", "end"):
+                expected = _apply(expected, event)
+        messages = None
+        async for event in buffer_to_sse(buffer, protocol, max_backlog=2):
+            if event["event"] not in ("metadata", "end"):
+                messages = _apply(messages, event)
+        assert messages == expected
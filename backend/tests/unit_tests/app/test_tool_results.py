@@ -0,0 +1,115 @@
+"""Test caching the results of tools."""
+import asyncio
+
+import asyncpg
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tools import tool
+
+from app import tool_results
+from app.tool_results import CachedTool, cache_results
+
+calls: list[str] = []
+
+
+@tool
+async def search(query: str) -> list:
+    """Search for a query."""
+    calls.append(query)
+    await asyncio.sleep(0.05)
+    return [{"query": query}]
+
+
+def _cached_search(monkeypatch, mode: str = "memory", ttl: float = 60) -> CachedTool:
+    monkeypatch.setattr(tool_results, "TOOL_RESULT_CACHE", mode)
+    monkeypatch.setattr(tool_results, "_caches", {})
+    calls.clear()
+    return cache_results(search, ttl)
+
+
+def test_off_by_default() -> None:
+    assert cache_results(search) is search
+
+
+async def test_cache_results(monkeypatch) -> None:
+    """Calls with the same normalized input return the same result."""
+    cached = _cached_search(monkeypatch)
+    assert cached.args == search.args
+
+    assert await cached.ainvoke({"query": "Python  asyncio"}) == [
+        {"query": "Python  asyncio"}
+    ]
+    assert await cached.ainvoke(" python asyncio") == [{"query": "Python  asyncio"}]
+    assert cached.invoke({"query": "PYTHON asyncio\n"}) == [
+        {"query": "Python  asyncio"}
+    ]
+    await cached.ainvoke({"query": "python"})
+    assert calls == ["Python  asyncio", "python"]
+
+
+async def test_single_flight(monkeypatch) -> None:
+    """Concurrent identical calls call the tool once."""
+    cached = _cached_search(monkeypatch)
+    results = await asyncio.gather(*(cached.ainvoke("q") for _ in range(5)))
+    assert results == [[{"query": "q"}]] * 5
+    assert calls == ["q"]
+    assert tool_results._inflight == {}
+
+
+async def test_shared(pool: asyncpg.pool.Pool, monkeypatch) -> None:
+    """Results cached in Postgres are used by other processes until they expire."""
+    cached = _cached_search(monkeypatch, "postgres", ttl=0.2)
+    await cached.ainvoke("q")
+    # Like another process.
+    monkeypatch.setattr(tool_results, "_caches", {})
+    assert await cached.ainvoke("q") == [{"query": "q"}]
+    assert calls == ["q"]
+
+    await asyncio.sleep(0.2)
+    monkeypatch.setattr(tool_results, "_caches", {})
+    await cached.ainvoke("q")
+    assert calls == ["q", "q"]
+    async with pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM tool_result") == 1
+
+
+class _Events(BaseCallbackHandler):
+    def __init__(self) -> None:
+        self.events: list[str] = []
+
+    def on_tool_start(self, serialized, input_str, **kwargs) -> None:
+        self.events.append(f"start {serialized['name']}")
+
+    def on_tool_end(self, output, **kwargs) -> None:
+        self.events.append("end")
+
+
+async def test_callbacks(monkeypatch) -> None:
+    """Every call, including cache hits and joined calls, has its tool events."""
+    cached = _cached_search(monkeypatch)
+    handlers = [_Events() for _ in range(3)]
+    await asyncio.gather(
+        *(cached.ainvoke("q", {"callbacks": [h]}) for h in handlers[:2])
+    )
+    await cached.ainvoke("q", {"callbacks": [handlers[2]]})
+    assert calls == ["q"]
+    # The caller that started the call also traces the tool it caches.
+    assert handlers[0].events == ["start search", "start search", "end", "end"]
+    assert handlers[1].events == ["start search", "end"]
+    assert handlers[2].events == ["start search", "end"]
+
+
+def test_sync(monkeypatch) -> None:
+    monkeypatch.setattr(tool_results, "TOOL_RESULT_CACHE", "memory")
+    monkeypatch.setattr(tool_results, "_caches", {})
+    counted: list[str] = []
+
+    @tool
+    def count(query: str) -> int:
+        """Count the calls."""
+        counted.append(query)
+        return len(counted)
+
+    cached = cache_results(count)
+    assert cached.invoke("q") == 1
+    assert cached.invoke({"query": " Q"}) == 1
+    assert cached.invoke("other") == 2
@@ -0,0 +1,64 @@
+"""Test the workers executing queued runs."""
+import asyncio
+from uuid import uuid4
+
+import asyncpg
+from langchain_core.runnables import RunnableLambda
+
+from app import run_manager, storage
+from app.worker import Worker
+from tests.unit_tests.app.test_run_manager import _wait_for
+
+
+async def test_worker(pool: asyncpg.pool.Pool) -> None:
+    """Workers execute queued runs and stop when they are cancelled."""
+    inputs = []
+
+    async def invoke(input):
+        inputs.append(input)
+        if input == "hang":
+            await asyncio.sleep(60)
+
+    worker = Worker(RunnableLambda(invoke), concurrency=2)
+    task = asyncio.create_task(worker.run())
+    try:
+        config = {"configurable": {"thread_id": "t"}}
+        ok = await run_manager.enqueue("1", "t", None, "ok", config)
+        hang = await run_manager.enqueue("1", "t", None, "hang", config)
+        worker.wakeup()
+        run = await _wait_for(ok["run_id"], "succeeded")
+        assert run["worker_id"] == worker.id
+        assert run["attempts"] == 1
+        run = await _wait_for(hang["run_id"], "running")
+
+        await run_manager.cancel(hang["run_id"])
+        await _wait_for(hang["run_id"], "cancelled")
+        assert sorted(inputs) == ["hang", "ok"]
+        assert not worker._tasks
+    finally:
+        worker.stop()
+        await task
+
+
+async def test_requeue_stale_runs(pool: asyncpg.pool.Pool) -> None:
+    """Runs of workers that stopped heartbeating are requeued, then failed."""
+    run = await run_manager.enqueue("1", str(uuid4()), None, None, {})
+    run_id = run["run_id"]
+    for attempt in range(1, 3):
+        [claimed] = await storage.claim_runs("gone", 1)
+        assert claimed["attempts"] == attempt
+        assert await storage.claim_runs("other", 1) == []
+        assert await storage.requeue_stale_runs(60, 2) == 0
+        async with pool.acquire() as conn:
+            await conn.execute(
+                (
+                    "UPDATE run SET heartbeat_at = now() - interval '2 minutes' "
+                    "WHERE run_id = $1"
+                ),
+                run_id,
+            )
+        await storage.requeue_stale_runs(60, 2)
+
+    run = await storage.get_run("1", run_id)
+    assert run["status"] == "failed"
+    assert run["error"] == "WorkerLost"
@@ -22,6 +22,8 @@ export interface StreamStateProps {
 export function useStreamState(): StreamStateProps {
   const [current, setCurrent] = useState<StreamState | null>(null);
   const [controller, setController] = useState<AbortController | null>(null);
+  // The run goes on when the stream is aborted, unless cancelled.
+  const [runId, setRunId] = useState<string | null>(null);
 
   const startStream = useCallback(
     async (
@@ -33,12 +35,18 @@ export function useStreamState(): StreamStateProps {
       setController(controller);
       setCurrent({ status: "inflight", messages: input || [], merge: true });
 
-      await fetchEventSource("/runs/stream", {
+      await fetchEventSource("/runs/stream?protocol=delta", {
         signal: controller.signal,
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ input, assistant_id, thread_id }),
         openWhenHidden: true,
+        async onopen(response) {
+          if (!response.ok) {
+            throw new Error(`${response.status} ${response.statusText}`);
+          }
+          setRunId(response.headers.get("X-Run-Id"));
+        },
         onmessage(msg) {
           if (msg.event === "data") {
             const messages = JSON.parse(msg.data);
@@ -47,6 +55,26 @@ export function useStreamState(): StreamStateProps {
               messages,
               run_id: current?.run_id,
             }));
+          } else if (msg.event === "messages") {
+            const { index, messages } = JSON.parse(msg.data);
+            setCurrent((current) => ({
+              status: "inflight",
+              messages: [
+                ...(current?.messages ?? []).slice(0, index),
+                ...messages,
+              ],
+              run_id: current?.run_id,
+            }));
+          } else if (msg.event === "delta") {
+            const { index, content } = JSON.parse(msg.data);
+            setCurrent((current) => {
+              const messages = [...(current?.messages ?? [])];
+              messages[index] = {
+                ...messages[index],
+                content: (messages[index].content as string) + content,
+              };
+              return { status: "inflight", messages, run_id: current?.run_id };
+            });
           } else if (msg.event === "metadata") {
             const { run_id } = JSON.parse(msg.data);
             setCurrent((current) => ({
@@ -71,6 +99,7 @@ export function useStreamState(): StreamStateProps {
             merge: current?.merge,
           }));
           setController(null);
+          setRunId(null);
         },
         onerror(error) {
           setCurrent((current) => ({
@@ -80,6 +109,7 @@ export function useStreamState(): StreamStateProps {
             merge: current?.merge,
           }));
           setController(null);
+          setRunId(null);
           throw error;
         },
       });
@@ -91,6 +121,10 @@ export function useStreamState(): StreamStateProps {
     (clear: boolean = false) => {
       controller?.abort();
       setController(null);
+      if (runId) {
+        fetch(`/runs/${runId}/cancel`, { method: "POST" });
+        setRunId(null);
+      }
       if (clear) {
         setCurrent((current) => ({
           status: "done",
@@ -105,7 +139,7 @@ export function useStreamState(): StreamStateProps {
         }));
       }
     },
-    [controller],
+    [controller, runId],
   );
 
   return {